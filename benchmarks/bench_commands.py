@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Replays scripted command storms against the bot, offline, and reports
+wall time, discord API calls per command, event loop lag and peak memory
+
+to run (from the repository root):
+$ python -m benchmarks.bench_commands [-l LATENCY] [-s STORM [STORM ...]] [-j]
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import pathlib
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks import fake_discord
+import hpc_bot.cogs as cogs
+
+
+BOT_TEXT_CHANNEL = 'hpc-bots'
+FAKE_HOME_USERS = 50
+STORM_TIMEOUT = 300  # seconds
+STUB_SQUEUE = pathlib.Path(__file__).resolve().parent.joinpath('stub_squeue.py')
+STUB_SACCT = pathlib.Path(__file__).resolve().parent.joinpath('stub_sacct.py')
+STUB_REPQUOTA = pathlib.Path(__file__).resolve().parent.joinpath('stub_repquota.py')
+STUB_LFS = pathlib.Path(__file__).resolve().parent.joinpath('stub_lfs.py')
+SACCT_FIXTURE = pathlib.Path(__file__).resolve().parent.joinpath('fixtures', 'sacct.txt')
+
+# storm name: quota source of the home command (default is "none", answer from the index)
+STORM_HOME_QUOTA = {
+    'home-repquota': 'repquota',
+    'home-lfs': 'lfs',
+}
+# storms where the home command scans home folders, as if the home index wasn't built yet
+HOME_SCAN_STORMS = ('home-scan',)
+# storms where the job notifier then reports every job of the sacct fixture to its subscribers
+NOTIFY_STORMS = ('notify',)
+# storm name: commands sent at once, (command, private message?)
+STORMS = {
+    'test': [('test', False)] * 20,
+    'status': [('status', False)] * 20,
+    'status-dm': [('status', True)] * 20,
+    'home': [('home', False)] * 20,
+    'home-repquota': [('home', False)] * 20,
+    'home-lfs': [('home', False)] * 20,
+    'home-scan': [('home', False)] * 20,
+    'history': [('history 1h', False)] * 20,
+    'queue': [('queue', False)] * 20,
+    'top': [('top', False)] * 20,
+    'storage': [('storage', False)] * 20,
+    'notify': [('notify 4090', False), ('notify 4091', False), ('notify 4092_1', False),
+               ('notify 4093', False), ('notify me bsilva', False)] * 4,
+    'mixed': [('status', False), ('home', False), ('history 1h', False), ('test', True),
+              ('perf', False)] * 10,
+}
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up a task that sleeps 'interval' seconds
+    """
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(time.perf_counter() - start - self.interval, 0))
+
+    def start(self):
+        """starts measuring"""
+        self.lags = []
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        """stops measuring, returns (max lag, p99 lag) in seconds"""
+        self._task.cancel()
+        if not self.lags:
+            return 0, 0
+        lags = sorted(self.lags)
+        return lags[-1], lags[min(int(len(lags) * 0.99), len(lags) - 1)]
+
+
+def make_fake_home(root, users=FAKE_HOME_USERS):
+    """
+    Creates home folders with a few nested folders and files
+    """
+    for user in range(users):
+        for folder in range(5):
+            path = pathlib.Path(root, f'user{user:03d}', f'folder{folder}', 'data')
+            path.mkdir(parents=True, exist_ok=True)
+            for file_number in range(5):
+                path.joinpath(f'file{file_number}').write_bytes(b'x' * 4096 * (file_number + 1))
+
+
+async def wait_for(predicate, timeout=60, error='Bot did not get ready in time'):
+    """
+    Polls predicate() until it is true
+    """
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise TimeoutError(error)
+        await asyncio.sleep(0.01)
+
+
+async def notify_fixture_jobs(bot):
+    """
+    Rewinds job accounting so that the job notifier reports every job of the sacct fixture,
+    and waits until it notified their subscribers
+    """
+    with open(SACCT_FIXTURE) as fixture:
+        last_end = max(line.split('|')[3] for line in fixture)
+    subscriptions = bot.job_subscriptions
+    bot.job_accounting.reset(0)
+    await bot.save_job_subscriptions()  # wakes up the job notifier
+    await wait_for(lambda: subscriptions.cursor == last_end and not subscriptions.jobs,
+                   STORM_TIMEOUT, 'Job notifier did not report the fixture jobs in time')
+
+
+async def start_bot(api, cache_dir, home_dir):
+    """
+    Creates the bot, delivers READY and waits for it to be ready (background tasks started,
+    first home folder scan done)
+    """
+    bot = cogs.Bot(cogs.BotSettings(
+        nickname='hpc-bot', bot_text_channel_name=BOT_TEXT_CHANNEL,
+        cache_dir=pathlib.Path(cache_dir), squeue=str(STUB_SQUEUE), sacct=str(STUB_SACCT),
+        home_quota='none', repquota=str(STUB_REPQUOTA), lfs=str(STUB_LFS)))
+    bot.home_index.root = home_dir
+    bot.home_quota.root = home_dir
+    fake_discord.populate_state(bot, BOT_TEXT_CHANNEL)
+
+    bot.dispatch('ready')
+    await wait_for(lambda: bot.background_tasks and bot.color is not None)
+    await wait_for(lambda: bot.home_index.last_scan is not None)
+    await wait_for(lambda: bot.sampler.latest is not None)
+    return bot
+
+
+async def run_storm(bot, api, storm, message_ids, after=None):
+    """
+    Sends all commands of a storm at once and waits for all of them to finish
+    after(bot), if given, is then awaited as part of the storm
+
+    Returns
+    -------
+    dict
+        storm results
+    """
+    finished = 0
+    errors = 0
+    all_finished = asyncio.Event()
+
+    async def on_command_finished(*_):
+        nonlocal finished
+        finished += 1
+        if finished == len(storm):
+            all_finished.set()
+
+    async def on_command_error(*_):
+        nonlocal errors
+        errors += 1
+        await on_command_finished()
+
+    bot.add_listener(on_command_finished, 'on_command_completion')
+    bot.add_listener(on_command_error, 'on_command_error')
+    for cog in bot.cogs.values():
+        cog.shared_results._results.clear()  # pylint: disable=protected-access
+
+    monitor = LoopLagMonitor()
+    api.reset()
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    monitor.start()
+    start = time.perf_counter()
+
+    for command, private in storm:
+        fake_discord.user_message(bot, f'<@!{fake_discord.BOT_ID}> {command}',
+                                  next(message_ids), private=private)
+    await asyncio.wait_for(all_finished.wait(), STORM_TIMEOUT)
+    if after is not None:
+        await after(bot)
+
+    wall_time = time.perf_counter() - start
+    max_lag, p99_lag = monitor.stop()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    bot.remove_listener(on_command_finished, 'on_command_completion')
+    bot.remove_listener(on_command_error, 'on_command_error')
+
+    return {
+        'commands': len(storm),
+        'errors': errors,
+        'wall_time': wall_time,
+        'api_calls': len(api.calls),
+        'api_calls_per_command': len(api.calls) / len(storm),
+        'api_calls_by_route': {f'{method} {path}': count
+                               for (method, path), count in api.calls_by_route().items()},
+        'loop_lag_max': max_lag,
+        'loop_lag_p99': p99_lag,
+        'peak_memory': peak_memory,
+    }
+
+
+async def run_benchmarks(storm_names, latency):
+    """
+    Runs the storms, returns {storm name: results}
+    """
+    api = fake_discord.FakeDiscordAPI(latency=latency)
+    api.install()
+    results = {}
+    with tempfile.TemporaryDirectory() as cache_dir, tempfile.TemporaryDirectory() as home_dir:
+        make_fake_home(home_dir)
+        bot = await start_bot(api, cache_dir, home_dir)
+        message_ids = itertools.count(500000000000000001)
+        try:
+            for storm_name in storm_names:
+                bot.home_quota.source = STORM_HOME_QUOTA.get(storm_name, 'none')
+                last_scan = bot.home_index.last_scan
+                if storm_name in HOME_SCAN_STORMS:
+                    bot.home_index.last_scan = None
+                after = notify_fixture_jobs if storm_name in NOTIFY_STORMS else None
+                results[storm_name] = await run_storm(bot, api, STORMS[storm_name], message_ids,
+                                                      after)
+                bot.home_index.last_scan = last_scan
+                if storm_name in NOTIFY_STORMS:  # the job notifier stops polling
+                    bot.job_subscriptions.unsubscribe(fake_discord.USER_ID)
+                    await bot.save_job_subscriptions()
+        finally:
+            await bot.close()
+            api.uninstall()
+            # pending delayed deletes of feedback messages
+            for task in asyncio.all_tasks():
+                if task is not asyncio.current_task():
+                    task.cancel()
+    return results
+
+
+def print_results(results):
+    """
+    Prints results as a table
+    """
+    header = f'{"storm":<13} {"cmds":>5} {"errors":>6} {"wall (s)":>9} {"api/cmd":>8} ' \
+             f'{"lag max (ms)":>13} {"lag p99 (ms)":>13} {"peak mem (KiB)":>15}'
+    print(header)
+    print('-' * len(header))
+    for storm_name, result in results.items():
+        print(f'{storm_name:<13} {result["commands"]:>5} {result["errors"]:>6} '
+              f'{result["wall_time"]:>9.3f} '
+              f'{result["api_calls_per_command"]:>8.2f} {result["loop_lag_max"] * 1000:>13.1f} '
+              f'{result["loop_lag_p99"] * 1000:>13.1f} {result["peak_memory"] / 1024:>15.0f}')
+
+
+def main():
+    """
+    Parses arguments and runs the benchmarks
+    """
+    cli = argparse.ArgumentParser(description='Offline hpc-bot command benchmarks')
+    cli.add_argument('-l',
+                     dest='latency',
+                     help='Simulated discord API latency, in seconds. Default is 0.05',
+                     type=float,
+                     default=0.05)
+    cli.add_argument('-s',
+                     dest='storms',
+                     help=f'Storms to run. Default is all: {" ".join(STORMS)}',
+                     nargs='+',
+                     choices=list(STORMS),
+                     default=list(STORMS))
+    cli.add_argument('-j',
+                     dest='json',
+                     help='Print results as JSON',
+                     action='store_true')
+    cli.add_argument('-v',
+                     dest='verbose',
+                     help='Show bot logs',
+                     action='store_true')
+    cli_parsed = cli.parse_args()
+
+    if cli_parsed.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    tracemalloc.start()
+    results = asyncio.run(run_benchmarks(cli_parsed.storms, cli_parsed.latency))
+    if cli_parsed.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+
+
+if __name__ == '__main__':
+    main()
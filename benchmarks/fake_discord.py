@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+In-process stand-ins for the discord.py HTTP and gateway layers
+
+FakeDiscordAPI replaces discord.http.HTTPClient.request (every REST call: send, edit,
+delete, typing, ...) and get_from_cdn (avatar downloads), answers them with plausible
+payloads after an optional simulated latency and records every call.
+FakeGateway replaces the websocket, and populate_state() fills the bot's connection state
+with what the gateway would have sent on READY / GUILD_CREATE.
+"""
+
+import asyncio
+import datetime
+import itertools
+import json
+import time
+from io import BytesIO
+import discord
+from discord.http import HTTPClient
+from PIL import Image
+
+
+BOT_ID = 100000000000000001
+USER_ID = 100000000000000002
+GUILD_ID = 200000000000000001
+BOT_TEXT_CHANNEL_ID = 300000000000000001
+GENERAL_CHANNEL_ID = 300000000000000002
+DM_CHANNEL_ID = 300000000000000003
+ALL_PERMISSIONS = 0x7FFFFFFF
+
+
+def user_payload(user_id, name, bot=False):
+    """discord user object"""
+    return {'id': str(user_id), 'username': name, 'discriminator': '0001', 'avatar': None,
+            'bot': bot}
+
+
+def member_payload(user_id, name, bot=False, nick=None):
+    """discord guild member object"""
+    return {'user': user_payload(user_id, name, bot), 'roles': [], 'nick': nick,
+            'joined_at': datetime.datetime.utcnow().isoformat(), 'deaf': False, 'mute': False}
+
+
+def text_channel_payload(channel_id, name, position):
+    """discord guild text channel object"""
+    return {'id': str(channel_id), 'type': 0, 'name': name, 'position': position,
+            'guild_id': str(GUILD_ID), 'permission_overwrites': [], 'nsfw': False,
+            'topic': None, 'last_message_id': None, 'parent_id': None}
+
+
+def guild_payload(bot_text_channel_name, extra_channels=0):
+    """discord guild object, as sent by GUILD_CREATE"""
+    channels = [text_channel_payload(BOT_TEXT_CHANNEL_ID, bot_text_channel_name, 0),
+                text_channel_payload(GENERAL_CHANNEL_ID, 'general', 1)]
+    channels += [text_channel_payload(GENERAL_CHANNEL_ID + 10 + index, f'channel-{index}',
+                                      2 + index)
+                 for index in range(extra_channels)]
+    return {
+        'id': str(GUILD_ID), 'name': 'benchmark', 'owner_id': str(USER_ID),
+        'member_count': 2, 'region': 'europe', 'verification_level': 0,
+        'default_message_notifications': 0,
+        'roles': [{'id': str(GUILD_ID), 'name': '@everyone', 'permissions': ALL_PERMISSIONS,
+                   'position': 0, 'color': 0, 'hoist': False, 'managed': False,
+                   'mentionable': False}],
+        'members': [member_payload(BOT_ID, 'hpc-bot', bot=True),
+                    member_payload(USER_ID, 'user')],
+        'channels': channels,
+    }
+
+
+class FakeGateway:
+    """
+    Stand-in for discord.gateway.DiscordWebSocket, records presence changes
+    """
+    def __init__(self):
+        self.presences = []
+        self.open = False  # Client.close() only closes open websockets
+
+    async def change_presence(self, *, activity=None, status=None, afk=False, since=0.0):
+        """records the new presence"""
+        self.presences.append((activity, status, afk, since))
+
+    async def close(self, code=1000):
+        """nothing to close"""
+
+
+class FakeDiscordAPI:
+    """
+    Stand-in for the discord REST API
+
+    Parameters
+    ----------
+    latency: float
+        seconds each request takes
+    """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = []  # (monotonic time, method, route path)
+        self.messages = {}  # message id: last payload
+        self._ids = itertools.count(400000000000000001)
+        self._original = None
+
+        avatar = BytesIO()
+        Image.new('RGB', (64, 64), (88, 101, 242)).save(avatar, format='PNG')
+        self.avatar = avatar.getvalue()
+
+    def install(self):
+        """
+        Patches discord.py's HTTPClient so that requests are answered by this object
+        """
+        api = self
+        self._original = (HTTPClient.request, HTTPClient.get_from_cdn)
+
+        async def request(http, route, *, files=None, **kwargs):  # pylint: disable=unused-argument
+            return await api.request(route, **kwargs)
+
+        async def get_from_cdn(http, url):  # pylint: disable=unused-argument
+            api.calls.append((time.monotonic(), 'GET', 'cdn'))
+            return api.avatar
+
+        HTTPClient.request = request
+        HTTPClient.get_from_cdn = get_from_cdn
+
+    def uninstall(self):
+        """
+        Restores discord.py's HTTPClient
+        """
+        HTTPClient.request, HTTPClient.get_from_cdn = self._original
+
+    def reset(self):
+        """
+        Forgets recorded calls
+        """
+        self.calls = []
+
+    @staticmethod
+    def message_payload(channel_id, message_id, body):
+        """discord message object, sent by the bot"""
+        return {
+            'id': str(message_id), 'channel_id': str(channel_id),
+            'author': user_payload(BOT_ID, 'hpc-bot', bot=True),
+            'content': body.get('content') or '',
+            'embeds': [body['embed']] if body.get('embed') else [],
+            'attachments': [], 'mentions': [], 'mention_roles': [], 'pinned': False,
+            'mention_everyone': False, 'tts': False, 'type': 0,
+            'timestamp': datetime.datetime.utcnow().isoformat(), 'edited_timestamp': None,
+        }
+
+    async def request(self, route, **kwargs):
+        """
+        Answers a REST request
+        """
+        self.calls.append((time.monotonic(), route.method, route.path))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        body = kwargs.get('json') or {}
+        if 'form' in kwargs:  # message with files
+            for field in kwargs['form']:
+                if field['name'] == 'payload_json':
+                    body = json.loads(field['value'])
+
+        key = (route.method, route.path)
+        if key == ('POST', '/channels/{channel_id}/messages'):
+            message_id = next(self._ids)
+            payload = self.message_payload(route.channel_id, message_id, body)
+            self.messages[message_id] = payload
+            return payload
+        if key == ('PATCH', '/channels/{channel_id}/messages/{message_id}'):
+            message_id = int(route.url.rsplit('/', 1)[1])
+            payload = dict(self.messages.get(message_id) or
+                           self.message_payload(route.channel_id, message_id, {}))
+            if 'embed' in body:
+                payload['embeds'] = [body['embed']] if body['embed'] else []
+            payload['edited_timestamp'] = datetime.datetime.utcnow().isoformat()
+            self.messages[message_id] = payload
+            return payload
+        if key == ('POST', '/users/@me/channels'):
+            return {'id': str(DM_CHANNEL_ID), 'type': 1,
+                    'recipients': [user_payload(body.get('recipient_id', USER_ID), 'user')]}
+        return None
+
+    def calls_by_route(self):
+        """
+        Number of recorded calls of each (method, route)
+        """
+        counts = {}
+        for _, method, path in self.calls:
+            counts[(method, path)] = counts.get((method, path), 0) + 1
+        return counts
+
+
+def populate_state(bot, bot_text_channel_name, extra_channels=0):
+    """
+    Fills the bot connection state as if the gateway had sent READY and GUILD_CREATE
+    and replaces the websocket with a FakeGateway
+
+    Returns
+    -------
+    discord.Guild
+    """
+    state = bot._connection  # pylint: disable=protected-access
+    state.user = discord.ClientUser(state=state, data=user_payload(BOT_ID, 'hpc-bot', bot=True))
+    guild = state._add_guild_from_data(  # pylint: disable=protected-access
+        guild_payload(bot_text_channel_name, extra_channels))
+    bot.ws = FakeGateway()
+    return guild
+
+
+def user_message(bot, content, message_id, private=False):
+    """
+    Makes the gateway deliver a MESSAGE_CREATE from the benchmark user
+    """
+    payload = {
+        'id': str(message_id), 'author': user_payload(USER_ID, 'user'),
+        'content': content, 'embeds': [], 'attachments': [], 'mentions': [],
+        'mention_roles': [], 'pinned': False, 'mention_everyone': False, 'tts': False,
+        'type': 0, 'timestamp': datetime.datetime.utcnow().isoformat(),
+        'edited_timestamp': None,
+    }
+    if private:
+        payload['channel_id'] = str(DM_CHANNEL_ID)
+        state = bot._connection  # pylint: disable=protected-access
+        if state._get_private_channel(DM_CHANNEL_ID) is None:  # pylint: disable=protected-access
+            state.add_dm_channel({'id': str(DM_CHANNEL_ID), 'type': 1,
+                                  'recipients': [user_payload(USER_ID, 'user')]})
+    else:
+        payload['channel_id'] = str(GENERAL_CHANNEL_ID)
+        payload['guild_id'] = str(GUILD_ID)
+        payload['member'] = {key: value for key, value in member_payload(USER_ID, 'user').items()
+                             if key != 'user'}
+    bot._connection.parse_message_create(payload)  # pylint: disable=protected-access
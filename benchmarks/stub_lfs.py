@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Stand-in for Lustre's 'lfs quota -q -u USER PATH': prints the usage of USER found in
+the repquota fixture (benchmarks/fixtures/repquota.txt, or the file in the REPQUOTA_FIXTURE
+environment variable), in the format of lfs quota
+"""
+
+import argparse
+import os
+import sys
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'repquota.txt')
+
+
+if __name__ == '__main__':
+    cli = argparse.ArgumentParser()
+    cli.add_argument('subcommand', choices=('quota',))
+    cli.add_argument('-q', action='store_true')
+    cli.add_argument('-u', dest='user', required=True)
+    cli.add_argument('path')
+    arguments = cli.parse_args()
+
+    with open(os.environ.get('REPQUOTA_FIXTURE', FIXTURE)) as fixture:
+        for line in fixture:
+            fields = line.split()
+            if len(fields) > 2 and fields[0] == arguments.user and fields[1] in ('--', '+-'):
+                used = fields[2] + ('*' if fields[1][0] == '+' else '')
+                print(f'{arguments.path:>15} {used:>9} 4000000 5000000 - {fields[-4]:>6} 0 0 -')
+                sys.exit(0)
+    print(f'{arguments.path:>15} {0:>9} 0 0 - 0 0 0 -')
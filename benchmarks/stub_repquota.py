@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Stand-in for repquota: prints fixture output, ignoring all arguments
+
+The fixture is benchmarks/fixtures/repquota.txt, or the file in the REPQUOTA_FIXTURE
+environment variable, in the format of 'repquota -u -p'
+"""
+
+import os
+import sys
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'repquota.txt')
+
+
+if __name__ == '__main__':
+    with open(os.environ.get('REPQUOTA_FIXTURE', FIXTURE)) as fixture:
+        sys.stdout.write(fixture.read())
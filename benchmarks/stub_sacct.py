@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Stand-in for SLURM's sacct: prints the fixture lines of jobs that ended at or after
+--starttime, ignoring all other arguments
+
+The fixture is benchmarks/fixtures/sacct.txt, or the file in the SACCT_FIXTURE
+environment variable, in the format the notify command asks sacct for
+(see hpc_bot.probes.slurm.SACCT_FORMAT)
+"""
+
+import os
+import sys
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'sacct.txt')
+END_FIELD = 3
+
+
+def print_jobs(arguments):
+    """
+    Prints the fixture lines of jobs that ended at or after the --starttime in arguments
+    """
+    start_time = ''
+    for argument in arguments:
+        if argument.startswith('--starttime='):
+            start_time = argument.split('=', 1)[1]
+
+    with open(os.environ.get('SACCT_FIXTURE', FIXTURE)) as fixture:
+        for line in fixture:
+            if line.split('|')[END_FIELD] >= start_time:
+                sys.stdout.write(line)
+
+
+if __name__ == '__main__':
+    print_jobs(sys.argv[1:])
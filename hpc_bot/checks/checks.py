@@ -28,7 +28,7 @@ import discord
 ##################
 
 
-async def info_message(ctx, user, channel, what):
+async def info_message(ctx, user, channel_name, what):
     """
     Sends info message to channel where command originated if bot has permission to do it
     """
@@ -36,10 +36,10 @@ async def info_message(ctx, user, channel, what):
 
         # send info message
         if what == 'no_channel':
-            await ctx.send(f"Error: Channel `{channel.name}` doesn't exist. Please create it.")
+            await ctx.send(f"Error: Channel `{channel_name}` doesn't exist. Please create it.")
         elif what == 'no_permission':
             await ctx.send("Error: Can't send messages to channel "
-                           f'`{channel.name}`. Check bot permissions.')
+                           f'`{channel_name}`. Check bot permissions.')
 
 
 ########
@@ -70,26 +70,25 @@ def can_write_to_bot_text_channel():
         if isinstance(ctx.channel, (discord.DMChannel, discord.GroupChannel)):
             return True
 
-        channel = ctx.bot.bot_text_channel  # discord.TextChannel or None
         guild = ctx.guild
+        channel = ctx.bot.get_bot_text_channel(guild)  # discord.TextChannel or None
+        channel_name = ctx.bot.bot_text_channel_name
         me = guild.me if guild is not None else ctx.bot.user
 
         # Bot doesn't recognize the bot text channel (deleted or didn't ever exist)
         if not channel:
-            await info_message(ctx, me, channel, 'no_channel')
+            await info_message(ctx, me, channel_name, 'no_channel')
             return False
 
         # if, for some reason, the bot couldn't find out for himself that the bot channel
-        # doesn't exist or was deleted, this is a redundant check
-        channel_found = discord.utils.get(guild.text_channels, name=channel.name)
-        if not channel_found:
-            await info_message(ctx, me, channel, 'no_channel')
+        # doesn't exist or was deleted, this is a redundant check (dict lookup by id)
+        if guild.get_channel(channel.id) is None:
+            await info_message(ctx, me, channel_name, 'no_channel')
             return False
 
-        permissions = channel.permissions_for(me)
-        permission = getattr(permissions, 'send_messages')
-        if not permission:
-            await info_message(ctx, me, channel, 'no_permission')
+        # cached, kept current from channel, role and member events
+        if not ctx.bot.can_send_to_bot_text_channel(guild):
+            await info_message(ctx, me, channel_name, 'no_permission')
             return False
 
         return True
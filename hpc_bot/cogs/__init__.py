@@ -21,5 +21,7 @@ Cogs - Groups of commands
 """
 
 from .bot import *
+from .command_cog import *
 from .commands import *
+from .resources import *
 from .help import *
@@ -20,8 +20,12 @@
 Bot Cog - bot class
 """
 
+import asyncio
+import json
 import logging
+import pathlib
 import sys
+from dataclasses import dataclass, field
 from io import BytesIO
 import discord
 from discord.ext import commands
@@ -29,37 +33,177 @@ from PIL import Image
 
 try:
     import cogs
+    import federation
+    import probes
+    import utils
 except ImportError:
     import hpc_bot.cogs as cogs
+    import hpc_bot.federation as federation
+    import hpc_bot.probes as probes
+    import hpc_bot.utils as utils
 
 
-class Bot(commands.Bot):
+AVATAR_THUMBNAIL_SIZE = (64, 64)
+
+
+@dataclass
+class GuildState:
+    """
+    Bot state on a single discord server
+
+    Text channels are indexed by name, and whether the bot can send messages to the bot text
+    channel is cached, both kept current from channel, role and member events
+    """
+    bot_text_channel: discord.TextChannel = None
+    text_channels: dict = field(default_factory=dict)  # name: {channel id: discord.TextChannel}
+    can_send: bool = None  # None if unknown (not computed yet or invalidated)
+
+    def index_channels(self, guild):
+        """
+        (Re)builds the text channel index of a discord server
+        """
+        self.text_channels = {}
+        for channel in guild.text_channels:
+            self.add_channel(channel)
+
+    def add_channel(self, channel):
+        """
+        Adds text channel to index
+        """
+        self.text_channels.setdefault(channel.name, {})[channel.id] = channel
+
+    def remove_channel(self, channel, name=None):
+        """
+        Removes text channel from index (name is the channel name when it was indexed)
+        """
+        name = channel.name if name is None else name
+        channels = self.text_channels.get(name)
+        if channels:
+            channels.pop(channel.id, None)
+            if not channels:
+                del self.text_channels[name]
+
+    def find_channel(self, name):
+        """
+        Returns text channel with given name (topmost one, same as in the discord client),
+        None if there isn't one
+        """
+        channels = self.text_channels.get(name)
+        if not channels:
+            return None
+        return min(channels.values(), key=lambda channel: (channel.position, channel.id))
+
+
+@dataclass
+class BotSettings:
+    """
+    Bot parameters (see the command line arguments of hpc_bot.py)
+    """
+    nickname: str
+    avatar_path: pathlib.Path = None
+    bot_text_channel_name: str = 'hpc-bots'
+    prefix: str = None
+    cache_dir: pathlib.Path = pathlib.Path('~/.cache/hpc_bot').expanduser()
+    edit_interval: float = 2.0
+    result_ttl: float = 10.0
+    sample_interval: float = probes.SAMPLE_INTERVAL
+    metrics_address: str = None
+    agents: list = None
+    squeue: str = probes.SQUEUE_COMMAND
+    sacct: str = probes.SACCT_COMMAND
+    alerts: list = field(default_factory=list)  # utils.AlertRule
+    top_rows: int = utils.TOP_ROWS
+    home_quota: str = 'auto'
+    repquota: str = probes.REPQUOTA_COMMAND
+    lfs: str = probes.LFS_COMMAND
+    du_cmd: str = probes.DU_COMMAND
+
+
+# discord.py calls event handlers (on_*) by name, and cogs use the other methods
+class Bot(commands.Bot):  # pylint: disable=too-many-public-methods
     """
     hpc-bot main bot class
+
+    Parameters
+    ----------
+    settings: BotSettings
+        bot parameters
+    kwargs:
+        passed to discord.ext.commands.Bot
     """
-    def __init__(self, nickname, avatar_path, bot_text_channel_name, prefix, *args, **kwargs):
-        if prefix:
-            command_prefix = commands.when_mentioned_or(prefix)
+    def __init__(self, settings, **kwargs):
+        if settings.prefix:
+            command_prefix = commands.when_mentioned_or(settings.prefix)
         else:
             command_prefix = commands.when_mentioned
-        super().__init__(command_prefix=command_prefix, *args, **kwargs)
+        super().__init__(command_prefix=command_prefix, **kwargs)
 
         # logger
         self.logger = logging.getLogger('hpc-bot.Bot')
 
+        # read by cogs when they are created
+        self.edit_interval = settings.edit_interval
+        self.result_ttl = settings.result_ttl
+        self.top_rows = settings.top_rows
+
+        # background tasks
+        cache_dir = settings.cache_dir
+        self.home_index = probes.HomeIndex(cache_dir.joinpath('home_index.json'),
+                                           du_cmd=settings.du_cmd)
+        self.mount_table = probes.MountTable()
+        self.sampler = probes.MetricsSampler(settings.sample_interval,
+                                             mount_table=self.mount_table)
+        self.shell_workers = probes.ShellWorkerPool()
+        self.job_queue = probes.JobQueue(settings.squeue)
+        self.process_scanner = probes.ProcessScanner()
+        self.home_quota = probes.HomeQuota(settings.home_quota, settings.repquota, settings.lfs)
+
+        # alerts, evaluated on each sample
+        self.alert_engine = utils.AlertEngine(settings.alerts)
+        self.sampler.mounts = self.alert_engine.mounts
+        self.sampler.listeners.append(self.check_alerts)
+        self.job_accounting = probes.JobAccounting(settings.sacct)
+        self.job_subscriptions = utils.JobSubscriptions(
+            cache_dir.joinpath('job_subscriptions.json'))
+        self._subscriptions_changed = None  # asyncio.Event, created inside the running loop
+        self.background_tasks = []
+
+        # hub mode: agents serving the probes of other hosts
+        self.hub = federation.Hub(settings.agents) if settings.agents else None
+
+        # every message sent, edited or deleted goes through the outbox, which follows the rate
+        # limits discord.py reports (bucket exhaustion is only logged at debug level)
+        self.outbox = utils.Outbox()
+        http_logger = logging.getLogger('discord.http')
+        http_logger.setLevel(logging.DEBUG)
+        http_logger.addHandler(utils.RateLimitListener(self.outbox))
+        if not utils.RateLimitListener.supported():
+            self.logger.warning('This discord.py version does not report rate limits as '
+                                'expected: messages are only held back by discord.py itself')
+
+        # prometheus metrics
+        self.metrics = utils.MetricsRegistry()
+        self.setup_metrics()
+        self.command_latency = utils.LatencyRecorder()
+        self.metrics_exporter = None
+        if settings.metrics_address:
+            self.metrics_exporter = utils.MetricsExporter(self.metrics, settings.metrics_address)
+
         # cogs/commands
         self.add_cog(cogs.Commands(self))
+        self.add_cog(cogs.Resources(self))
         self.help_command = cogs.Help()
         self.help_command.cog = self.cogs['Commands']
 
         # bot variables
-        self.nickname = nickname
-        self.avatar_path = avatar_path
-        self.bot_text_channel_name = bot_text_channel_name
-        self.bot_text_channel = None
-        self.prefix = prefix
+        self.nickname = settings.nickname
+        self.avatar_path = settings.avatar_path
+        self.bot_text_channel_name = settings.bot_text_channel_name
+        self.guild_states = {}  # guild id: GuildState
+        self.prefix = settings.prefix
         self.avatar_hash = None
         self.color = None
+        self.color_cache_file = cache_dir.joinpath('avatar_colors.json')
 
     ########
     # EVENTS
@@ -69,97 +213,78 @@ class Bot(commands.Bot):
         """
         Called when bot finished initializing
         """
-        # check how many discord servers this bot is connected to (1 max)
-        if len(self.guilds) > 1:
-            self.logger.error('Bot can only be active on a single discord server')
-            await self.close()
-
-        # 0 or 1 discord server
-        else:
-            if len(self.guilds) == 1:
-                guild = self.bot_guild
-
-                # set nickname
-                if guild.me.nick != self.nickname:
-                    self.logger.info(f'Setting nickname from "{guild.me.nick}"'
-                                     f' to "{self.nickname}"')
-                    await guild.me.edit(nick=self.nickname, reason='Setting up bot nickname')
-
-                # check if bot-specific text channel exists
-                self.bot_text_channel = self.retrieve_bot_text_channel(guild)
-                if not self.bot_text_channel:
-                    self.logger.warning(
-                        f'No text channel named "{self.bot_text_channel_name}" exists on the'
-                        f' "{guild}" discord server. No messages will be sent by the bot until'
-                        ' this channel exists')
-
-                # presence 'Type help'
-                self.logger.info('Setting bot presence')
-                await self.change_bot_presence(guild)
-
-            # bot avatar
-            if self.avatar_path:  # if image path was defined
-                with open(self.avatar_path, 'rb') as avatar_image:
-                    self.logger.info(f'Setting avatar to "{self.avatar_path}"')
-                    await self.user.edit(avatar=avatar_image.read())
-                avatar = self.avatar_path
-            else:  # fetch avatar image if no local image path was defined
-                avatar = await self.user.avatar_url_as(format='png').read()
-                avatar = BytesIO(avatar)
-
-            # bot color (based on avatar color)
-            self.logger.info('Setting bot color')
-            self.color = self.update_color(avatar)
-            self.avatar_hash = self.user.avatar
-
-            self.logger.info(f'Guild: {self.bot_guild}')
-            self.logger.info(f'Text channel: {self.bot_text_channel}')
-            self.logger.info(f'Logged in as: {self.user.name}, id: {self.user.id}')
-            self.logger.info('Bot is ready')
+        # each discord server has its own state (text channel, channel index, permissions)
+        # an error on one of them doesn't stop the others, nor the bot, from starting
+        guilds = list(self.guilds)
+        results = await asyncio.gather(*(self.setup_guild(guild) for guild in guilds),
+                                       return_exceptions=True)
+        for guild, result in zip(guilds, results):
+            if isinstance(result, Exception):
+                self.logger.error(f'Could not set up guild "{guild}": {result!r}')
+
+        # presence 'Type help' (the same on every discord server)
+        self.logger.info('Setting bot presence')
+        await self.change_bot_presence()
+
+        # bot avatar
+        if self.avatar_path:  # if image path was defined
+            with open(self.avatar_path, 'rb') as avatar_image:
+                self.logger.info(f'Setting avatar to "{self.avatar_path}"')
+                await self.user.edit(avatar=avatar_image.read())
+            avatar = self.avatar_path
+        else:  # avatar image is only fetched if its color isn't cached
+            avatar = None
+
+        # bot color (based on avatar color)
+        self.logger.info('Setting bot color')
+        self.avatar_hash = self.user.avatar
+        self.color = await self.load_color(avatar)
+
+        self.start_background_tasks()
+
+        for guild_id, guild_state in self.guild_states.items():
+            self.logger.info(f'Guild: {self.get_guild(guild_id)}, '
+                             f'text channel: {guild_state.bot_text_channel}')
+        self.logger.info(f'Logged in as: {self.user.name}, id: {self.user.id}')
+        self.logger.info('Bot is ready')
 
     async def on_guild_join(self, guild):
         """
         Called when joining a guild
         """
         self.logger.info(f'Joining guild: {guild.name}')
-        # leave additional discord servers (1 max)
-        if len(self.guilds) > 1:
-            self.logger.error('Bot cannot join additional discord servers')
-            self.logger.warning(f'Leaving guild: {guild.name}')
-            await guild.leave()
-
-        else:
-            # set nickname when joining guild
-            self.logger.info(f'Setting nickname to: {self.nickname}')
-            await guild.me.edit(nick=self.nickname, reason='Setting up bot nickname')
+        await self.setup_guild(guild)
+        await self.change_bot_presence()
 
-            # presence 'Type help'
-            await self.change_bot_presence(guild)
-
-            # check if bot-specific text channel exists
-            self.bot_text_channel = self.retrieve_bot_text_channel(guild)
-            if not self.bot_text_channel:
-                self.logger.warning(
-                    f'No text channel named "{self.bot_text_channel_name}" exists on the "{guild}" '
-                    'discord server. No messages will be sent by the bot until this channel exists')
+    async def on_guild_remove(self, guild):
+        """
+        Called when leaving a guild (or being removed from it)
+        """
+        self.logger.info(f'Left guild: {guild.name}')
+        self.guild_states.pop(guild.id, None)
 
     async def on_guild_channel_delete(self, channel):
         """
         Called when a channel is deleted
         """
+        guild_state = self.guild_states.get(channel.guild.id)
+        if not guild_state or not isinstance(channel, discord.TextChannel):
+            return
+        guild_state.remove_channel(channel)
+
         # if bot text channel is deleted
-        if channel == self.bot_text_channel:
-            self.logger.warning(f'Bot text channel "{self.bot_text_channel}" '
-                                f'(id: {self.bot_text_channel.id}) was deleted.')
+        if channel == guild_state.bot_text_channel:
+            self.logger.warning(f'Bot text channel "{channel}" (id: {channel.id}) '
+                                f'of guild "{channel.guild}" was deleted.')
 
             # check if there is another text channel with the defined bot text channel name
-            self.bot_text_channel = self.retrieve_bot_text_channel(channel.guild)
+            self.update_bot_text_channel(channel.guild)
 
             # there is
-            if self.bot_text_channel:
+            if guild_state.bot_text_channel:
                 self.logger.info(
                     'Found another text channel that matches bot text channel definition: '
-                    f'"{self.bot_text_channel}" (id: {self.bot_text_channel.id})')
+                    f'"{guild_state.bot_text_channel}" (id: {guild_state.bot_text_channel.id})')
             # there isn't
             else:
                 self.logger.warning(
@@ -169,12 +294,77 @@ class Bot(commands.Bot):
         """
         Called when a server channel is created
         """
+        guild_state = self.guild_states.get(channel.guild.id)
+        if not guild_state or not isinstance(channel, discord.TextChannel):
+            return
+        guild_state.add_channel(channel)
+
         # if bot text channel doesn't exist yet
-        if not self.bot_text_channel \
-                and isinstance(channel, discord.TextChannel) \
-                and channel.name == self.bot_text_channel_name:
+        if not guild_state.bot_text_channel and channel.name == self.bot_text_channel_name:
             self.logger.info('Newly created text channel matches bot text channel definition.')
-            self.bot_text_channel = channel
+            self.update_bot_text_channel(channel.guild)
+
+    async def on_guild_channel_update(self, before, after):
+        """
+        Called when a server channel is updated (name, position, permission overwrites, ...)
+        """
+        guild_state = self.guild_states.get(after.guild.id)
+        if not guild_state:
+            return
+
+        # channel (or category) overwrites may have changed bot permissions
+        guild_state.can_send = None
+
+        if isinstance(after, discord.TextChannel) and before.name != after.name:
+            guild_state.remove_channel(after, name=before.name)
+            guild_state.add_channel(after)
+            if self.bot_text_channel_name in (before.name, after.name):
+                self.update_bot_text_channel(after.guild)
+
+    async def on_guild_role_create(self, role):
+        """
+        Called when a server role is created
+        """
+        self.invalidate_permissions(role.guild)
+
+    async def on_guild_role_delete(self, role):
+        """
+        Called when a server role is deleted
+        """
+        self.invalidate_permissions(role.guild)
+
+    async def on_guild_role_update(self, before, after):
+        """
+        Called when a server role is updated
+        """
+        self.invalidate_permissions(after.guild)
+
+    async def on_member_update(self, before, after):
+        """
+        Called when a server member is updated (only bot role changes matter)
+        """
+        if after.id == self.user.id and before.roles != after.roles:
+            self.invalidate_permissions(after.guild)
+
+    async def on_guild_update(self, before, after):
+        """
+        Called when a server is updated (owner change affects permissions)
+        """
+        self.invalidate_permissions(after)
+
+    async def close(self):
+        """
+        Stops background tasks and shell workers before logging out
+        """
+        for task in self.background_tasks:
+            task.cancel()
+        await self.shell_workers.stop()
+        self.mount_table.close()
+        if self.hub:
+            self.hub.close()
+        if self.metrics_exporter:
+            await self.metrics_exporter.stop()
+        await super().close()
 
     async def on_error(self, event, *args, **kwargs):
         """
@@ -217,25 +407,274 @@ class Bot(commands.Bot):
             exc = commands.errors.CommandNotFound(f'Command "{ctx.invoked_with}" was not found')
             self.dispatch('command_error', ctx, exc)
 
+    def start_background_tasks(self):
+        """
+        Starts background tasks, once (on_ready can be called again after reconnecting)
+        """
+        if self.background_tasks:
+            return
+        self.logger.info('Starting background tasks')
+        self.background_tasks.append(self.loop.create_task(self.shell_workers.start()))
+        self.background_tasks.append(self.loop.create_task(self.home_index.run(self.loop)))
+        self.background_tasks.append(self.loop.create_task(self.sampler.run(self.loop)))
+        self.background_tasks.append(self.loop.create_task(self.run_job_notifier()))
+        if self.metrics_exporter:
+            self.background_tasks.append(self.loop.create_task(self.metrics_exporter.start()))
+
+    async def run_job_notifier(self):
+        """
+        Background task. While there are subscriptions, polls job accounting every
+        ACCOUNTING_INTERVAL seconds and sends a private message to the subscribers of each
+        finished job
+        """
+        subscriptions = self.job_subscriptions
+        self._subscriptions_changed = asyncio.Event()
+        await self.loop.run_in_executor(None, subscriptions.load)
+        self.job_accounting.cursor = subscriptions.cursor
+        self.job_accounting.seen = set(subscriptions.seen)
+
+        while True:
+            # no subscriptions, no polling
+            if not subscriptions:
+                self.job_accounting.cursor = None
+                await self._subscriptions_changed.wait()
+                self._subscriptions_changed.clear()
+                continue
+
+            # the queue is read before accounting, so arrays missing from it have every task
+            # reported by this poll
+            queued_job_ids = await self.queued_array_job_ids() if subscriptions.arrays else None
+            try:
+                jobs = await self.job_accounting.poll(self.shell_workers)
+            except (OSError, probes.ShellWorkerError) as error:
+                self.logger.error(f'Could not poll job accounting: {error}')
+                jobs = []
+
+            for job in jobs:
+                subscribers = subscriptions.pop_subscribers(job)
+                if subscribers:
+                    embed = await self.finished_job_embed(job)
+                    await asyncio.gather(*(self.notify_subscriber(subscriber, embed)
+                                           for subscriber in subscribers))
+            arrays = []
+            if queued_job_ids is not None:
+                arrays = subscriptions.pop_finished_arrays(queued_job_ids)
+            for array_job_id, states, subscribers in arrays:
+                embed = await self.finished_array_embed(array_job_id, states)
+                await asyncio.gather(*(self.notify_subscriber(subscriber, embed)
+                                       for subscriber in subscribers))
+            if jobs or arrays or subscriptions.cursor != self.job_accounting.cursor:
+                await self.save_job_subscriptions()
+
+            try:
+                await asyncio.wait_for(self._subscriptions_changed.wait(),
+                                       probes.ACCOUNTING_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._subscriptions_changed.clear()
+
+    async def queued_array_job_ids(self):
+        """
+        Array job ids (without task ids) of every job in the queue
+
+        Returns
+        -------
+        set or None
+            None if squeue failed
+        """
+        try:
+            returncode, stderr = await self.job_queue.refresh(self.shell_workers)
+        except probes.ShellWorkerError as error:
+            returncode, stderr = None, error
+        if returncode != 0:
+            self.logger.error(f'Could not read the job queue: {stderr}')
+            return None
+        return {probes.base_job_id(job_id) for job_id in self.job_queue.jobs}
+
+    def check_alerts(self, snapshot, mounts):
+        """
+        Sample listener. Evaluates alert rules and posts the ones that fired or were resolved
+        """
+        events = self.alert_engine.evaluate(snapshot, mounts)
+        if events:
+            self.loop.create_task(self.post_alerts(events))
+
+    async def post_alerts(self, events):
+        """
+        Posts alert events to the bot text channel of every discord server
+        """
+        guilds = [self.get_guild(guild_id) for guild_id, guild_state in self.guild_states.items()
+                  if guild_state.bot_text_channel is not None]
+        guilds = [guild for guild in guilds
+                  if guild is not None and self.can_send_to_bot_text_channel(guild)]
+        for rule, fired, value in events:
+            unit = '' if rule.metric == 'load' else '%'
+            if fired:
+                self.logger.warning(f'Alert {rule.name} fired: {value:.1f}{unit}')
+                title = f'🚨 {rule.name} at {value:.1f}{unit} (alert at {rule.above:g}{unit})'
+                color = discord.Color.red()
+            else:
+                self.logger.info(f'Alert {rule.name} resolved: {value:.1f}{unit}')
+                title = (f'✅ {rule.name} back to {value:.1f}{unit} '
+                         f'(resolved at {rule.clear:g}{unit})')
+                color = discord.Color.green()
+            embed = discord.Embed(title=title, color=color).set_footer(
+                text=f'🖥️ {self.nickname} • alert')
+            sends = [self.send_message(guild, embed=embed) for guild in guilds]
+            results = await asyncio.gather(*sends, return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    self.logger.error(f'Could not post alert {rule.name}: {result}')
+
+    async def save_job_subscriptions(self):
+        """
+        Persists job subscriptions (and the accounting cursor, with the jobs already reported at
+        it, so that a restart doesn't report them again) and wakes up the job notifier
+        Jobs are only reported if they end after the first subscription is made
+        """
+        if self.job_accounting.cursor is None:
+            self.job_accounting.reset()
+        self.job_subscriptions.cursor = self.job_accounting.cursor
+        self.job_subscriptions.seen = set(self.job_accounting.seen)
+        try:
+            await self.loop.run_in_executor(None, self.job_subscriptions.write,
+                                            self.job_subscriptions.dump())
+        except OSError as error:
+            self.logger.warning(f'Could not write job subscriptions: {error}')
+        if self._subscriptions_changed is not None:
+            self._subscriptions_changed.set()
+
+    async def notify_subscriber(self, subscriber, embed):
+        """
+        Sends a finished job embed to a subscriber, as a private message
+        """
+        try:
+            user = self.get_user(subscriber) or await self.fetch_user(subscriber)
+            channel = user.dm_channel or await user.create_dm()
+            await self.outbox.send(channel, embed=embed, priority=utils.BACKGROUND)
+        except discord.HTTPException as error:
+            self.logger.warning(f'Could not notify user {subscriber}: {error}')
+
+    async def finished_job_embed(self, job):
+        """
+        Generates the embed sent to the subscribers of a finished job
+        """
+        emoji = '✅' if job.state == 'COMPLETED' else '❌'
+        return discord.Embed(
+            title=f'{emoji} job {job.job_id} {job.state.lower()}',
+            description=job.name,
+            color=await self.get_color()
+        ).add_field(
+            name='user', value=job.user, inline=True
+        ).add_field(
+            name='exit code', value=job.exit_code, inline=True
+        ).add_field(
+            name='ended', value=job.end.replace('T', ' '), inline=True
+        ).set_footer(
+            text=f'🖥️ {self.nickname} • notify'
+        )
+
+    async def finished_array_embed(self, array_job_id, states):
+        """
+        Generates the embed sent to the subscribers of an array job, once every task ended
+        states is {state: number of tasks}
+        """
+        emoji = '✅' if set(states) == {'COMPLETED'} else '❌'
+        return discord.Embed(
+            title=f'{emoji} array job {array_job_id} finished',
+            description=' • '.join(f'{tasks} {state.lower()}'
+                                   for state, tasks in sorted(states.items())),
+            color=await self.get_color()
+        ).set_footer(
+            text=f'🖥️ {self.nickname} • notify'
+        )
+
+    def setup_metrics(self):
+        """
+        Declares prometheus metrics and instruments discord API calls
+        """
+        metrics = self.metrics
+        metrics.counter('hpc_bot_commands_total', 'Commands invoked')
+        metrics.histogram('hpc_bot_command_duration_seconds', 'Command duration, end to end')
+        metrics.counter('hpc_bot_subprocess_spawns_total', 'Shell commands run')
+        metrics.counter('hpc_bot_discord_api_requests_total', 'Discord API requests')
+        metrics.counter('hpc_bot_discord_rate_limit_waits_total',
+                        'Discord API requests delayed by a rate limit')
+        metrics.counter('hpc_bot_discord_rate_limit_wait_seconds_total',
+                        'Time spent waiting for Discord API rate limits')
+        metrics.add_collector(self.collect_host_metrics)
+        metrics.add_collector(self.collect_outbox_metrics)
+        logging.getLogger('discord.http').addHandler(utils.RateLimitCounter(metrics))
+
+        # every discord API call (send, edit, delete, ...) goes through HTTPClient.request
+        request = self.http.request
+
+        async def counted_request(route, **kwargs):
+            metrics.inc('hpc_bot_discord_api_requests_total',
+                        method=route.method, route=route.path)
+            with utils.span('discord'):
+                return await request(route, **kwargs)
+        self.http.request = counted_request
+
+    def collect_outbox_metrics(self):
+        """
+        Outbox metrics, for the metrics endpoint
+        """
+        outbox = self.outbox
+        return [
+            ('hpc_bot_outbox_queued_requests', 'Discord API requests waiting in the outbox',
+             [({}, sum(len(channel_queue.heap) for channel_queue in outbox.channels.values()))]),
+            ('hpc_bot_outbox_edits_merged', 'Message edits merged into a later edit',
+             [({}, outbox.edits_merged)]),
+            ('hpc_bot_outbox_rate_limit_waits', 'Times the outbox waited for a rate limit',
+             [({}, outbox.rate_limit_waits)]),
+        ]
+
+    def collect_host_metrics(self):
+        """
+        Host metrics from the latest background sample, for the metrics endpoint
+        """
+        snapshot = self.sampler.latest
+        if snapshot is None:
+            return []
+        memory = snapshot.memory
+        swap = snapshot.swap
+        disk = snapshot.disk
+        return [
+            ('hpc_bot_host_uptime_seconds', 'Host uptime', [({}, snapshot.uptime)]),
+            ('hpc_bot_host_load', 'Host load average',
+             [({'period': '1m'}, snapshot.load.one),
+              ({'period': '5m'}, snapshot.load.five),
+              ({'period': '15m'}, snapshot.load.fifteen)]),
+            ('hpc_bot_host_memory_bytes', 'Host RAM',
+             [({'state': 'total'}, memory.total), ({'state': 'used'}, memory.used),
+              ({'state': 'free'}, memory.free), ({'state': 'cache'}, memory.cache),
+              ({'state': 'available'}, memory.available)]),
+            ('hpc_bot_host_swap_bytes', 'Host SWAP',
+             [({'state': 'total'}, swap.total), ({'state': 'used'}, swap.used),
+              ({'state': 'free'}, swap.free)]),
+            ('hpc_bot_host_disk_bytes', 'Host disk',
+             [({'state': 'size'}, disk.size), ({'state': 'used'}, disk.used),
+              ({'state': 'available'}, disk.available)]),
+            ('hpc_bot_sample_timestamp_seconds', 'Time of the latest host sample',
+             [({}, snapshot.timestamp)]),
+        ]
+
     @staticmethod
     def update_color(image):
         """
         Generates a new bot color
         image is a filename (string), pathlib.Path object or a file object
+        CPU bound, run it in an executor
         """
         image_read = Image.open(image)
+        image_read.draft('RGB', AVATAR_THUMBNAIL_SIZE)  # decode JPEGs at a reduced size
+        image_read.thumbnail(AVATAR_THUMBNAIL_SIZE)
+        image_read = image_read.convert('RGBA')
         image_color = image_read.resize((1, 1)).getpixel((0, 0))  # average pixel color
         image_color = image_color[:-1] if len(image_color) > 3 else image_color  # alpha value
         return discord.Color.from_rgb(*image_color)
 
-    @property
-    def bot_guild(self):
-        """
-        return this bot discord server
-        None if bot is still on no discord servers or on more than one
-        """
-        return self.guilds[0] if len(self.guilds) == 1 else None
-
     def bot_name(self, ctx):
         """
         return bot nickname if on text channel, bot name if private channel
@@ -247,26 +686,99 @@ class Bot(commands.Bot):
         """
         Finds a text channel with the defined bot text channel name
         """
-        for text_channel in guild.text_channels:
-            if text_channel.name == self.bot_text_channel_name:
-                return text_channel
+        return self.guild_states[guild.id].find_channel(self.bot_text_channel_name)
 
-    async def change_bot_presence(self, guild):
+    def update_bot_text_channel(self, guild):
+        """
+        Sets bot text channel of a discord server from the channel index
+        """
+        guild_state = self.guild_states[guild.id]
+        guild_state.bot_text_channel = self.retrieve_bot_text_channel(guild)
+        guild_state.can_send = None
+
+    def invalidate_permissions(self, guild):
+        """
+        Forgets cached bot permissions of a discord server
+        """
+        guild_state = self.guild_states.get(guild.id)
+        if guild_state:
+            guild_state.can_send = None
+
+    def can_send_to_bot_text_channel(self, guild):
+        """
+        Checks if bot can send messages to the bot text channel of a discord server
+        Permission is computed once and cached until a channel, role or member event changes it
+        """
+        guild_state = self.guild_states[guild.id]
+        if guild_state.can_send is None:
+            permissions = guild_state.bot_text_channel.permissions_for(guild.me)
+            guild_state.can_send = permissions.send_messages
+        return guild_state.can_send
+
+    async def setup_guild(self, guild):
+        """
+        Sets nickname and finds the bot text channel of a discord server
+        """
+        guild_state = self.guild_states.setdefault(guild.id, GuildState())
+
+        # set nickname (the bot may not be allowed to change it)
+        if guild.me.nick != self.nickname:
+            self.logger.info(f'Setting nickname on "{guild}" from "{guild.me.nick}"'
+                             f' to "{self.nickname}"')
+            try:
+                await guild.me.edit(nick=self.nickname, reason='Setting up bot nickname')
+            except discord.HTTPException as error:
+                self.logger.warning(f'Could not set nickname on "{guild}": {error}')
+
+        # check if bot-specific text channel exists
+        guild_state.index_channels(guild)
+        self.update_bot_text_channel(guild)
+        if not guild_state.bot_text_channel:
+            self.logger.warning(
+                f'No text channel named "{self.bot_text_channel_name}" exists on the "{guild}" '
+                'discord server. No messages will be sent by the bot until this channel exists')
+
+    def get_bot_text_channel(self, guild):
+        """
+        Returns the bot text channel of a discord server, None if it doesn't exist
+        (or if guild is None)
+        """
+        guild_state = self.guild_states.get(guild.id) if guild is not None else None
+        return guild_state.bot_text_channel if guild_state else None
+
+    def output_channel(self, ctx):
+        """
+        Channel where command output goes: the private channel where the command was called from
+        or the bot text channel of the discord server it was called from
+        """
+        if isinstance(ctx.channel, (discord.DMChannel, discord.GroupChannel)):
+            return ctx.channel
+        return self.get_bot_text_channel(ctx.guild)
+
+    async def change_bot_presence(self):
         """
         Changes bot "presence" message
+        Presence is shared by all discord servers, nickname is the same in every one of them
         """
+        presence = f'for @{self.nickname} help'
         await self.change_presence(activity=discord.Activity(type=discord.ActivityType.watching,
-                                                             name=f'for @{guild.me.nick} help'))
+                                                             name=presence))
 
-    async def send_message(self, ctx, *args, **kwargs):
+    async def send_message(self, ctx, *args, priority=None, **kwargs):
         """
         Sends message to bot_text_channel or to private channel where the command was called from
+        ctx can also be a discord.Guild, to send to its bot_text_channel (ex: alerts)
+
+        Messages go through the outbox, with priority (utils.INTERACTIVE or utils.BACKGROUND)
+        defaulting to interactive for commands and background for guilds
         """
-        if isinstance(ctx.channel, (discord.DMChannel, discord.GroupChannel)):
-            channel = ctx.channel
+        if isinstance(ctx, discord.Guild):
+            channel = self.get_bot_text_channel(ctx)
+            priority = utils.BACKGROUND if priority is None else priority
         else:
-            channel = self.bot_text_channel
-        message = await channel.send(*args, **kwargs)
+            channel = self.output_channel(ctx)
+            priority = utils.INTERACTIVE if priority is None else priority
+        message = await self.outbox.send(channel, *args, priority=priority, **kwargs)
         return message
 
     async def get_color(self):
@@ -277,9 +789,53 @@ class Bot(commands.Bot):
         # avatar changed
         if self.avatar_hash != self.user.avatar:
             self.logger.info('Avatar changed. Generating new bot color')
-            # fetch avatar image
-            new_avatar = await self.user.avatar_url_as(format='png').read()
-            new_avatar = BytesIO(new_avatar)
             self.avatar_hash = self.user.avatar
-            self.color = self.update_color(new_avatar)
+            with utils.span('color'):
+                self.color = await self.load_color()
         return self.color
+
+    async def load_color(self, image=None):
+        """
+        Returns the bot color for the current avatar
+        Colors are cached on disk by avatar hash, so the avatar is only downloaded and decoded
+        (in an executor, from a thumbnail) the first time a new avatar is seen
+
+        image is the avatar image (see update_color), fetched from discord if None
+        """
+        avatar_hash = self.user.avatar or 'default'
+        colors = await self.loop.run_in_executor(None, self.read_color_cache)
+        if avatar_hash in colors:
+            return discord.Color(colors[avatar_hash])
+
+        if image is None:
+            image = self.user.avatar_url_as(format='png', size=AVATAR_THUMBNAIL_SIZE[0])
+            image = BytesIO(await image.read())
+        color = await self.loop.run_in_executor(None, self.update_color, image)
+
+        colors[avatar_hash] = color.value
+        await self.loop.run_in_executor(None, self.write_color_cache, colors)
+        return color
+
+    def read_color_cache(self):
+        """
+        Reads the avatar hash: color value cache
+        """
+        try:
+            with open(self.color_cache_file) as color_cache:
+                return json.load(color_cache)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as error:
+            self.logger.warning(f'Ignoring unreadable color cache: {error}')
+            return {}
+
+    def write_color_cache(self, colors):
+        """
+        Writes the avatar hash: color value cache
+        """
+        try:
+            self.color_cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.color_cache_file, 'w') as color_cache:
+                json.dump(colors, color_cache)
+        except OSError as error:
+            self.logger.warning(f'Could not write color cache: {error}')
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Base of the cogs with bot commands
+"""
+
+import logging
+import time
+import traceback
+from functools import partial
+from io import BytesIO
+import discord
+from discord.ext import commands
+
+try:
+    import checks
+    import utils
+except ImportError:
+    import hpc_bot.checks as checks
+    import hpc_bot.utils as utils
+
+
+class CommandCog(commands.Cog):
+    """
+    Cog with bot commands. Logs, times and counts every invocation of its commands, and has the
+    helpers they use to answer
+    """
+    def __init__(self, bot):
+        super().__init__()
+        self.bot = bot
+        self.logger = logging.getLogger(f'hpc-bot.{type(self).__name__}')
+        self.shared_results = utils.SingleFlight(bot.result_ttl)
+
+    async def cog_before_invoke(self, ctx):
+        """
+        Called before each command invocation
+        """
+        user = ctx.author
+        ctx.start_time = time.perf_counter()
+        ctx.phases = utils.start_spans()
+        self.bot.metrics.inc('hpc_bot_commands_total', command=ctx.command.name)
+        self.logger.info(f'Calling command: {ctx.command}, '
+                         f'by user: {user}, nickname: {user.display_name}, '
+                         f'from channel: {ctx.channel}',
+                         extra={'command': ctx.command.name, 'user': str(user),
+                                'channel': str(ctx.channel)})
+
+    async def cog_after_invoke(self, ctx):
+        """
+        Called after each command invocation, even if it failed
+        """
+        duration = time.perf_counter() - ctx.start_time
+        self.bot.metrics.observe('hpc_bot_command_duration_seconds', duration,
+                                 command=ctx.command.name)
+        self.bot.command_latency.record(ctx.command.name, dict(ctx.phases, total=duration))
+        self.logger.info(f'Command {ctx.command} finished in {duration:.2f}s',
+                         extra={'command': ctx.command.name, 'user': str(ctx.author),
+                                'channel': str(ctx.channel), 'duration': round(duration, 3)})
+
+    async def cog_command_error(self, ctx, error):
+        """
+        Called when an error is raised inside this cog
+        """
+        if isinstance(error, (commands.MaxConcurrencyReached, commands.CheckFailure)):
+            self.logger.warning(f'When calling command {ctx.command.name}: {error}')
+        else:
+            self.logger.error(
+                f'Error calling command {ctx.command.name}:\n{traceback.format_exc()}')
+
+    async def command_finished_ok(self, ctx, msg=None):
+        """
+        Commands can call this when finished
+        """
+        # can send feedback message to channel where command originated?
+        me = ctx.guild.me if ctx.guild is not None else ctx.bot.user
+        can_write_to_origin_channel = checks.can_write_to_origin_channel(me)
+        if await can_write_to_origin_channel(ctx):
+
+            # feedback message
+            if not msg:  # default feedback message for commands
+                message = f'Command `{ctx.command.name}` finished'
+                # for private messages don't mention bot_text_channel
+                if not isinstance(ctx.channel, (discord.DMChannel, discord.GroupChannel)):
+                    message += f'. Check output at {self.bot.output_channel(ctx).mention}'
+            else:
+                message = msg
+            message_ok = await self.bot.outbox.send(ctx.channel, message)
+            await self.bot.outbox.delete(message_ok, delay=30)
+
+    async def new_embed(self, ctx, title):
+        """
+        Generates a new default embed for a command, with the bot color
+        """
+        bot_color = await self.bot.get_color()
+        return discord.Embed(
+            title=title,
+            color=bot_color,
+        ).set_footer(
+            text=f'🖥️ {ctx.command.name}'
+        )
+
+    async def run_shared(self, ctx, run_command, key=None, use_cache=True):
+        """
+        Runs a command once for all concurrent callers
+        The first caller runs 'run_command(ctx)', which sends and returns the output embed
+        (or utils.Pages, or None on error). Callers that arrive while it is running, or while its
+        result is cached, get a copy of that output without running anything.
+
+        key identifies the command run, defaults to the command name
+        """
+        key = key if key is not None else ctx.command.name
+        embed, shared = await self.shared_results.run(
+            key, partial(run_command, ctx), use_cache=use_cache)
+        if embed is None:
+            return
+        if shared:
+            self.logger.info(f'Command {ctx.command.name} answered with a shared result')
+            if isinstance(embed, utils.Pages):
+                await self.send_pages(ctx, embed)
+            else:
+                await self.bot.send_message(ctx, embed=embed)
+        await self.command_finished_ok(ctx)
+
+    def paginate(self, fields, template, attachment_name):
+        """
+        Splits already ordered (name, value) fields into embed pages (utils.Pages),
+        the fields after the first 'top_rows' going to a compressed attachment
+        """
+        pager = utils.ResultPager(self.bot.top_rows, attachment_name)
+        for position, (name, value) in enumerate(fields):
+            pager.add(name, value, -position)
+        return pager.pages(template)
+
+    async def send_pages(self, ctx, pages, skip_first=False):
+        """
+        Sends embed pages (utils.Pages), then the attachment with the rows that didn't fit,
+        if any. skip_first skips the first page (ex: already sent as a message being edited)
+        """
+        for embed in pages.embeds[1:] if skip_first else pages.embeds:
+            await self.bot.send_message(ctx, embed=embed)
+        if pages.attachment:
+            await self.bot.send_message(
+                ctx, f'{pages.attachment_rows} more rows:',
+                file=discord.File(BytesIO(pages.attachment), filename=pages.attachment_name))
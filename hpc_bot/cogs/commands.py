@@ -21,66 +21,74 @@ Commands Cog - bot commands
 """
 
 import asyncio
-import logging
 import signal
-import traceback
+import time
 from functools import partial
+from io import BytesIO
 import discord
 from discord.ext import commands
 
+from .command_cog import CommandCog
+
 try:
     import checks
+    import federation
+    import probes
+    import utils
 except ImportError:
     import hpc_bot.checks as checks
+    import hpc_bot.federation as federation
+    import hpc_bot.probes as probes
+    import hpc_bot.utils as utils
 
 
-class Commands(commands.Cog):
-    """
-    Main Cog. Contains all bot commands
-    """
-    def __init__(self, bot):
-        super().__init__()
-        self.bot = bot
-        self.logger = logging.getLogger('hpc-bot.Commands')
+STATUS_PROBE_TIMEOUT = 10  # seconds
 
-    async def cog_before_invoke(self, ctx):
-        """
-        Called before each command invocation
-        """
-        user = ctx.author
-        self.logger.info(f'Calling command: {ctx.command}, '
-                         f'by user: {user}, nickname: {user.display_name}, '
-                         f'from channel: {ctx.channel}')
+# status probe: functions run on daemon threads (a probe blocked in the kernel can't be cancelled)
+# (disk_usage sums every real mount, read through the bot's mount table)
+STATUS_PROBES = {
+    'cpu_and_time': lambda: (probes.read_uptime(), probes.read_loadavg()),
+    'ram_and_swap': probes.read_meminfo,
+}
 
-    async def cog_command_error(self, ctx, error):
-        """
-        Called when an error is raised inside this cog
-        """
-        if isinstance(error, (commands.MaxConcurrencyReached, commands.CheckFailure)):
-            self.logger.warning(f'When calling command {ctx.command.name}: {error}')
-        else:
-            self.logger.error(
-                f'Error calling command {ctx.command.name}:\n{traceback.format_exc()}')
+# status probe: names of the embed fields it fills
+STATUS_FIELDS = {
+    'cpu_and_time': ('🕒 UP time', '🎛️ CPU'),
+    'ram_and_swap': ('🧠 RAM', '📼 SWAP'),
+    'disk_usage': ('🖴 STORAGE',),
+}
 
-    async def command_finished_ok(self, ctx, msg=None):
-        """
-        Commands can call this when finished
-        """
-        # can send feedback message to channel where command originated?
-        me = ctx.guild.me if ctx.guild is not None else ctx.bot.user
-        can_write_to_origin_channel = checks.can_write_to_origin_channel(me)
-        if await can_write_to_origin_channel(ctx):
 
-            # feedback message
-            if not msg:  # default feedback message for commands
-                message = f'Command `{ctx.command.name}` finished'
-                # for private messages don't mention bot_text_channel
-                if not isinstance(ctx.channel, (discord.DMChannel, discord.GroupChannel)):
-                    message += f'. Check output at {self.bot.bot_text_channel.mention}'
-            else:
-                message = msg
-            message_ok = await ctx.send(message)
-            await message_ok.delete(delay=30)
+# history metric: embed field name and unit
+HISTORY_FIELDS = {
+    'load': ('🎛️ CPU load (1min)', ''),
+    'memory': ('🧠 RAM used', '%'),
+    'swap': ('📼 SWAP used', '%'),
+    'disk': ('🖴 STORAGE used', '%'),
+}
+
+
+TOP_MAX_COUNT = 20  # rows per embed field (field values are limited to 1024 characters)
+TOP_MAX_AGE = 60  # seconds, older process scans are too old to compute CPU usage against
+TOP_SAMPLE = 1  # seconds between two process scans when there is no recent one
+
+
+def format_seconds(seconds):
+    """
+    Formats a duration as milliseconds or seconds
+    """
+    return f'{seconds * 1000:.0f}ms' if seconds < 1 else f'{seconds:.2f}s'
+
+
+class Commands(CommandCog):
+    """
+    Main Cog. Contains the host status, statistics, job notification and cluster commands
+    (disk space and job queue commands are in the Resources cog)
+    """
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.charts = utils.ChartCache(bot.sampler, HISTORY_FIELDS)
+        self.status_calls = probes.DaemonCalls()  # keyed by status probe name
 
     async def handle_command_runtime(self, cmd_runtime, **kwargs):
         """
@@ -88,7 +96,7 @@ class Commands(commands.Cog):
         """
         embed = kwargs.get('embed')
         embed.description = f'ran in {cmd_runtime}s'
-        await kwargs.get('message_sent').edit(embed=embed)
+        await kwargs.get('batcher').update()
 
     @commands.command()
     @commands.check(checks.can_write_to_bot_text_channel())
@@ -109,30 +117,145 @@ class Commands(commands.Cog):
         await self.command_finished_ok(ctx)
 
     @commands.command()
-    @commands.max_concurrency(1)
     @commands.check(checks.can_write_to_bot_text_channel())
     async def status(self, ctx):
         """
         Shows server status: CPU, RAM and total disk usage
         """
+        await self.run_shared(ctx, self.run_status)
+
+    async def run_status(self, ctx):
+        """
+        Runs the status probes, sending their results to a new embed
+
+        Returns
+        -------
+        discord.Embed or None
+            status embed, None if an error occurred
+        """
+        status_embed = await self.new_embed(ctx, '🎚️ server status')
+
+        # shell commands are only a fallback, when /proc can't be read
+        if not probes.proc_available():
+            self.logger.warning('Could not read /proc. Falling back to shell commands')
+            status_message_sent = await self.bot.send_message(ctx, embed=status_embed)
+            if await self.status_from_shell(ctx, status_embed, status_message_sent):
+                return status_embed
+            return None
+
+        # fields are filled, in place, as each probe finishes
+        for field_names in STATUS_FIELDS.values():
+            for field_name in field_names:
+                status_embed.add_field(name=field_name, value='⏳', inline=True)
+        status_message_sent = await self.bot.send_message(ctx, embed=status_embed)
+        batcher = utils.EditBatcher(status_message_sent, status_embed, self.bot.edit_interval,
+                                    self.bot.outbox)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(self.run_status_probe(probe_name, status_embed, batcher)
+                               for probe_name in STATUS_FIELDS))
+        status_embed.description = f'ran in {time.perf_counter() - start:.2f}s'
+        await batcher.update()
+        await batcher.close()
+        return status_embed
+
+    async def run_status_probe(self, probe_name, status_embed, batcher):
+        """
+        Runs one of the status probes on a daemon thread, with a timeout, and replaces its
+        placeholder fields with the result. A probe that timed out and is still blocked is waited
+        for again by the next status, instead of starting another thread
+        """
+        field_index = 0
+        for name, field_names in STATUS_FIELDS.items():
+            if name == probe_name:
+                break
+            field_index += len(field_names)
+
+        try:
+            with utils.span('host'):
+                if probe_name == 'disk_usage':  # each mount has its own timeout
+                    result = await self.bot.mount_table.usage()
+                else:
+                    result = await self.status_calls.wait(probe_name, STATUS_PROBE_TIMEOUT,
+                                                          STATUS_PROBES[probe_name])
+        except asyncio.TimeoutError:
+            self.logger.warning(f'Status probe {probe_name} timed out '
+                                f'after {STATUS_PROBE_TIMEOUT}s')
+            values = ['timed out'] * len(STATUS_FIELDS[probe_name])
+        except OSError as error:
+            self.logger.error(f'Status probe {probe_name} failed: {error}')
+            values = ['unavailable'] * len(STATUS_FIELDS[probe_name])
+        else:
+            values = self.format_status_probe(probe_name, result)
+
+        for offset, (field_name, value) in enumerate(zip(STATUS_FIELDS[probe_name], values)):
+            status_embed.set_field_at(field_index + offset, name=field_name, value=value,
+                                      inline=True)
+        await batcher.update()
+
+    async def status_from_shell(self, ctx, status_embed, status_message_sent):
+        """
+        Fills status embed by running uptime, free and df
+
+        Returns
+        -------
+        bool
+            True if all commands ran to conclusion, False if an error occurred.
+        """
         cmds = {
             'cpu_and_time': 'uptime',
             'ram_and_swap': 'free -gh',
             'disk_usage':   'df -h --total | tail -n 1'
         }
-        status_embed = await self.new_status_embed(ctx)
-        status_message_sent = await self.bot.send_message(ctx, embed=status_embed)
-
+        batcher = utils.EditBatcher(status_message_sent, status_embed, self.bot.edit_interval,
+                                    self.bot.outbox)
         for cmd_name, cmd in cmds.items():
             ok = await self.run_shell_cmd(
                 ctx, cmd,
                 partial(self.handle_status, cmd_output=cmd_name),
                 self.handle_command_runtime,
                 embed=status_embed,
-                message_sent=status_message_sent)
+                message_sent=status_message_sent,
+                batcher=batcher)
             if not ok:
-                return
-        await self.command_finished_ok(ctx)
+                return False
+        await batcher.close()
+        return True
+
+    @staticmethod
+    def format_status_probe(probe_name, result):
+        """
+        Formats the result of a status probe, one value per field in STATUS_FIELDS[probe_name]
+        """
+        size = probes.format_size
+        if probe_name == 'cpu_and_time':
+            uptime, load = result
+            return [probes.format_uptime(uptime),
+                    f'1min : {load.one:.2f}\n'
+                    f'5min : {load.five:.2f}\n'
+                    f'15min : {load.fifteen:.2f}']
+
+        if probe_name == 'ram_and_swap':
+            memory, swap = result
+            return [f'total : {size(memory.total)}\n'
+                    f'used : {size(memory.used)}\n'
+                    f'free : {size(memory.free)}\n'
+                    f'cache : {size(memory.cache)}\n'
+                    f'available : {size(memory.available)}',
+                    f'total : {size(swap.total)}\n'
+                    f'used : {size(swap.used)}\n'
+                    f'free : {size(swap.free)}']
+
+        # disk_usage, summed over every mount (as 'df --total')
+        usages = result
+        disk = probes.total_disk(usages)
+        value = (f'size : {size(disk.size)}\n'
+                 f'available : {size(disk.available)}\n'
+                 f'used : {size(disk.used)} ({disk.percentage}%)')
+        failed = sum(usage.error is not None for usage in usages)
+        if failed:
+            value += f'\n⚠️ {failed} not responding or unreadable'
+        return [value]
 
     async def handle_status(self, ctx, line, cmd_output='', **kwargs):
         """
@@ -150,112 +273,282 @@ class Commands(commands.Cog):
         if cmd_output == 'cpu_and_time':
             uptime = line[line.find('up ')+3:line.find('user')].rsplit(',', maxsplit=1)[0]
             cpu = line[line.rfind('load average: ')+14:].split(', ')  # 1, 5 and 15 minutes average
-            await kwargs.get('message_sent').edit(
-                embed=kwargs.get('embed').add_field(
-                    name='🕒 UP time',
-                    value=uptime,
-                    inline=True
-                ).add_field(
-                    name='🎛️ CPU',
-                    value=f'1min : {cpu[0]}\n'
-                          f'5min : {cpu[1]}\n'
-                          f'15min : {cpu[2]}',
-                    inline=True))
+            kwargs.get('embed').add_field(
+                name='🕒 UP time',
+                value=uptime,
+                inline=True
+            ).add_field(
+                name='🎛️ CPU',
+                value=f'1min : {cpu[0]}\n'
+                      f'5min : {cpu[1]}\n'
+                      f'15min : {cpu[2]}',
+                inline=True)
+            await kwargs.get('batcher').update()
 
         elif cmd_output == 'ram_and_swap':
             line_contents = line.split()
             # ignores first line, which only contains column headers
             if line_contents[0] == 'Mem:':
                 _, ram_total, ram_used, ram_free, _, ram_cache, ram_available = line_contents
-                await kwargs.get('message_sent').edit(
-                    embed=kwargs.get('embed').add_field(
-                        name='🧠 RAM',
-                        value=f'total : {ram_total}\n'
-                              f'used : {ram_used}\n'
-                              f'free : {ram_free}\n'
-                              f'cache : {ram_cache}\n'
-                              f'available : {ram_available}',
-                        inline=True))
+                kwargs.get('embed').add_field(
+                    name='🧠 RAM',
+                    value=f'total : {ram_total}\n'
+                          f'used : {ram_used}\n'
+                          f'free : {ram_free}\n'
+                          f'cache : {ram_cache}\n'
+                          f'available : {ram_available}',
+                    inline=True)
+                await kwargs.get('batcher').update()
             elif line_contents[0] == 'Swap:':
                 _, swap_total, swap_used, swap_free = line_contents
-                await kwargs.get('message_sent').edit(
-                    embed=kwargs.get('embed').add_field(
-                        name='📼 SWAP',
-                        value=f'total : {swap_total}\n'
-                              f'used : {swap_used}\n'
-                              f'free : {swap_free}',
-                        inline=True))
+                kwargs.get('embed').add_field(
+                    name='📼 SWAP',
+                    value=f'total : {swap_total}\n'
+                          f'used : {swap_used}\n'
+                          f'free : {swap_free}',
+                    inline=True)
+                await kwargs.get('batcher').update()
 
         elif cmd_output == 'disk_usage':
             _, disk_size, disk_used, disk_available, disk_use_percentage, _ = line.split()
-            await kwargs.get('message_sent').edit(
-                embed=kwargs.get('embed').add_field(
-                    name='🖴 STORAGE',
-                    value=f'size : {disk_size}\n'
-                          f'available : {disk_available}\n'
-                          f'used : {disk_used} ({disk_use_percentage})',
-                    inline=True))
+            kwargs.get('embed').add_field(
+                name='🖴 STORAGE',
+                value=f'size : {disk_size}\n'
+                      f'available : {disk_available}\n'
+                      f'used : {disk_used} ({disk_use_percentage})',
+                inline=True)
+            await kwargs.get('batcher').update()
 
-    async def new_status_embed(self, ctx):
+    @commands.command()
+    @commands.check(checks.can_write_to_bot_text_channel())
+    async def history(self, ctx, window='1h'):
         """
-        Generates a new default embed for the status command
+        Load, RAM, SWAP and disk usage statistics over a time window (ex: 30m, 12h, 7d)
         """
-        bot_color = await self.bot.get_color()
-        return discord.Embed(
-            title="🎚️ server status",
-            color=bot_color,
-        ).set_footer(
-            text=f'🖥️ {ctx.command.name}'
-        )
+        try:
+            seconds = probes.parse_duration(window)
+        except ValueError:
+            await ctx.send(f'Error: `{window}` is not a valid time window (ex: 30m, 12h, 7d)')
+            return
+
+        samples, statistics = self.bot.sampler.summary(seconds)
+        history_embed = await self.new_embed(ctx, f'📈 server status over the last {window}')
+        if not samples:
+            history_embed.description = 'no samples yet'
+        else:
+            history_embed.description = f'{samples} samples'
+            for metric, (field_name, unit) in HISTORY_FIELDS.items():
+                lines = [f'{statistic} : {value:.2f}{unit}'
+                         for statistic, value in statistics[metric].items()]
+                history_embed.add_field(name=field_name, value='\n'.join(lines), inline=True)
+        await self.bot.send_message(ctx, embed=history_embed)
+        await self.command_finished_ok(ctx)
 
     @commands.command()
-    @commands.max_concurrency(1)
     @commands.check(checks.can_write_to_bot_text_channel())
-    async def home(self, ctx):
+    async def chart(self, ctx, metric='load', window='1h'):
         """
-        Disk usage of each user's /home folder on the server
+        Chart of load, memory, swap or disk usage over a time window (ex: chart memory 12h)
         """
-        command = 'sudo du -sh /home/*'
-        home_embed = await self.new_home_embed(ctx)
-        home_message_sent = await self.bot.send_message(ctx, embed=home_embed)
-        ok = await self.run_shell_cmd(ctx, command,
-                                      self.handle_home,
-                                      self.handle_command_runtime,
-                                      embed=home_embed,
-                                      message_sent=home_message_sent)
-        if ok:
-            await self.command_finished_ok(ctx)
+        if metric not in HISTORY_FIELDS:
+            await ctx.send(f'Error: `{metric}` is not a valid metric '
+                           f'({", ".join(HISTORY_FIELDS)})')
+            return
+        try:
+            seconds = probes.parse_duration(window)
+        except ValueError:
+            await ctx.send(f'Error: `{window}` is not a valid time window (ex: 30m, 12h, 7d)')
+            return
+
+        chart_embed = await self.new_embed(ctx, f'📈 server status over the last {window}')
+        png = await self.charts.get(metric, seconds, chart_embed.color.to_rgb())
+        chart_file = discord.File(BytesIO(png), filename='chart.png')
+        chart_embed.set_image(url='attachment://chart.png')
+        await self.bot.send_message(ctx, embed=chart_embed, file=chart_file)
+        await self.command_finished_ok(ctx)
 
-    async def handle_home(self, ctx, line, **kwargs):
+    @commands.command()
+    @commands.check(checks.can_write_to_bot_text_channel())
+    async def perf(self, ctx):
         """
-        Handles home command output
+        Latency percentiles of each command, split by phase (host, discord, color and total)
+        """
+        perf_embed = await self.new_embed(ctx, '⏱️ command latency (p50 / p95 / p99)')
+        summary = self.bot.command_latency.summary()
+        if not summary:
+            perf_embed.description = 'no commands recorded yet'
+        for command, phases in summary.items():
+            lines = []
+            for phase, (samples, percentiles) in phases.items():
+                lines.append(f'{phase} : {" / ".join(format_seconds(p) for p in percentiles)}'
+                             f' ({samples})')
+            perf_embed.add_field(name=command, value='\n'.join(lines), inline=True)
+        await self.bot.send_message(ctx, embed=perf_embed)
+        await self.command_finished_ok(ctx)
 
-        Parameters
-        ----------
-        ctx: Context
-            context
-        line: str
-            line of command output
+    @commands.command()
+    @commands.check(checks.can_write_to_bot_text_channel())
+    async def top(self, ctx, count='10'):
         """
-        line_contents = line.split('/')
-        usage = line_contents[0].rstrip()
-        user = line_contents[-1]
+        Users and processes using the most CPU, with their memory use (ex: top 20)
+        """
+        if not count.isdigit() or not 0 < int(count) <= TOP_MAX_COUNT:
+            await ctx.send(f'Error: `{count}` is not a number between 1 and {TOP_MAX_COUNT}')
+            return
+        await self.run_shared(ctx, partial(self.run_top, count=int(count)),
+                              key=('top', int(count)))
 
-        await kwargs.get('message_sent').edit(
-            embed=kwargs.get('embed').add_field(
-                name=user, value=usage, inline=True))
+    async def run_top(self, ctx, count):
+        """
+        Scans processes and sends the top CPU consumers, per user and per process name,
+        to a new embed
 
-    async def new_home_embed(self, ctx):
+        Returns
+        -------
+        discord.Embed or None
+            top embed, None if an error occurred
         """
-        Generates a new default embed for the home command
+        scanner = self.bot.process_scanner
+        try:
+            with utils.span('host'):
+                # CPU usage is measured against the previous scan
+                if scanner.stale(TOP_MAX_AGE):
+                    await self.bot.loop.run_in_executor(None, scanner.scan)
+                    await asyncio.sleep(TOP_SAMPLE)
+                by_user, by_name, processes, elapsed = await self.bot.loop.run_in_executor(
+                    None, scanner.scan)
+        except OSError as error:
+            self.logger.error(f'Could not scan processes: {error}')
+            await ctx.send(f'Error: command `{ctx.command.name}` could not read processes')
+            return None
+
+        top_embed = await self.new_embed(ctx, '🔝 top CPU users (CPU • RAM (processes))')
+        top_embed.description = f'{processes} processes, CPU use over the last {elapsed:.1f}s'
+        for field_name, aggregates in (('👤 users', by_user), ('⚙️ processes', by_name)):
+            top_rows = sorted(aggregates.items(), key=lambda item: (-item[1][0], -item[1][1]))
+            lines = [f'{name} : {cpu:.0f}% • {probes.format_size(rss)} ({number})'
+                     for name, (cpu, rss, number) in top_rows[:count]]
+            top_embed.add_field(name=field_name, value='\n'.join(lines) or '-', inline=False)
+        await self.bot.send_message(ctx, embed=top_embed)
+        return top_embed
+
+    @commands.command()
+    async def notify(self, ctx, target=None, user=None):
         """
-        bot_color = await self.bot.get_color()
-        return discord.Embed(
-            title="🏠 size of each home folder",
-            color=bot_color,
-        ).set_footer(
-            text=f'🖥️ {ctx.command.name}'
-        )
+        Private message when SLURM jobs finish: "notify <job id>" for a job, "notify me [user]"
+        for all jobs of a user (default: your nickname), "notify" lists your subscriptions
+        and "notify stop" cancels them
+        """
+        subscriptions = self.bot.job_subscriptions
+        subscriber = ctx.author.id
+
+        if target is None:
+            jobs, users = subscriptions.subscriptions_of(subscriber)
+            if not jobs and not users:
+                message = 'You have no job notifications'
+            else:
+                message = 'You will be notified when these finish: ' + ', '.join(
+                    [f'job `{job_id}`' for job_id in jobs] +
+                    [f'jobs of `{slurm_user}`' for slurm_user in users])
+            await self.command_finished_ok(ctx, message)
+            return
+
+        if target == 'stop':
+            cancelled = subscriptions.unsubscribe(subscriber)
+            message = f'Cancelled {cancelled} job notification{"s" if cancelled != 1 else ""}'
+        elif target == 'me':
+            slurm_user = user or ctx.author.display_name
+            subscriptions.subscribe_user(slurm_user, subscriber)
+            message = f'You will get a private message whenever a job of `{slurm_user}` finishes'
+        elif target.replace('_', '').isdigit():
+            subscriptions.subscribe_job(target, subscriber)
+            message = f'You will get a private message when job `{target}` finishes'
+        else:
+            await ctx.send(f'Error: `{target}` is not a job id, "me" or "stop"')
+            return
+        await self.bot.save_job_subscriptions()
+        await self.command_finished_ok(ctx, message)
+
+    @commands.command()
+    @commands.check(checks.can_write_to_bot_text_channel())
+    async def cluster(self, ctx, probe='status'):
+        """
+        Status (or home folder usage, "cluster home") of every host running an hpc-bot agent
+        """
+        if self.bot.hub is None:
+            await ctx.send('Error: no agents configured (see the -H option)')
+            return
+        if probe not in federation.PROBES:
+            await ctx.send(f'Error: `{probe}` is not a valid probe '
+                           f'({", ".join(federation.PROBES)})')
+            return
+        await self.run_shared(ctx, partial(self.run_cluster, probe=probe), key=('cluster', probe))
+
+    async def run_cluster(self, ctx, probe):
+        """
+        Queries all agents concurrently and merges their answers into embed pages
+
+        Returns
+        -------
+        utils.Pages
+            cluster pages
+        """
+        start = time.perf_counter()
+        with utils.span('host'):
+            answers = await self.bot.hub.query_all(probe)
+        answered = [answer for answer in answers if answer.error is None]
+
+        title = '🎚️ cluster status' if probe == 'status' else \
+            '🏠 size of each home folder, per host'
+        cluster_embed = await self.new_embed(ctx, title)
+        cluster_embed.description = (f'{len(answered)}/{len(answers)} agents answered '
+                                     f'in {time.perf_counter() - start:.2f}s')
+        if probe == 'status':
+            fields = self.format_cluster_status(answered)
+        else:
+            fields = self.format_cluster_home(answered)
+        fields += [(f'⚠️ {answer.host or answer.address}', answer.error)
+                   for answer in answers if answer.error is not None]
+
+        cluster_pages = self.paginate(fields, cluster_embed, f'cluster_{probe}.txt.gz')
+        await self.send_pages(ctx, cluster_pages)
+        return cluster_pages
+
+    @staticmethod
+    def format_cluster_status(answers):
+        """
+        One (field name, value) per host, sorted by host name
+        """
+        size = probes.format_size
+        fields = []
+        for answer in sorted(answers, key=lambda answer: answer.host):
+            snapshot = federation.snapshot_from_dict(answer.result)
+            load, memory, swap, disk = snapshot.load, snapshot.memory, snapshot.swap, snapshot.disk
+            fields.append((
+                f'🖥️ {answer.host}',
+                f'CPU : {load.one:.2f} / {load.five:.2f} / {load.fifteen:.2f}\n'
+                f'RAM : {size(memory.used)} / {size(memory.total)}\n'
+                f'SWAP : {size(swap.used)} / {size(swap.total)}\n'
+                f'STORAGE : {disk.percentage}%\n'
+                f'UP : {probes.format_uptime(snapshot.uptime)}'))
+        return fields
+
+    @staticmethod
+    def format_cluster_home(answers):
+        """
+        One (field name, value) per user, with the usage on each host, sorted by user name
+        """
+        users = {}  # user: [(host, usage string)]
+        for answer in sorted(answers, key=lambda answer: answer.host):
+            partial_users = set(answer.result['partial'])
+            for user, usage in answer.result['usage'].items():
+                partial_usage = ' (partial)' if user in partial_users else ''
+                users.setdefault(user, []).append(
+                    (answer.host, f'{probes.format_size(usage)}{partial_usage}'))
+            for user in answer.result.get('unreadable', ()):  # older agents don't send it
+                users.setdefault(user, []).append((answer.host, '⚠️ unreadable'))
+        return [(user, '\n'.join(f'{host} : {usage}' for host, usage in hosts))
+                for user, hosts in sorted(users.items())]
 
     async def run_shell_cmd(self, ctx, cmd, handle_output_line, handle_cmd_runtime, **kwargs):
         """
@@ -271,44 +564,38 @@ class Commands(commands.Cog):
         handle_output_line: function
             function to handle each line of output produced by the command
         handle_cmd_runtime: function
-            function to handle the single line of command runtime
+            function to handle the command runtime (seconds, as a string)
         kwargs:
-            should include 'embed' and 'message_sent'
+            should include 'embed', 'message_sent' and 'batcher' (utils.EditBatcher of both),
+            which the caller closes once done
 
         Returns
         -------
         bool
             True if command ran to conclusion, False if an error occurred.
         """
-        async with self.bot.bot_text_channel.typing():
-            # wrap command in GNU time (outputs "real" command runtime to stderr)
-            cmd = f'/usr/bin/time -f "%e" bash -c "{cmd}"'
-
-            process = await asyncio.create_subprocess_shell(
-                cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-
-            # read each line of stdout and pass it to handling function
-            while not process.stdout.at_eof():  # if command isn't done outputting to stdout
-                line_read = await process.stdout.readline()
-                line = line_read.decode('utf-8').rstrip()
-                if line:
-                    await handle_output_line(ctx, line, **kwargs)
+        async with self.bot.output_channel(ctx).typing():
+            # run command on a persistent shell worker, passing each line of stdout
+            # to the handling function
+            self.bot.metrics.inc('hpc_bot_subprocess_spawns_total', command=ctx.command.name)
+            returncode, cmd_runtime, stderr = await self.bot.shell_workers.run(
+                cmd, partial(handle_output_line, ctx, **kwargs))
+            utils.add_span('host', cmd_runtime)
+
+            log_fields = {'command': ctx.command.name, 'user': str(ctx.author),
+                          'channel': str(ctx.channel), 'duration': round(cmd_runtime, 3),
+                          'exit_code': returncode}
 
             # no error while running the command
-            if process.returncode == 0:
-                # read command runtime from stderr and pass it to runtime handling function
-                cmd_runtime = await process.stderr.readline()
-                cmd_runtime = cmd_runtime.decode('utf-8').rstrip()
-                await handle_cmd_runtime(cmd_runtime, **kwargs)
+            if returncode == 0:
+                self.logger.info(f'Shell command finished: {cmd}', extra=log_fields)
+                await handle_cmd_runtime(f'{cmd_runtime:.2f}', **kwargs)
                 return True
 
             # errors
-            _, stderr = await process.communicate()  # wait for command to finish and read stderr
-            stderr = stderr.decode("utf-8").rstrip().rsplit("\n", 1)[0]  # remove runtime from end
-
             # signal terminated
-            if process.returncode < 0:
-                signal_code = abs(process.returncode)
+            if returncode < 0:
+                signal_code = abs(returncode)
                 await ctx.send(f'Error: command `{ctx.command.name}` '
                                f'terminated by signal `{signal_code}` '
                                f'({signal.Signals(signal_code).name})')
@@ -316,15 +603,18 @@ class Commands(commands.Cog):
             # error return code
             else:
                 await ctx.send(f'Error: command `{ctx.command.name}` '
-                               f'terminated with an error code `{process.returncode}`')
+                               f'terminated with an error code `{returncode}`')
                 # TODO find a way to get return code name with python...
 
             # delete message that was being updated, if any
+            batcher = kwargs.get('batcher')
+            if batcher:
+                batcher.cancel()
             message_sent = kwargs.get('message_sent')
             if message_sent:
-                await message_sent.delete()
+                await self.bot.outbox.delete(message_sent, priority=utils.INTERACTIVE)
 
             self.logger.error(
-                f'Error code {process.returncode} while running command: '
-                f'{ctx.command.name} ({cmd})\n{stderr}')
+                f'Error code {returncode} while running command: '
+                f'{ctx.command.name} ({cmd})\n{stderr}', extra=log_fields)
             return False
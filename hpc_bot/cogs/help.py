@@ -41,10 +41,11 @@ class Help(commands.MinimalHelpCommand):
         """
         Defines the message at the top of help command when called without parameters
         """
-        if self.cog.bot.bot_text_channel:
-            bot_text_channel = self.cog.bot.bot_text_channel.mention
+        channel = self.cog.bot.get_bot_text_channel(self.context.guild)
+        if channel:
+            bot_text_channel = channel.mention
         else:
-            bot_text_channel = None
+            bot_text_channel = f'#{self.cog.bot.bot_text_channel_name}'
         prefix = self.cog.bot.prefix
 
         if prefix:
@@ -54,6 +55,10 @@ class Help(commands.MinimalHelpCommand):
         else:
             prefix_help = ''
 
+        if self.cog.bot.hub:
+            prefix_help += 'This bot also monitors other hosts: use `cluster` to see all of ' \
+                           'them in a single message\n\n'
+
         return 'This bot provides some commands that can retrieve information from the hpc ' \
                'server it is associated with.\nMost commands output to the defined ' \
                f'bot text channel ({bot_text_channel}).\n\nCommands can be called by typing:  ' \
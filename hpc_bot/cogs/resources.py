@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Resources Cog - storage, home folder and job queue commands
+"""
+
+import datetime
+import time
+from functools import partial
+from discord.ext import commands
+
+from .command_cog import CommandCog
+
+try:
+    import checks
+    import probes
+    import utils
+except ImportError:
+    import hpc_bot.checks as checks
+    import hpc_bot.probes as probes
+    import hpc_bot.utils as utils
+
+
+class Resources(CommandCog):
+    """
+    Disk space and SLURM job queue commands
+    """
+    def __init__(self, bot):
+        super().__init__(bot)
+        self.queue_fields = {'partition': {}, 'user': {}}  # group: rendered field value
+
+    @commands.command()
+    @commands.check(checks.can_write_to_bot_text_channel())
+    async def storage(self, ctx):
+        """
+        Size, used space and inodes of each mounted filesystem
+        """
+        await self.run_shared(ctx, self.run_storage)
+
+    async def run_storage(self, ctx):
+        """
+        Probes every real mount (each with its own timeout, so a hung mount doesn't block the
+        others) and sends their usage to new embed pages
+
+        Returns
+        -------
+        utils.Pages or None
+            storage pages, None if an error occurred
+        """
+        start = time.perf_counter()
+        try:
+            with utils.span('host'):
+                usages = await self.bot.mount_table.usage()
+        except OSError as error:
+            self.logger.error(f'Could not read mounts: {error}')
+            await ctx.send(f'Error: command `{ctx.command.name}` could not read mounts')
+            return None
+
+        fields = []
+        for usage in usages:
+            mount = usage.mount
+            if usage.error is not None:
+                value = f'{mount.fstype} • ⚠️ {usage.error}'
+            else:
+                disk = usage.disk
+                value = (f'{mount.fstype} • {probes.format_size(disk.used)}/'
+                         f'{probes.format_size(disk.size)} ({disk.percentage}%)')
+                if usage.inodes:
+                    value += f'\ninodes {usage.inodes_percentage}% of {usage.inodes:,}'
+            fields.append((f'💾 {mount.path}', value))
+
+        storage_embed = await self.new_embed(ctx, '💾 storage (used/size (use%) • inodes)')
+        failed = sum(usage.error is not None for usage in usages)
+        storage_embed.description = f'{len(usages)} filesystems'
+        if failed:
+            storage_embed.description += f', {failed} not responding or unreadable'
+        storage_embed.description += f' • ran in {time.perf_counter() - start:.2f}s'
+        storage_pages = self.paginate(fields, storage_embed, 'storage.txt.gz')
+        await self.send_pages(ctx, storage_pages)
+        return storage_pages
+
+    @commands.command()
+    @commands.check(checks.can_write_to_bot_text_channel())
+    async def home(self, ctx, *options):
+        """
+        Disk usage of each user's /home folder on the server
+
+        Answers from the filesystem's quota report when it has one, from the home folder index,
+        which is kept up to date in the background, otherwise
+        Use "home --refresh" to rescan the home folders before answering
+        """
+        refresh = '--refresh' in options
+        await self.run_shared(ctx, partial(self.run_home, refresh=refresh),
+                              key=('home', refresh), use_cache=not refresh)
+
+    async def run_home(self, ctx, refresh=False):
+        """
+        Sends the disk usage of each user's /home folder, largest first, to new embed pages
+
+        Returns
+        -------
+        utils.Pages or None
+            home pages, None if an error occurred
+        """
+        home_embed = await self.new_embed(ctx, '🏠 size of each home folder')
+        pager = utils.ResultPager(self.bot.top_rows, attachment_name='home.txt.gz')
+
+        # quota reports are up to date and much faster than any scan
+        try:
+            with utils.span('host'):
+                quota = await self.bot.home_quota.read(self.bot.shell_workers,
+                                                       self.bot.mount_table)
+        except (OSError, probes.ShellWorkerError) as error:
+            self.logger.error(f'Could not read home quotas: {error}')
+            quota = None
+        if quota is not None:
+            usage, source = quota
+            for user, user_usage in usage.items():
+                pager.add(user, probes.format_size(user_usage), user_usage)
+            home_embed.description = self.home_summary(pager)
+            home_embed.set_footer(text=f'🖥️ {ctx.command.name} • source: {source} quota')
+            home_pages = pager.pages(home_embed)
+            await self.send_pages(ctx, home_pages)
+            return home_pages
+
+        home_index = self.bot.home_index
+        if refresh:
+            await home_index.refresh()
+
+        # index wasn't built yet, scan now
+        if home_index.last_scan is None:
+            return await self.scan_home(ctx, home_embed, pager)
+
+        for user, usage in home_index.usage.items():
+            pager.add(user, self.format_home_usage(usage, user in home_index.partial), usage)
+        for user in home_index.unreadable:  # listed last
+            pager.add(user, '⚠️ unreadable', -1)
+        last_scan = datetime.datetime.fromtimestamp(home_index.last_scan)
+        home_embed.description = self.home_summary(pager)
+        if home_index.unreadable:
+            home_embed.description += f' • {len(home_index.unreadable)} unreadable'
+        home_embed.set_footer(
+            text=f'🖥️ {ctx.command.name} • source: index, last scanned '
+                 f'{last_scan:%Y-%m-%d %H:%M}')
+        home_pages = pager.pages(home_embed)
+        await self.send_pages(ctx, home_pages)
+        return home_pages
+
+    @staticmethod
+    def home_summary(pager):
+        """
+        Number of home folders, and how many of them are shown
+        """
+        if pager.rows > pager.top:
+            return f'{pager.rows} home folders, the {pager.top} largest shown'
+        return f'{pager.rows} home folders'
+
+    async def scan_home(self, ctx, home_embed, pager):
+        """
+        Follows the running scan of the home folder index (see HomeIndex.follow_scan), showing
+        the largest home folders in the embed as soon as they are measured. Folders that take
+        longer than their deadline are shown as partial, folders that can't be read (even with
+        du) as unreadable
+
+        Returns
+        -------
+        utils.Pages or None
+            home pages, None if an error occurred
+        """
+        home_index = self.bot.home_index
+        try:
+            users = await self.bot.loop.run_in_executor(None, probes.home_users, home_index.root)
+        except OSError as error:
+            self.logger.error(f'Could not list home folders: {error}')
+            await ctx.send(f'Error: command `{ctx.command.name}` could not list home folders')
+            return None
+
+        home_embed.set_footer(text=f'🖥️ {ctx.command.name} • source: scan')
+        home_message_sent = await self.bot.send_message(ctx, embed=home_embed)
+        batcher = utils.EditBatcher(home_message_sent, home_embed, self.bot.edit_interval,
+                                    self.bot.outbox)
+        start = time.perf_counter()
+        partial_users = unreadable_users = 0
+        async for user, usage, partial_usage in home_index.follow_scan():
+            if usage is None:
+                unreadable_users += 1
+                pager.add(user, '⚠️ unreadable', -1)
+            else:
+                partial_users += partial_usage
+                pager.add(user, self.format_home_usage(usage, partial_usage), usage)
+            home_embed.clear_fields()
+            for name, value in pager.peek():
+                home_embed.add_field(name=name, value=value, inline=True)
+            home_embed.description = f'{pager.rows}/{len(users)} home folders measured…'
+            await batcher.update()
+        await batcher.close()
+
+        home_embed.clear_fields()
+        home_embed.description = f'ran in {time.perf_counter() - start:.2f}s • ' \
+                                 f'{self.home_summary(pager)}'
+        if partial_users:
+            home_embed.description += f' • {partial_users} partial'
+        if unreadable_users:
+            home_embed.description += f' • {unreadable_users} unreadable'
+        home_pages = pager.pages(home_embed)
+        await self.bot.outbox.edit(home_message_sent, embed=home_pages.embeds[0])
+        await self.send_pages(ctx, home_pages, skip_first=True)
+        return home_pages
+
+    @staticmethod
+    def format_home_usage(usage, partial_usage):
+        """
+        Formats a home folder size, as a lower bound if some of the folder wasn't measured
+        """
+        if partial_usage:
+            return f'≥ {probes.format_size(usage)} (partial)'
+        return probes.format_size(usage)
+
+    @commands.command()
+    @commands.check(checks.can_write_to_bot_text_channel())
+    async def queue(self, ctx):
+        """
+        SLURM jobs running and pending, per partition and per user
+        """
+        await self.run_shared(ctx, self.run_queue)
+
+    async def run_queue(self, ctx):
+        """
+        Refreshes the job queue snapshot and sends its aggregates to new embed pages
+        Only the fields of partitions and users whose jobs changed are formatted again
+
+        Returns
+        -------
+        utils.Pages or None
+            queue pages, None if an error occurred
+        """
+        job_queue = self.bot.job_queue
+        if not job_queue.fresh:
+            self.bot.metrics.inc('hpc_bot_subprocess_spawns_total', command=ctx.command.name)
+        with utils.span('host'):
+            returncode, stderr = await job_queue.refresh(self.bot.shell_workers)
+        if returncode != 0:
+            self.logger.error(f'Error code {returncode} while running: {job_queue.squeue_cmd}\n'
+                              f'{stderr}')
+            await ctx.send(f'Error: command `{ctx.command.name}` '
+                           f'terminated with an error code `{returncode}`')
+            return None
+
+        changed_users, changed_partitions = job_queue.take_changes()
+        for group_type, aggregates, changed in (('partition', job_queue.by_partition,
+                                                 changed_partitions),
+                                                ('user', job_queue.by_user, changed_users)):
+            fields = self.queue_fields[group_type]
+            for group in changed:
+                if group in aggregates:
+                    fields[group] = self.format_queue_group(aggregates[group])
+                else:
+                    fields.pop(group, None)
+
+        queue_embed = await self.new_embed(ctx, '📋 job queue')
+        totals = job_queue.state_totals()
+        queue_embed.description = (
+            f'{len(job_queue.jobs)} jobs: {totals.get("RUNNING", 0)} running, '
+            f'{totals.get("PENDING", 0)} pending, {totals.get("other", 0)} other '
+            f'• squeue ran in {job_queue.runtime:.2f}s')
+
+        fields = [(f'🗂️ {partition}', value)
+                  for partition, value in sorted(self.queue_fields['partition'].items())]
+        users = sorted(job_queue.by_user.items(),  # users with more jobs first
+                       key=lambda item: (-sum(jobs for jobs, _ in item[1].values()), item[0]))
+        fields += [(f'👤 {user}', self.queue_fields['user'][user]) for user, _ in users]
+        queue_pages = self.paginate(fields, queue_embed, 'queue.txt.gz')
+        await self.send_pages(ctx, queue_pages)
+        return queue_pages
+
+    @staticmethod
+    def format_queue_group(states):
+        """
+        Formats the job and CPU counts of a partition or user, one line per state
+        """
+        return '\n'.join(f'{state.lower()} : {states[state][0]} jobs ({states[state][1]} CPUs)'
+                         for state in probes.QUEUE_STATES + ('other',) if state in states)
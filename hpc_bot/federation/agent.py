@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Host agent
+
+Serves the probes of the host it runs on to a hub bot, without connecting to discord.
+One agent per compute node replaces one full bot (and gateway connection) per node.
+"""
+
+import asyncio
+import dataclasses
+import logging
+import os
+import socket
+
+try:
+    import probes
+    from federation import protocol
+except ImportError:
+    import hpc_bot.probes as probes
+    from hpc_bot.federation import protocol
+
+
+PROBE_TIMEOUT = 10  # seconds
+REQUEST_TIMEOUT = 5 * 60  # seconds an idle hub connection is kept open
+
+
+class Agent:
+    """
+    Answers probe requests from hubs
+
+    Parameters
+    ----------
+    address: str
+        "unix:/path/to/socket" or "[host:]port" to listen on
+    home_index: probes.HomeIndex
+        home folder index, kept up to date by the caller
+    """
+    def __init__(self, address, home_index):
+        self.logger = logging.getLogger('hpc-bot.Agent')
+        self.address = address
+        self.home_index = home_index
+        self.hostname = socket.gethostname()
+        self.server = None
+        self.mount_table = probes.MountTable()
+        self.probe_calls = probes.DaemonCalls()  # keyed by probe name
+
+    async def start(self):
+        """
+        Starts listening
+        """
+        kind, where = protocol.parse_address(self.address)
+        if kind == 'unix':
+            if os.path.exists(where):  # left behind by an agent that didn't shut down cleanly
+                os.unlink(where)
+            self.server = await asyncio.start_unix_server(self.handle_connection, where)
+        else:
+            self.server = await asyncio.start_server(self.handle_connection, *where)
+        self.logger.info(f'Agent listening on {self.address}')
+
+    async def handle_connection(self, reader, writer):
+        """
+        Answers requests from a hub, one per line, until it disconnects
+        """
+        peer = writer.get_extra_info('peername') or 'unix socket'
+        self.logger.info(f'Hub connected: {peer}')
+        try:
+            while True:
+                line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+                if not line:
+                    break
+                writer.write(protocol.encode(await self.answer(line)))
+                await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            self.logger.info(f'Hub disconnected: {peer}')
+
+    async def answer(self, line):
+        """
+        Runs the requested probe
+
+        Returns
+        -------
+        dict
+            answer message
+        """
+        try:
+            probe = protocol.decode(line).get('probe')
+        except ValueError as error:
+            return {'host': self.hostname, 'error': f'invalid request: {error}'}
+
+        try:
+            if probe == 'status':
+                # /proc on a daemon thread, disk summed over every mount as the bot's status,
+                # each mount with its own timeout: a hung probe never holds more than one thread
+                snapshot = await self.probe_calls.wait(probe, PROBE_TIMEOUT,
+                                                       probes.collect_snapshot, ())
+                disk = probes.total_disk(await self.mount_table.usage())
+                result = protocol.snapshot_to_dict(dataclasses.replace(snapshot, disk=disk))
+            elif probe == 'home':
+                result = {'usage': self.home_index.usage,
+                          'partial': sorted(self.home_index.partial),
+                          'unreadable': sorted(self.home_index.unreadable),
+                          'last_scan': self.home_index.last_scan}
+            else:
+                return {'host': self.hostname, 'error': f'unknown probe: {probe}'}
+        except asyncio.TimeoutError:
+            return {'host': self.hostname, 'error': f'timed out after {PROBE_TIMEOUT}s'}
+        except OSError as error:
+            return {'host': self.hostname, 'error': str(error)}
+        return {'host': self.hostname, 'result': result}
+
+    async def stop(self):
+        """
+        Stops listening
+        """
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.mount_table.close()
+
+
+async def run_agent(address, cache_dir, du_cmd=probes.DU_COMMAND):
+    """
+    Runs an agent, and the home folder index it serves, until cancelled
+    du_cmd measures the home folders the agent can't read (see probes.HomeIndex)
+    """
+    home_index = probes.HomeIndex(cache_dir.joinpath('home_index.json'), du_cmd=du_cmd)
+    agent = Agent(address, home_index)
+    home_index_task = asyncio.get_event_loop().create_task(
+        home_index.run(asyncio.get_event_loop()))
+    await agent.start()
+    try:
+        await agent.server.serve_forever()
+    finally:
+        home_index_task.cancel()
+        await agent.stop()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Hub side of the federation: queries every agent concurrently
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass
+
+try:
+    from federation import protocol
+except ImportError:
+    from hpc_bot.federation import protocol
+
+
+AGENT_TIMEOUT = 15  # seconds, a bit more than the agent's own probe timeout
+MESSAGE_LIMIT = 2 ** 20  # bytes, home answers of servers with many users are long lines
+
+
+@dataclass
+class AgentAnswer:
+    """
+    Answer of one agent to a probe request
+    host is None if the agent couldn't be reached, error is None if the probe ran
+    """
+    address: str
+    host: str = None
+    result: object = None
+    error: str = None
+
+
+class AgentClient:
+    """
+    Persistent connection to a single agent, reopened when it breaks
+
+    Parameters
+    ----------
+    address: str
+        "unix:/path/to/socket" or "[host:]port" of the agent
+    timeout: float
+        seconds to wait for an answer
+    """
+    def __init__(self, address, timeout=AGENT_TIMEOUT):
+        self.logger = logging.getLogger('hpc-bot.AgentClient')
+        self.address = address
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self._lock = None  # asyncio.Lock, created inside the running loop
+
+    async def connect(self):
+        """
+        Opens the connection
+        """
+        kind, where = protocol.parse_address(self.address)
+        if kind == 'unix':
+            connection = asyncio.open_unix_connection(where, limit=MESSAGE_LIMIT)
+        else:
+            connection = asyncio.open_connection(*where, limit=MESSAGE_LIMIT)
+        self.reader, self.writer = await asyncio.wait_for(connection, self.timeout)
+
+    async def query(self, probe):
+        """
+        Sends a probe request and waits for the answer
+        A connection that was closed by the agent (ex: restarted) is reopened once
+
+        Returns
+        -------
+        AgentAnswer
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:  # one request at a time per connection
+            for attempt in range(2):
+                reused = self.writer is not None
+                try:
+                    if not reused:
+                        await self.connect()
+                    self.writer.write(protocol.encode({'probe': probe}))
+                    await self.writer.drain()
+                    line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+                    if not line:
+                        raise ConnectionResetError('connection closed by agent')
+                    message = protocol.decode(line)
+                except (OSError, asyncio.TimeoutError, ValueError) as error:
+                    self.close()
+                    if reused and attempt == 0 and isinstance(error, ConnectionError):
+                        continue  # stale connection, try a new one
+                    self.logger.warning(f'Agent {self.address} failed: {error!r}')
+                    return AgentAnswer(self.address,
+                                       error='timed out' if isinstance(
+                                           error, asyncio.TimeoutError) else 'unreachable')
+                return AgentAnswer(self.address, host=message.get('host'),
+                                   result=message.get('result'), error=message.get('error'))
+
+    def close(self):
+        """
+        Closes the connection (a new one is opened by the next query)
+        """
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class Hub:
+    """
+    Queries a set of agents
+
+    Parameters
+    ----------
+    addresses: list of str
+        agent addresses
+    timeout: float
+        seconds to wait for each agent
+    """
+    def __init__(self, addresses, timeout=AGENT_TIMEOUT):
+        self.clients = [AgentClient(address, timeout) for address in addresses]
+
+    async def query_all(self, probe):
+        """
+        Sends a probe request to every agent concurrently
+
+        Returns
+        -------
+        list of AgentAnswer
+            in the same order as the agent addresses
+        """
+        return await asyncio.gather(*(client.query(probe) for client in self.clients))
+
+    def close(self):
+        """
+        Closes all agent connections
+        """
+        for client in self.clients:
+            client.close()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Agent/hub wire protocol
+
+One JSON object per line, in both directions, over a TCP or Unix socket.
+Requests are {"probe": name}, answers are {"host": hostname, "result": ...} or
+{"host": hostname, "error": message}.
+"""
+
+import json
+from dataclasses import asdict
+
+try:
+    import probes
+except ImportError:
+    import hpc_bot.probes as probes
+
+
+PROBES = ('status', 'home')
+
+
+def parse_address(address):
+    """
+    Parses an agent address: "unix:/path/to/socket" or "[host:]port" (host defaults to 127.0.0.1)
+
+    Returns
+    -------
+    ('unix', path) or ('tcp', (host, port))
+
+    Raises
+    ------
+    ValueError
+        if port is not a number
+    """
+    if address.startswith('unix:'):
+        return 'unix', address[len('unix:'):]
+    host, _, port = address.rpartition(':')
+    return 'tcp', (host or '127.0.0.1', int(port))
+
+
+def encode(message):
+    """
+    Encodes a message as a JSON line
+    """
+    return json.dumps(message, separators=(',', ':')).encode() + b'\n'
+
+
+def decode(line):
+    """
+    Decodes a JSON line
+
+    Raises
+    ------
+    ValueError
+        if line isn't a JSON object
+    """
+    message = json.loads(line)
+    if not isinstance(message, dict):
+        raise ValueError(f'Expected a JSON object, got: {line[:100]!r}')
+    return message
+
+
+def snapshot_to_dict(snapshot):
+    """
+    probes.SystemSnapshot -> JSON serializable dict
+    """
+    return asdict(snapshot)
+
+
+def snapshot_from_dict(data):
+    """
+    dict (see snapshot_to_dict) -> probes.SystemSnapshot
+    """
+    return probes.SystemSnapshot(
+        timestamp=data['timestamp'],
+        uptime=data['uptime'],
+        load=probes.LoadAverage(**data['load']),
+        memory=probes.Memory(**data['memory']),
+        swap=probes.Swap(**data['swap']),
+        disk=probes.Disk(**data['disk']))
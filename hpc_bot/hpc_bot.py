@@ -34,6 +34,7 @@ __description__ = 'A discord bot to relay HPC information.'
 
 
 import argparse
+import asyncio
 import copy
 import hashlib
 import json
@@ -44,8 +45,14 @@ import sys
 
 try:
     import cogs
+    import federation
+    import probes
+    import utils
 except ImportError:
     import hpc_bot.cogs as cogs
+    import hpc_bot.federation as federation
+    import hpc_bot.probes as probes
+    import hpc_bot.utils as utils
 
 
 def path_argument(string):
@@ -54,6 +61,104 @@ def path_argument(string):
         return pathlib.Path(string).expanduser().resolve()
 
 
+def log_rotation_argument(string):
+    """returns a valid log rotation (see utils.parse_rotation) or None"""
+    if string is not None:
+        try:
+            return utils.parse_rotation(string)
+        except ValueError as error:
+            raise argparse.ArgumentTypeError(str(error))
+
+
+def metrics_argument(string):
+    """returns a valid metrics address (see utils.parse_metrics_address) or None"""
+    if string is not None:
+        try:
+            utils.parse_metrics_address(string)
+        except ValueError as error:
+            raise argparse.ArgumentTypeError(str(error))
+        return string
+
+
+def agents_argument(string):
+    """returns a list of agent addresses (comma separated in string) or None"""
+    if string is not None:
+        agents = [agent.strip() for agent in string.split(',') if agent.strip()]
+        for agent in agents:
+            try:
+                federation.parse_address(agent)
+            except ValueError:
+                raise argparse.ArgumentTypeError(f'invalid agent address: "{agent}"')
+        return agents
+
+
+def positive_int_argument(value):
+    """returns value (a string or a number) as an int greater than 0"""
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise argparse.ArgumentTypeError(f'invalid positive integer: "{value}"')
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f'must be a positive integer: "{value}"')
+    return number
+
+
+def choice_argument(*choices):
+    """returns a function that checks that a string is one of choices"""
+    def check_choice(string):
+        if string not in choices:
+            raise argparse.ArgumentTypeError(f'must be one of {", ".join(choices)}')
+        return string
+    return check_choice
+
+
+def log_path_argument(string):
+    """returns a Path to a log file ("bot.log" inside string, if string is a folder)"""
+    log_path = path_argument(string)
+    # logging handles files directly
+    if log_path.exists() and log_path.is_dir():
+        log_path = log_path.joinpath('bot.log')  # append file to log path
+    return log_path
+
+
+def agents_config_argument(agents):
+    """returns a list of agent addresses from a list or a comma separated string"""
+    return agents_argument(agents if isinstance(agents, str) else ','.join(agents))
+
+
+def unchanged(value):
+    """returns value as is"""
+    return value
+
+
+# config file parameter: function that checks and converts its value
+# (each parameter has the same name as the argument it replaces)
+CONFIG_PARAMETERS = {
+    'token': unchanged,
+    'nickname': unchanged,
+    'avatar': path_argument,
+    'bot_text_channel': unchanged,
+    'command_prefix': unchanged,
+    'log': log_path_argument,
+    'log_rotation': log_rotation_argument,
+    'log_format': choice_argument('text', 'json'),
+    'cache_dir': path_argument,
+    'edit_interval': float,
+    'result_ttl': float,
+    'sample_interval': float,
+    'top_rows': positive_int_argument,
+    'metrics': metrics_argument,
+    'squeue': unchanged,
+    'sacct': unchanged,
+    'home_quota': choice_argument(*probes.QUOTA_SOURCES),
+    'repquota': unchanged,
+    'lfs': unchanged,
+    'du': unchanged,
+    'agent': unchanged,
+    'agents': agents_config_argument,
+}
+
+
 def config_parser(cli, cli_parsed):
     """
     Parses the config file and modifies options accordingly
@@ -66,23 +171,18 @@ def config_parser(cli, cli_parsed):
     with open(cli_parsed.config) as config_data:
         configs = json.load(config_data)
 
-    if 'token' in configs and cli_parsed.token == cli.get_default('token'):
-        cli_parsed.token = configs['token']
-    if 'nickname' in configs and cli_parsed.nickname == cli.get_default('nickname'):
-        cli_parsed.nickname = configs['nickname']
-    if 'avatar' in configs and cli_parsed.avatar == cli.get_default('avatar'):
-        cli_parsed.avatar = path_argument(configs['avatar'])
-    if 'bot_text_channel' in configs and cli_parsed.bot_text_channel == cli.get_default(
-            'bot_text_channel'):
-        cli_parsed.bot_text_channel = configs['bot_text_channel']
-    if 'command_prefix' in configs and cli_parsed.command_prefix == cli.get_default(
-            'command_prefix'):
-        cli_parsed.command_prefix = configs['command_prefix']
-    if 'log' in configs and cli_parsed.log == cli.get_default('log'):
-        cli_parsed.log = path_argument(configs['log'])
-        # logging handles files directly
-        if cli_parsed.log.exists() and cli_parsed.log.is_dir():
-            cli_parsed.log = cli_parsed.log.joinpath('bot.log')  # append file to log path
+    for parameter, convert in CONFIG_PARAMETERS.items():
+        if parameter in configs and getattr(cli_parsed, parameter) == cli.get_default(parameter):
+            try:
+                setattr(cli_parsed, parameter, convert(configs[parameter]))
+            except (argparse.ArgumentTypeError, TypeError, ValueError) as error:
+                cli.error(f'config {parameter}: {error}')
+
+    # alerts are only defined in the config file
+    try:
+        cli_parsed.alerts = utils.parse_alert_rules(configs.get('alerts', []))
+    except (TypeError, ValueError) as error:
+        cli.error(f'config alerts: {error}')
 
     return cli_parsed
 
@@ -126,6 +226,103 @@ def arguments_handler():
                           'Default is "./bot.log"',
                      type=path_argument,
                      default=path_argument('bot.log'))
+    cli.add_argument('-lr',
+                     dest='log_rotation',
+                     help='Rotate log file when it reaches a size (ex: 500K, 10M, 1G) or '
+                          '"hourly", "daily" or "weekly". 5 rotated files are kept. '
+                          'Default is to never rotate',
+                     type=log_rotation_argument,
+                     default=None)
+    cli.add_argument('-lf',
+                     dest='log_format',
+                     help='Log file format: "text" or "json" (one JSON object per line, '
+                          'with command, user, duration and exit code fields for commands). '
+                          'Default is "text"',
+                     choices=('text', 'json'),
+                     default='text')
+    cli.add_argument('-cd',
+                     dest='cache_dir',
+                     help='Folder where the bot keeps data between restarts (home folder usage '
+                          'index, ...). Default is "~/.cache/hpc_bot"',
+                     type=path_argument,
+                     default=path_argument('~/.cache/hpc_bot'))
+    cli.add_argument('-ei',
+                     dest='edit_interval',
+                     help='Minimum seconds between edits of a message that is being updated '
+                          'with command output. Default is 2',
+                     type=float,
+                     default=2.0)
+    cli.add_argument('-rt',
+                     dest='result_ttl',
+                     help='Seconds during which the output of a command is reused by later calls '
+                          'of the same command, instead of running it again. Default is 10',
+                     type=float,
+                     default=10.0)
+    cli.add_argument('-si',
+                     dest='sample_interval',
+                     help='Seconds between samples of system metrics kept for the history '
+                          'command (one week of samples is kept). Default is 60',
+                     type=float,
+                     default=60.0)
+    cli.add_argument('-tr',
+                     dest='top_rows',
+                     help='Number of largest rows (ex: home folders) shown in embeds by commands '
+                          'with long outputs. The other rows are attached as a compressed text '
+                          f'file. Default is {utils.TOP_ROWS}',
+                     type=positive_int_argument,
+                     default=utils.TOP_ROWS)
+    cli.add_argument('-m',
+                     dest='metrics',
+                     help='[host:]port where bot and host metrics are served in the Prometheus '
+                          'format (at /metrics). Host defaults to 127.0.0.1. '
+                          'Default is to not serve metrics',
+                     type=metrics_argument,
+                     default=None)
+    cli.add_argument('-sq',
+                     dest='squeue',
+                     help='SLURM squeue executable used by the queue command. '
+                          'Default is "squeue"',
+                     default='squeue')
+    cli.add_argument('-sa',
+                     dest='sacct',
+                     help='SLURM sacct executable used to find finished jobs for the notify '
+                          'command. Default is "sacct"',
+                     default='sacct')
+    cli.add_argument('-hq',
+                     dest='home_quota',
+                     help='Where the home command reads per-user usage from first: "auto" '
+                          '(repquota or lfs quota, if /home is an ext2/3/4, XFS or Lustre mount '
+                          'with quotas), "repquota", "lfs" or "none" (always scan home folders). '
+                          'Default is "auto"',
+                     choices=probes.QUOTA_SOURCES,
+                     default='auto')
+    cli.add_argument('-rq',
+                     dest='repquota',
+                     help='repquota executable used by the home command. Default is "repquota"',
+                     default=probes.REPQUOTA_COMMAND)
+    cli.add_argument('-lq',
+                     dest='lfs',
+                     help='Lustre lfs executable used by the home command. Default is "lfs"',
+                     default=probes.LFS_COMMAND)
+    cli.add_argument('-du',
+                     dest='du',
+                     help='du command used to measure the home folders the bot user can\'t read, '
+                          'can include arguments. Home folders are usually only readable by their '
+                          'owner: allow it in sudoers or home folders are reported as unreadable. '
+                          f'"none" to never run it. Default is "{probes.DU_COMMAND}"',
+                     default=probes.DU_COMMAND)
+    cli.add_argument('-A',
+                     dest='agent',
+                     help='Run as an agent instead of as a discord bot: serve this host\'s '
+                          'probes to a hub bot at "[host:]port" (host defaults to 127.0.0.1) '
+                          'or "unix:/path/to/socket". No token is needed in this mode',
+                     default=None)
+    cli.add_argument('-H',
+                     dest='agents',
+                     help='Hub mode: comma separated addresses of the agents queried by the '
+                          '"cluster" command (ex: node1:7000,node2:7000,unix:/run/hpc-bot.sock)',
+                     type=agents_argument,
+                     default=None)
     cli.add_argument('-c',
                      dest='config',
                      help='Config file path. Bot parameters will be loaded from config file. '
@@ -133,12 +330,15 @@ def arguments_handler():
                      type=path_argument,
                      default=None)
     cli_parsed = cli.parse_args()
+    cli_parsed.alerts = []
 
     if cli_parsed.config:
         cli_parsed = config_parser(cli, cli_parsed)
+    if cli_parsed.du == 'none':
+        cli_parsed.du = None
 
-    # token is required
-    if not cli_parsed.token:
+    # token is required (except for agents, which don't connect to discord)
+    if not cli_parsed.token and not cli_parsed.agent:
         cli.error('Bot token is required for bot to run (-t TOKEN)')
 
     return cli_parsed
@@ -151,32 +351,59 @@ def main():
     # command line interface stuff
     cli = arguments_handler()
 
-    # logging stuff
-    log_stderr_handler = logging.StreamHandler(sys.stderr)
-    log_file_handler = logging.FileHandler(filename=cli.log, encoding='utf-8', mode='a')
-    log_file_handler.setFormatter(logging.Formatter(
-        '%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
-    logging.basicConfig(level=logging.INFO, handlers=[log_stderr_handler, log_file_handler])
+    # logging stuff (records are written by a background thread)
+    log_listener = utils.setup_logging(sys.stderr, cli.log, rotation=cli.log_rotation,
+                                       json_lines=cli.log_format == 'json')
     logger = logging.getLogger('hpc-bot.main')
 
     # log arguments
     args = copy.deepcopy(vars(cli))
-    hashed_token = hashlib.sha256(args['token'].encode()).hexdigest()  # keep token private in log
-    args['token'] = f'sha256({hashed_token})'
+    if args['token']:
+        hashed_token = hashlib.sha256(args['token'].encode()).hexdigest()  # keep token private
+        args['token'] = f'sha256({hashed_token})'
     for arg, value in args.items():
         logger.info(f'Parameter:{arg}={value}')
     del args
 
+    # agent mode (no discord connection)
+    if cli.agent:
+        logger.info('Starting agent')
+        try:
+            asyncio.run(federation.run_agent(cli.agent, cli.cache_dir, cli.du))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            logger.info('Shutting down agent complete')
+            log_listener.stop()  # writes the records still queued
+        return
+
     # start bot
     logger.info('Starting bot')
-    bot = cogs.Bot(
-        nickname=cli.nickname,
-        avatar_path=cli.avatar,
-        bot_text_channel_name=cli.bot_text_channel,
-        prefix=cli.command_prefix
-    )
-    bot.run(cli.token)
-    logger.info('Shutting down bot complete')
+    try:
+        bot = cogs.Bot(cogs.BotSettings(
+            nickname=cli.nickname,
+            avatar_path=cli.avatar,
+            bot_text_channel_name=cli.bot_text_channel,
+            prefix=cli.command_prefix,
+            cache_dir=cli.cache_dir,
+            edit_interval=cli.edit_interval,
+            result_ttl=cli.result_ttl,
+            sample_interval=cli.sample_interval,
+            metrics_address=cli.metrics,
+            agents=cli.agents,
+            squeue=cli.squeue,
+            sacct=cli.sacct,
+            alerts=cli.alerts,
+            top_rows=cli.top_rows,
+            home_quota=cli.home_quota,
+            repquota=cli.repquota,
+            lfs=cli.lfs,
+            du_cmd=cli.du
+        ))
+        bot.run(cli.token)
+    finally:
+        logger.info('Shutting down bot complete')
+        log_listener.stop()  # writes the records still queued
 
 
 if __name__ == '__main__':
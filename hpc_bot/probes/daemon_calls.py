@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Blocking calls that may never return, each on a daemon thread
+
+A call blocked in the kernel (ex: statvfs of a dead NFS server) can't be cancelled, so running it
+in an executor and timing it out leaves that executor thread blocked for good. Each call here
+gets a daemon thread of its own instead, and a call that didn't return yet is shared by later
+calls with the same key, so a hung call holds a single thread however often it is retried.
+"""
+
+import asyncio
+import threading
+
+
+class DaemonCalls:
+    """
+    Runs blocking calls on daemon threads, one thread per key at most
+    """
+    def __init__(self):
+        self._pending = {}  # key: asyncio.Future of a call that didn't return yet
+
+    @staticmethod
+    def _run(loop, future, function, args):
+        try:
+            result = function(*args)
+            callback = future.set_result
+        except Exception as error:  # pylint: disable=broad-except
+            result = error
+            callback = future.set_exception
+
+        def resolve():
+            if not future.done():
+                callback(result)
+        try:
+            loop.call_soon_threadsafe(resolve)
+        except RuntimeError:  # loop closed while the call was blocked
+            pass
+
+    def call(self, key, function, *args):
+        """
+        Runs function(*args) on a new daemon thread, unless the call with the same key
+        didn't return yet, in which case that call is reused
+
+        Returns
+        -------
+        asyncio.Future
+            result of the call, shared with the other callers of the same key (see wait())
+        """
+        future = self._pending.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending[key] = future
+            future.add_done_callback(lambda _: self._pending.pop(key, None))
+            threading.Thread(target=self._run, args=(loop, future, function, args),
+                             name=f'daemon call {key}', daemon=True).start()
+        return future
+
+    async def wait(self, key, timeout, function, *args):
+        """
+        Same as call(), waiting at most 'timeout' seconds for the result
+        Timing out leaves the call running, for the next callers of the same key
+
+        Raises
+        ------
+        asyncio.TimeoutError
+            if the call didn't return in time
+        """
+        return await asyncio.wait_for(asyncio.shield(self.call(key, function, *args)), timeout)
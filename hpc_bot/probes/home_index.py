@@ -0,0 +1,500 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Incremental home folder usage index
+
+Keeps per-user disk usage of every /home folder in a persistent cache.
+Each directory is stored with its mtime, the size of the files directly inside it and its
+subdirectories. A directory whose mtime didn't change since the last scan is not listed again,
+so a rescan only costs one lstat per directory instead of one stat per file.
+Files that grow in place don't change their directory mtime, so a full scan is still done
+every FULL_SCAN_INTERVAL seconds.
+Home folders are walked concurrently by a bounded pool of threads, each for HOME_SCAN_DEADLINE
+seconds at most: a huge or hung home folder is recorded as partial (a lower bound) instead of
+holding up the whole scan, and the directories it did list are reused by the next scan.
+Home folders are usually only readable by their owner: the ones the bot user can't fully read
+are measured with a privileged du command (ex: "sudo -n du") instead, and reported as unreadable
+if that fails too, instead of as a lower bound of a few KiB. A du total is reused by the next
+scans while the home folder's mtime and the size the bot could read don't change, so that du
+only runs again on full scans or when something changed.
+"""
+
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import shlex
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+
+
+HOME_PATH = '/home'
+SCAN_INTERVAL = 60 * 60  # 1 hour
+FULL_SCAN_INTERVAL = 24 * 60 * 60  # 1 day
+DU_COMMAND = 'sudo -n du'
+DU_TIMEOUT = 10 * 60  # seconds
+HOME_SCAN_WORKERS = 8
+HOME_SCAN_DEADLINE = 60  # seconds each home folder is measured for (walk and du), at most
+HOME_SCAN_GRACE = 5  # seconds a walk blocked in a system call is waited for after its deadline
+DEADLINE_CHECK_ENTRIES = 1024  # entries listed between deadline checks, inside a directory
+
+
+@dataclass
+class HomeWalk:
+    """
+    Progress of a home folder measurement, updated by the thread measuring it
+    """
+    user: str = None
+    started: float = None  # monotonic timestamp
+    size: int = 0  # bytes
+    readable: str = 'all'  # "all", "some" or "none" (the home folder itself couldn't be listed)
+    timed_out: bool = False  # deadline reached, size is a lower bound
+    listed: int = 0  # directories listed
+    reused: int = 0  # directories reused from the cache
+    directories: dict = field(default_factory=dict)  # readable directories, see HomeIndex
+    du_usage: list = None  # see HomeIndex.du_usage
+    du_error: OSError = None
+    done: bool = False
+
+
+def home_users(root=HOME_PATH):
+    """
+    Names of the folders in root (one per user)
+    Blocking, run it in an executor
+    """
+    with os.scandir(root) as entries:
+        return sorted(entry.name for entry in entries if entry.is_dir(follow_symlinks=False))
+
+
+def privileged_usage(du_cmd, path, timeout=DU_TIMEOUT):
+    """
+    Disk usage of everything under path, in bytes, from 'du -sk'
+    du_cmd can include arguments (ex: "sudo -n du"), to measure folders the bot user can't read
+    Blocking, run it in an executor
+
+    Raises
+    ------
+    OSError
+        if du can't be run, times out or can't read all of path
+    """
+    try:
+        completed = subprocess.run(shlex.split(du_cmd) + ['-sk', '--', path],
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   universal_newlines=True, timeout=timeout, check=False)
+    except subprocess.TimeoutExpired:
+        raise OSError(f'"{du_cmd}" timed out after {timeout:.1f}s')
+    # du also exits with an error when it could only read part of path
+    if completed.returncode != 0 or not completed.stdout.split():
+        raise OSError(f'"{du_cmd}" exited with code {completed.returncode}: '
+                      f'{completed.stderr.strip()}')
+    return int(completed.stdout.split()[0]) * 1024
+
+
+class HomeIndex:
+    """
+    Persistent, incrementally updated index of each user's /home folder disk usage
+
+    Parameters
+    ----------
+    cache_file: os.PathLike
+        file where the index is persisted between restarts
+    root: str
+        folder containing each user's home folder
+    interval: int
+        seconds between background scans
+    du_cmd: str
+        du command (see privileged_usage) that measures the home folders the bot user can't
+        fully read. None to only report them as partial or unreadable
+    """
+    def __init__(self, cache_file, root=HOME_PATH, interval=SCAN_INTERVAL, du_cmd=DU_COMMAND):
+        self.logger = logging.getLogger('hpc-bot.HomeIndex')
+        self.cache_file = cache_file
+        self.root = root
+        self.interval = interval
+        self.du_cmd = du_cmd
+
+        self.usage = {}  # user: bytes
+        self.partial = set()  # users with folders that couldn't be read (usage is a lower bound)
+        self.unreadable = set()  # users whose home folder couldn't be read at all (no usage)
+        self.directories = {}  # path: [mtime_ns, files size, subdirectory names]
+        self.du_usage = {}  # user: [home folder mtime_ns, bytes read by the bot, bytes from du]
+        self.last_scan = None  # timestamp
+        self.last_full_scan = 0  # timestamp
+        self.workers = HOME_SCAN_WORKERS
+        self.deadline = HOME_SCAN_DEADLINE
+
+        self._lock = threading.Lock()
+        self._measured = None  # user: (bytes or None, partial) of the running scan
+        self._listeners = []  # called with (user, bytes or None, partial), then None at the end
+
+        self._refresh_requested = None  # asyncio.Event, created inside the running loop
+        self._scan_finished = None
+        self._scans_started = 0
+        self._scans_finished = 0
+
+    def load(self):
+        """
+        Loads the index from cache_file, if it exists
+        """
+        try:
+            with open(self.cache_file) as cache:
+                data = json.load(cache)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as error:
+            self.logger.warning(f'Ignoring unreadable home index "{self.cache_file}": {error}')
+            return
+
+        if data.get('root') != self.root:
+            return
+        self.usage = data['usage']
+        self.partial = set(data['partial'])
+        self.unreadable = set(data.get('unreadable', ()))
+        self.directories = data['directories']
+        self.du_usage = data.get('du_usage', {})
+        self.last_scan = data['last_scan']
+        self.last_full_scan = data['last_full_scan']
+
+    def save(self):
+        """
+        Atomically writes the index to cache_file
+        """
+        data = {
+            'root': self.root,
+            'usage': self.usage,
+            'partial': sorted(self.partial),
+            'unreadable': sorted(self.unreadable),
+            'directories': self.directories,
+            'du_usage': self.du_usage,
+            'last_scan': self.last_scan,
+            'last_full_scan': self.last_full_scan,
+        }
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        temporary_file = f'{self.cache_file}.tmp'
+        with open(temporary_file, 'w') as cache:
+            json.dump(data, cache)
+        os.replace(temporary_file, self.cache_file)
+
+    def scan(self, full=False):
+        """
+        Rescans every home folder, reusing cached directories whose mtime didn't change
+        Home folders are walked 'workers' at a time, each for 'deadline' seconds at most
+        Home folders that can't be fully read are measured with du_cmd instead (reusing the
+        du total of the last scan if they didn't change, unless full), in what is left of
+        their deadline
+        Blocking, run it in an executor
+
+        Returns
+        -------
+        (int, int)
+            number of directories listed and number of directories reused from the cache
+        """
+        with self._lock:
+            self._measured = {}
+        try:
+            return self._scan(full)
+        finally:
+            with self._lock:
+                self._measured = None
+                for listener in self._listeners:
+                    listener(None)
+                self._listeners.clear()
+
+    def _scan(self, full):
+        old_directories = {} if full else self.directories
+        try:
+            users = home_users(self.root)
+        except OSError as error:
+            self.logger.error(f'Could not list "{self.root}": {error}')
+            return 0, 0
+
+        walks = {user: HomeWalk(user) for user in users}
+        executor = ThreadPoolExecutor(self.workers, thread_name_prefix='home-scan')
+        stop = threading.Event()
+        futures = {executor.submit(self._measure_home, walks[user], old_directories, full, stop):
+                   user for user in users}
+        try:
+            self._wait_for_homes(futures, walks)
+        finally:
+            stop.set()
+            executor.shutdown(wait=False)
+
+        new_directories = {}
+        du_usage = {}
+        for walk in walks.values():
+            if walk.done:  # homes still blocked (ex: hung network mount) are walked next time
+                new_directories.update(walk.directories)
+                if walk.du_usage is not None:
+                    du_usage[walk.user] = walk.du_usage
+        with self._lock:
+            measured = dict(self._measured)
+        self.usage = {user: usage for user, (usage, _) in measured.items() if usage is not None}
+        self.partial = {user for user, (usage, partial_usage) in measured.items()
+                        if usage is not None and partial_usage}
+        self.unreadable = {user for user, (usage, _) in measured.items() if usage is None}
+        self.directories = new_directories
+        self.du_usage = du_usage
+        self.last_scan = time.time()
+        if full:
+            self.last_full_scan = self.last_scan
+
+        du_errors = [walk.du_error for walk in walks.values() if walk.du_error is not None]
+        if self.partial or self.unreadable:
+            du_failure = f'. Last du error: {du_errors[-1]}' if du_errors else ''
+            self.logger.warning(f'{len(self.unreadable)} home folders could not be read and '
+                                f'{len(self.partial)} only partially (see the -du option)'
+                                f'{du_failure}')
+        return (sum(walk.listed for walk in walks.values()),
+                sum(walk.reused for walk in walks.values()))
+
+    def _wait_for_homes(self, futures, walks):
+        """
+        Waits for each home folder to be measured, giving up on the ones blocked in a system
+        call past their deadline (they are recorded as partial)
+        """
+        pending = set(futures)
+        while pending:
+            started = [walks[futures[future]].started for future in pending
+                       if walks[futures[future]].started is not None]
+            timeout = min(started) + self.deadline + HOME_SCAN_GRACE - time.monotonic() \
+                if started else self.deadline
+            done, pending = concurrent.futures.wait(pending, max(timeout, 0),
+                                                    concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                future.result()
+            now = time.monotonic()
+            for future in list(pending):
+                walk = walks[futures[future]]
+                if walk.started is not None and \
+                        now > walk.started + self.deadline + HOME_SCAN_GRACE:
+                    pending.discard(future)
+                    self._record(walk.user, walk.size, True)
+
+    def _measure_home(self, walk, old_directories, full, stop):
+        """
+        Walks a home folder (see _walk_home), then runs du on it if it couldn't be fully read,
+        and records its usage
+        Blocking, runs in a pool thread
+        """
+        user = walk.user
+        walk.started = time.monotonic()
+        end = walk.started + self.deadline
+        home = os.path.join(self.root, user)
+        self._walk_home(home, walk, old_directories, end, stop)
+
+        remaining = end - time.monotonic()
+        if walk.readable != 'all' and self.du_cmd and remaining > 0 and not stop.is_set():
+            try:
+                walk.size = self._du_home(user, walk, full, remaining)
+                walk.readable = 'all'
+                walk.timed_out = False
+            except OSError as error:
+                walk.du_error = error
+        walk.done = True
+        if walk.readable == 'none' and not walk.timed_out:
+            self._record(user, None, True)
+        else:
+            self._record(user, walk.size, walk.readable != 'all' or walk.timed_out)
+
+    def _record(self, user, usage, partial_usage):
+        """
+        Records the usage of a home folder (None if unreadable) and passes it to the listeners
+        """
+        with self._lock:
+            if self._measured is None or user in self._measured:
+                return
+            self._measured[user] = (usage, partial_usage)
+            for listener in self._listeners:
+                listener((user, usage, partial_usage))
+
+    def _du_home(self, user, walk, full, timeout):
+        """
+        Disk usage of a home folder the bot couldn't fully read, from du_cmd. The total of the
+        last scan is reused if the home folder's mtime and the size walked didn't change,
+        unless full. The total is kept in walk.du_usage
+
+        Raises
+        ------
+        OSError
+            if du fails or takes longer than timeout
+        """
+        home = os.path.join(self.root, user)
+        try:
+            mtime = os.lstat(home).st_mtime_ns
+        except OSError:
+            mtime = None
+        cached = None if full else self.du_usage.get(user)
+        if mtime is not None and cached and cached[:2] == [mtime, walk.size]:
+            total = cached[2]
+        else:
+            total = privileged_usage(self.du_cmd, home, timeout)
+        if mtime is not None:
+            walk.du_usage = [mtime, walk.size, total]
+        return total
+
+    @staticmethod
+    def _walk_home(home, walk, old_directories, end, stop):
+        """
+        Adds up the disk usage of a home folder into walk, reusing the directories of
+        old_directories whose mtime didn't change, until done, past end or stop is set.
+        Readable directories are added to walk.directories (unreadable ones aren't, so that
+        the next scan lists them again)
+        """
+        stack = [home]
+        while stack:
+            if stop.is_set() or time.monotonic() > end:
+                walk.timed_out = True
+                return
+            path = stack.pop()
+            try:
+                path_stat = os.lstat(path)
+            except OSError:
+                walk.readable = 'none' if path == home else 'some'
+                continue
+
+            cached = old_directories.get(path)
+            if cached and cached[0] == path_stat.st_mtime_ns:
+                _, files_size, subdirectories = cached
+                readable = True
+                walk.reused += 1
+            else:
+                files_size, subdirectories, readable = HomeIndex._list_directory(path, end)
+                walk.listed += 1
+                if not readable:
+                    empty = not files_size and not subdirectories
+                    walk.readable = 'none' if path == home and empty else 'some'
+
+            if readable:
+                walk.directories[path] = [path_stat.st_mtime_ns, files_size, subdirectories]
+            walk.size += files_size + path_stat.st_blocks * 512
+            stack.extend(os.path.join(path, subdirectory) for subdirectory in subdirectories)
+
+    @staticmethod
+    def _list_directory(path, end=None):
+        """
+        Lists a single directory, stopping past end (a time.monotonic() timestamp)
+
+        Returns
+        -------
+        (int, list, bool)
+            disk usage of the files directly inside path, subdirectory names and
+            False if the directory (or some of its entries) couldn't be read, or end was reached
+        """
+        files_size = 0
+        subdirectories = []
+        readable = True
+        try:
+            with os.scandir(path) as entries:
+                for number, entry in enumerate(entries, 1):
+                    if end is not None and number % DEADLINE_CHECK_ENTRIES == 0 and \
+                            time.monotonic() > end:
+                        return files_size, subdirectories, False
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirectories.append(entry.name)
+                        else:
+                            files_size += entry.stat(follow_symlinks=False).st_blocks * 512
+                    except OSError:
+                        readable = False
+        except OSError:
+            readable = False
+        return files_size, subdirectories, readable
+
+    async def run(self, loop):
+        """
+        Background task. Scans every 'interval' seconds or when a refresh is requested
+        """
+        self._refresh_requested = asyncio.Event()
+        self._scan_finished = asyncio.Event()
+        await loop.run_in_executor(None, self.load)
+
+        while True:
+            full = time.time() - self.last_full_scan >= FULL_SCAN_INTERVAL
+            start = time.perf_counter()
+            self._scans_started += 1
+            try:
+                listed, reused = await loop.run_in_executor(None, partial(self.scan, full=full))
+                await loop.run_in_executor(None, self.save)
+            except Exception:  # pylint: disable=broad-except
+                self.logger.exception('Error while scanning home folders')
+            else:
+                self.logger.info(f'Home folders scanned in {time.perf_counter() - start:.2f}s '
+                                 f'({"full" if full else "incremental"}, {listed} directories '
+                                 f'listed, {reused} reused)')
+
+            # wake up whoever is waiting for a refresh
+            self._scans_finished += 1
+            self._scan_finished.set()
+            self._scan_finished.clear()
+
+            try:
+                await asyncio.wait_for(self._refresh_requested.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._refresh_requested.clear()
+
+    async def refresh(self):
+        """
+        Requests an immediate rescan, skipping the wait for the next scheduled one,
+        and waits for it to finish
+        If a scan is already running, waits for the one after it, which sees newer changes
+        """
+        if self._refresh_requested is None:  # background task not started
+            return
+        wanted_scan = self._scans_started + 1
+        self._refresh_requested.set()
+        while self._scans_finished < wanted_scan:
+            await self._scan_finished.wait()
+
+    async def follow_scan(self):
+        """
+        Yields (user, bytes or None if unreadable, partial) for each home folder of the running
+        scan as it is measured, including the ones measured before the call
+        If no scan is running, a new one is requested (see refresh)
+        """
+        if self._refresh_requested is None:  # background task not started
+            return
+        loop = asyncio.get_running_loop()
+        rows = asyncio.Queue()
+
+        def listener(row):
+            loop.call_soon_threadsafe(rows.put_nowait, row)
+
+        with self._lock:
+            measured = list(self._measured.items()) if self._measured is not None else []
+            self._listeners.append(listener)
+            if self._measured is None:
+                self._refresh_requested.set()
+        try:
+            for user, (usage, partial_usage) in measured:
+                yield user, usage, partial_usage
+            while True:
+                row = await rows.get()
+                if row is None:
+                    return
+                yield row
+        finally:
+            with self._lock:
+                if listener in self._listeners:
+                    self._listeners.remove(listener)
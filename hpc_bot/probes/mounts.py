@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Per-mount storage usage, from /proc/self/mountinfo and statvfs
+
+The mount list is parsed again only when the kernel reports that mountinfo changed (poll on
+the open file, see proc(5)). statvfs of each mount runs in its own daemon thread (see
+DaemonCalls), waited for with a timeout, so a hung mount (ex: dead NFS server) only marks that
+mount as not responding. A statvfs still blocked is reused by later probes of the same mount.
+"""
+
+import asyncio
+import os
+import re
+import select
+from dataclasses import dataclass
+
+from .daemon_calls import DaemonCalls
+from .system import PROC_PATH, Disk
+
+
+STATVFS_TIMEOUT = 5  # seconds
+# filesystems that don't store user data (not listed by the storage command)
+PSEUDO_FILESYSTEMS = frozenset((
+    'autofs', 'binfmt_misc', 'bpf', 'cgroup', 'cgroup2', 'configfs', 'debugfs', 'devpts',
+    'devtmpfs', 'efivarfs', 'fusectl', 'hugetlbfs', 'mqueue', 'nsfs', 'proc', 'pstore', 'ramfs',
+    'rpc_pipefs', 'securityfs', 'selinuxfs', 'squashfs', 'sysfs', 'tmpfs', 'tracefs'))
+
+
+@dataclass(frozen=True)
+class Mount:
+    """
+    A mounted filesystem, from a line of /proc/self/mountinfo
+    """
+    device: str  # major:minor
+    path: str
+    fstype: str
+    source: str
+
+
+@dataclass(frozen=True)
+class MountUsage:
+    """
+    Space and inode usage of a mount, or why it couldn't be read
+    """
+    mount: Mount
+    disk: Disk = None
+    inodes: int = 0
+    inodes_free: int = 0
+    error: str = None
+
+    @property
+    def inodes_percentage(self):
+        """used inodes / inodes, rounded up (same as df -i)"""
+        if not self.inodes:
+            return 0
+        return -(-(self.inodes - self.inodes_free) * 100 // self.inodes)
+
+
+def unescape_mountinfo(field):
+    """
+    Decodes the octal escapes (ex: \\040 for a space) of a mountinfo field
+    """
+    return re.sub(r'\\([0-7]{3})', lambda match: chr(int(match.group(1), 8)), field)
+
+
+def parse_mountinfo_line(line):
+    """
+    Parses a /proc/self/mountinfo line:
+    'id parent major:minor root mount_point options [optional fields...] - type source options'
+
+    Returns
+    -------
+    Mount or None
+        None if line is malformed
+    """
+    fields = line.split()
+    try:
+        separator = fields.index('-', 6)
+        return Mount(device=fields[2],
+                     path=unescape_mountinfo(fields[4]),
+                     fstype=fields[separator + 1],
+                     source=unescape_mountinfo(fields[separator + 2]))
+    except (ValueError, IndexError):
+        return None
+
+
+def real_mounts(mountinfo):
+    """
+    Mounts of mountinfo (its text) that store data, in mount order
+    A path mounted over keeps only its last mount, a device mounted more than once (ex: bind
+    mounts) only its first mount
+    """
+    by_path = {}
+    for line in mountinfo.splitlines():
+        mount = parse_mountinfo_line(line)
+        if mount is not None and mount.fstype not in PSEUDO_FILESYSTEMS:
+            by_path.pop(mount.path, None)
+            by_path[mount.path] = mount
+
+    mounts = []
+    seen_devices = set()
+    for mount in by_path.values():
+        if mount.device not in seen_devices:
+            seen_devices.add(mount.device)
+            mounts.append(mount)
+    return mounts
+
+
+def statvfs_disk(stats):
+    """
+    Space of a filesystem, from its os.statvfs result
+    """
+    return Disk(size=stats.f_blocks * stats.f_frsize,
+                used=(stats.f_blocks - stats.f_bfree) * stats.f_frsize,
+                available=stats.f_bavail * stats.f_frsize)
+
+
+def total_disk(usages):
+    """
+    Sums the space of the MountUsages that could be read, as the total line of 'df --total'
+    """
+    disks = [usage.disk for usage in usages if usage.error is None]
+    return Disk(size=sum(disk.size for disk in disks),
+                used=sum(disk.used for disk in disks),
+                available=sum(disk.available for disk in disks))
+
+
+class MountTable:
+    """
+    Cached list of real mounts and their usage
+
+    Parameters
+    ----------
+    proc_path: str
+        /proc mount point
+    timeout: float
+        seconds to wait for the statvfs of each mount
+    """
+    def __init__(self, proc_path=PROC_PATH, timeout=STATVFS_TIMEOUT):
+        self.mountinfo_path = os.path.join(proc_path, 'self', 'mountinfo')
+        self.timeout = timeout
+        self.mounts = []  # probes.Mount
+        self.reads = 0  # times mountinfo was parsed
+        self._mountinfo = None  # open mountinfo file
+        self._poll = None
+        self._statvfs_calls = DaemonCalls()  # keyed by mount path
+
+    def refresh(self):
+        """
+        Parses mountinfo again if it changed since the last time it was read
+
+        Returns
+        -------
+        bool
+            True if the mount list was read again
+        """
+        if self._mountinfo is None:
+            self._mountinfo = open(self.mountinfo_path)
+            try:
+                self._poll = select.poll()
+                self._poll.register(self._mountinfo, select.POLLPRI | select.POLLERR)
+            except AttributeError:  # no poll on this platform, read every time
+                self._poll = None
+        elif self._poll is not None and not self._poll.poll(0):
+            return False
+
+        self._mountinfo.seek(0)
+        self.mounts = real_mounts(self._mountinfo.read())
+        self.reads += 1
+        return True
+
+    def close(self):
+        """
+        Closes mountinfo
+        """
+        if self._mountinfo is not None:
+            self._mountinfo.close()
+            self._mountinfo = self._poll = None
+
+    async def probe(self, mount):
+        """
+        Reads the usage of a mount, waiting at most 'timeout' seconds
+
+        Returns
+        -------
+        MountUsage
+        """
+        try:
+            stats = await self._statvfs_calls.wait(mount.path, self.timeout, os.statvfs,
+                                                   mount.path)
+        except asyncio.TimeoutError:
+            return MountUsage(mount, error='not responding')
+        except OSError as error:
+            return MountUsage(mount, error=error.strerror or str(error))
+
+        return MountUsage(mount, disk=statvfs_disk(stats), inodes=stats.f_files,
+                          inodes_free=stats.f_ffree)
+
+    async def disk_of(self, path):
+        """
+        Reads the usage of the filesystem containing path, waiting at most 'timeout' seconds
+
+        Returns
+        -------
+        Disk
+
+        Raises
+        ------
+        asyncio.TimeoutError
+            if statvfs didn't return in time
+        OSError
+            if path can't be read
+        """
+        stats = await self._statvfs_calls.wait(path, self.timeout, os.statvfs, path)
+        return statvfs_disk(stats)
+
+    async def usage(self):
+        """
+        Probes every mount concurrently
+        Mounts with no blocks (ex: autofs placeholders) are left out, as df does
+
+        Returns
+        -------
+        list of MountUsage
+            in mount order
+        """
+        self.refresh()
+        usages = await asyncio.gather(*(self.probe(mount) for mount in self.mounts))
+        return [usage for usage in usages if usage.error is not None or usage.disk.size]
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Per-user and per-process CPU and memory usage, from /proc
+
+Each scan reads /proc/[pid]/stat of every process. CPU usage is the difference of CPU time
+against the previous scan, kept in a compact cache of pid: (start time, CPU ticks, uid).
+/proc/[pid]/status is only read for processes that weren't in the cache (to get their uid).
+Blocking, run scans in an executor.
+"""
+
+import os
+import pwd
+import threading
+import time
+from functools import lru_cache
+
+from .system import PROC_PATH
+
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+@lru_cache(maxsize=4096)
+def user_name(uid):
+    """
+    Name of the user with uid, the uid itself if it has no name
+    """
+    try:
+        return pwd.getpwuid(uid).pw_name
+    except KeyError:
+        return str(uid)
+
+
+class ProcessScanner:
+    """
+    Incremental /proc process scanner
+
+    Parameters
+    ----------
+    proc_path: str
+        /proc mount point
+    """
+    def __init__(self, proc_path=PROC_PATH):
+        self.proc_path = proc_path
+        self.processes = {}  # pid: (start time, CPU ticks, uid)
+        self.last_scan = None  # monotonic timestamp
+        self._lock = threading.Lock()
+
+    def _read_uid(self, pid):
+        with open(f'{self.proc_path}/{pid}/status', 'rb') as status:
+            for line in status:
+                if line.startswith(b'Uid:'):
+                    return int(line.split()[1])  # real uid
+        return None
+
+    def stale(self, max_age):
+        """
+        True if there is no scan younger than max_age seconds to measure CPU usage against
+        """
+        return self.last_scan is None or time.monotonic() - self.last_scan > max_age
+
+    def scan(self):
+        """
+        Reads every process and computes its CPU usage since the previous scan
+
+        Returns
+        -------
+        (dict, dict, int, float or None)
+            {user: [cpu %, rss bytes, processes]}, {process name: [cpu %, rss bytes, processes]},
+            number of processes and seconds since the previous scan (None if this is the first
+            scan, in which case CPU % are all 0)
+        """
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self.last_scan if self.last_scan is not None else None
+            previous = self.processes
+            processes = {}
+            by_user = {}
+            by_name = {}
+
+            with os.scandir(self.proc_path) as entries:
+                pids = [entry.name for entry in entries if entry.name.isdigit()]
+
+            for pid in pids:
+                try:
+                    with open(f'{self.proc_path}/{pid}/stat', 'rb') as stat_file:
+                        stat = stat_file.read()
+                except OSError:  # process ended
+                    continue
+                name_end = stat.rfind(b')')
+                name = stat[stat.find(b'(') + 1:name_end].decode(errors='replace')
+                fields = stat[name_end + 2:].split()
+                ticks = int(fields[11]) + int(fields[12])  # utime + stime
+                start_time = int(fields[19])
+                rss = int(fields[21]) * PAGE_SIZE
+
+                cached = previous.get(pid)
+                if cached is not None and cached[0] == start_time:
+                    previous_ticks, uid = cached[1], cached[2]
+                else:  # new process (or pid reused)
+                    try:
+                        uid = self._read_uid(pid)
+                    except OSError:
+                        continue
+                    previous_ticks = 0 if elapsed is not None else ticks
+                processes[pid] = (start_time, ticks, uid)
+
+                cpu = 0.0
+                if elapsed:
+                    cpu = (ticks - previous_ticks) / CLOCK_TICKS / elapsed * 100
+                for aggregates, key in ((by_user, uid), (by_name, name)):
+                    totals = aggregates.get(key)
+                    if totals is None:
+                        aggregates[key] = [cpu, rss, 1]
+                    else:
+                        totals[0] += cpu
+                        totals[1] += rss
+                        totals[2] += 1
+
+            self.processes = processes
+            self.last_scan = now
+            by_user = {user_name(uid): totals for uid, totals in by_user.items()}
+            return by_user, by_name, len(processes), elapsed
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Per-user home folder usage from filesystem quota reports
+
+Filesystems that track quotas know each user's usage without walking the tree:
+repquota (ext2/3/4 and XFS user quotas) reports every user at once and 'lfs quota' (Lustre)
+one user at a time. Quotas cover a whole filesystem, so they are only used when /home is
+a mount point of its own.
+"""
+
+import asyncio
+import logging
+import re
+import shlex
+import time
+
+from .home_index import HOME_PATH, home_users
+
+
+REPQUOTA_COMMAND = 'repquota'
+LFS_COMMAND = 'lfs'
+QUOTA_SOURCES = ('auto', 'repquota', 'lfs', 'none')
+REPQUOTA_FILESYSTEMS = ('xfs', 'ext4', 'ext3', 'ext2')
+QUOTA_RETRY = 60 * 60  # seconds before a quota source that failed is tried again
+# 'user  --  used  soft  hard  [grace]  files ...', sizes in KiB
+REPQUOTA_LINE = re.compile(r'^(\S+)\s+[-+]{2}\s+(\d+)\s')
+# 'user  filesystem  used[*]  quota  limit ...' (user prepended to 'lfs quota -q'), in KiB
+LFS_LINE = re.compile(r'^(\S+)\s+\S+\s+(\d+)\*?\s')
+
+
+def quote_command(command):
+    """
+    Quotes each word of command (ex: "sudo repquota") for the shell
+    """
+    return ' '.join(shlex.quote(word) for word in shlex.split(command))
+
+
+class HomeQuota:
+    """
+    Reads per-user usage of the home folders from quota reports, when the filesystem has them
+
+    Parameters
+    ----------
+    source: str
+        one of QUOTA_SOURCES. "auto" picks repquota or lfs from the filesystem of root
+    repquota: str
+        repquota command, can include arguments (ex: "sudo repquota"). A stub printing
+        fixture output can be used instead
+    lfs: str
+        lfs command
+    root: str
+        folder containing each user's home folder
+    """
+    def __init__(self, source='auto', repquota=REPQUOTA_COMMAND, lfs=LFS_COMMAND,
+                 root=HOME_PATH):
+        self.logger = logging.getLogger('hpc-bot.HomeQuota')
+        self.source = source
+        self.repquota = repquota
+        self.lfs = lfs
+        self.root = root
+        self._retry_after = {}  # source: monotonic timestamp, for sources that failed
+
+    def detect(self, mounts):
+        """
+        Quota source of root, from the list of mounts (probes.Mount)
+
+        Returns
+        -------
+        (str, str) or None
+            source and filesystem type (None if source isn't "auto"),
+            None if there is no quota source
+        """
+        if self.source != 'auto':
+            return None if self.source == 'none' else (self.source, None)
+        mount = next((mount for mount in mounts if mount.path == self.root), None)
+        if mount is None:
+            return None
+        if mount.fstype == 'lustre':
+            return 'lfs', mount.fstype
+        if mount.fstype in REPQUOTA_FILESYSTEMS:
+            return 'repquota', mount.fstype
+        return None
+
+    def repquota_cmd(self):
+        """shell command run to get all user quotas"""
+        return f'{quote_command(self.repquota)} -u -p {shlex.quote(self.root)}'
+
+    def lfs_cmd(self, users):
+        """shell command run to get the quota of each user, each line starting with the user"""
+        return '; '.join(
+            f'echo {shlex.quote(user)} $({quote_command(self.lfs)} quota -q -u '
+            f'{shlex.quote(user)} {shlex.quote(self.root)})' for user in users)
+
+    async def read(self, shell_workers, mount_table):
+        """
+        Reads the usage of each home folder owner from the quota report of their filesystem
+
+        Parameters
+        ----------
+        shell_workers: ShellWorkerPool
+            where repquota or lfs run
+        mount_table: MountTable
+            mounts, to find the filesystem of root
+
+        Returns
+        -------
+        (dict, str) or None
+            {user: bytes} and a description of the source (ex: "repquota (xfs)"),
+            None if there is no usable quota source
+
+        Raises
+        ------
+        ShellWorkerError
+            if the worker died while running the quota command
+        """
+        loop = asyncio.get_running_loop()
+        mount_table.refresh()
+        detected = self.detect(mount_table.mounts)
+        if detected is None:
+            return None
+        source, fstype = detected
+        if time.monotonic() < self._retry_after.get(source, 0):
+            return None
+
+        try:
+            users = await loop.run_in_executor(None, home_users, self.root)
+        except OSError as error:
+            self.logger.error(f'Could not list "{self.root}": {error}')
+            return None
+
+        if source == 'lfs':
+            cmd, line_format = self.lfs_cmd(users), LFS_LINE
+        else:
+            cmd, line_format = self.repquota_cmd(), REPQUOTA_LINE
+        quotas = {}
+
+        async def handle_line(line):
+            match = line_format.match(line)
+            if match:
+                quotas[match.group(1)] = int(match.group(2)) * 1024
+
+        returncode, runtime, stderr = await shell_workers.run(cmd, handle_line)
+        if returncode != 0 or not quotas:
+            self.logger.warning(f'No usable {source} quota report for "{self.root}" '
+                                f'(return code {returncode}): {stderr.strip()}. '
+                                f'Scanning home folders instead')
+            self._retry_after[source] = time.monotonic() + QUOTA_RETRY
+            return None
+
+        self.logger.info(f'Read {source} quotas of {len(quotas)} users in {runtime}s')
+        usage = {user: quotas.get(user, 0) for user in users}
+        return usage, f'{source} ({fstype})' if fstype else source
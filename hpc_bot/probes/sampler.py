@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Background system metrics sampler
+
+Samples load, memory, swap and disk usage periodically into a fixed size ring buffer
+Disk usage is summed over every mount, as in the status command. Mounts, and paths sampled on their
+own (alert rules), are probed apart from the system snapshot, each with a timeout (see MountTable),
+so a hung mount doesn't hold back the other metrics
+"""
+
+import asyncio
+import dataclasses
+import logging
+import time
+import numpy
+
+from .mounts import MountTable, total_disk
+from .system import collect_snapshot
+
+
+SAMPLE_INTERVAL = 60  # seconds
+HISTORY_DURATION = 7 * 24 * 60 * 60  # 1 week
+SAMPLE_TIMEOUT = 30  # seconds
+
+# sampled metrics: load is the 1 minute load average, all others are percentages of use
+METRICS = ('load', 'memory', 'swap', 'disk')
+PERCENTILES = (50, 95, 99)
+
+
+class RingBuffer:
+    """
+    Fixed size buffer of timestamped samples, backed by numpy arrays
+    When full, new samples overwrite the oldest ones
+
+    Parameters
+    ----------
+    size: int
+        maximum number of samples
+    columns: int
+        number of values in each sample
+    """
+    def __init__(self, size, columns):
+        self.size = size
+        self.timestamps = numpy.zeros(size, dtype=numpy.float64)
+        self.values = numpy.zeros((size, columns), dtype=numpy.float32)
+        self.count = 0  # samples ever appended
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def append(self, timestamp, values):
+        """
+        Adds a sample, overwriting the oldest one if full
+        """
+        position = self.count % self.size
+        self.timestamps[position] = timestamp
+        self.values[position] = values
+        self.count += 1
+
+    def window(self, seconds, now=None):
+        """
+        Samples from the last 'seconds' seconds, oldest first
+
+        Returns
+        -------
+        (numpy.ndarray, numpy.ndarray)
+            timestamps (n,) and values (n, columns)
+        """
+        now = time.time() if now is None else now
+        # roll so that samples are in chronological order
+        start = self.count % self.size if self.count > self.size else 0
+        order = numpy.roll(numpy.arange(len(self)), -start)
+        timestamps = self.timestamps[order]
+        mask = timestamps >= now - seconds
+        return timestamps[mask], self.values[order][mask]
+
+    @property
+    def last_timestamp(self):
+        """timestamp of the newest sample, None if empty"""
+        if not self.count:
+            return None
+        return float(self.timestamps[(self.count - 1) % self.size])
+
+
+class MetricsSampler:
+    """
+    Periodically samples the system and keeps the results in a RingBuffer
+
+    Parameters
+    ----------
+    interval: float
+        seconds between samples
+    duration: float
+        seconds of history to keep
+    mount_table: MountTable
+        probes the disk usage of every mount and of 'mounts' (a new one if None)
+    """
+    def __init__(self, interval=SAMPLE_INTERVAL, duration=HISTORY_DURATION, mount_table=None):
+        self.logger = logging.getLogger('hpc-bot.MetricsSampler')
+        self.interval = interval
+        self.metrics = METRICS  # columns of history values
+        self.history = RingBuffer(max(int(duration // interval), 1), len(METRICS))
+        self.latest = None  # last probes.SystemSnapshot
+        self.mounts = ()  # paths whose disk usage is also sampled on its own
+        self.mount_table = mount_table if mount_table is not None else MountTable()
+        self.latest_mounts = {}  # path: probes.Disk, of the last sample
+        self.listeners = []  # called with (snapshot, mounts) after each sample
+
+    @staticmethod
+    def sample_values(snapshot):
+        """
+        Converts a probes.SystemSnapshot into a row of METRICS values
+        """
+        def percentage(used, total):
+            return used * 100 / total if total else 0
+
+        return (snapshot.load.one,
+                percentage(snapshot.memory.used, snapshot.memory.total),
+                percentage(snapshot.swap.used, snapshot.swap.total),
+                percentage(snapshot.disk.used, snapshot.disk.used + snapshot.disk.available))
+
+    async def sample_disk(self, path):
+        """
+        Disk usage of the filesystem containing path, None if it can't be read or doesn't respond
+        """
+        try:
+            return await self.mount_table.disk_of(path)
+        except asyncio.TimeoutError:
+            self.logger.warning(f'Could not sample disk usage of {path}: not responding')
+        except OSError as error:
+            self.logger.warning(f'Could not sample disk usage of {path}: {error}')
+        return None
+
+    async def sample_mounts(self):
+        """
+        Disk usage of each of 'mounts', probed concurrently
+        Mounts that can't be read or don't respond are left out
+        """
+        paths = tuple(self.mounts)
+        disks = await asyncio.gather(*(self.sample_disk(path) for path in paths))
+        return {path: disk for path, disk in zip(paths, disks) if disk is not None}
+
+    async def run(self, loop):
+        """
+        Background task. Samples every 'interval' seconds
+        A sample still blocked (ex: statvfs on a hung mount) is waited for instead of piling up
+        new ones in the executor
+        """
+        pending = None
+        while True:
+            if pending is None or pending.done():
+                pending = loop.run_in_executor(None, collect_snapshot, ())
+            try:
+                snapshot = await asyncio.wait_for(asyncio.shield(pending), SAMPLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.logger.warning(f'Sample took longer than {SAMPLE_TIMEOUT}s, skipping it')
+            except OSError as error:
+                self.logger.error(f'Could not sample system metrics: {error}')
+            else:
+                disk = total_disk(await self.mount_table.usage())
+                snapshot = dataclasses.replace(snapshot, disk=disk)
+                mounts = await self.sample_mounts()
+                self.latest = snapshot
+                self.latest_mounts = mounts
+                self.history.append(snapshot.timestamp, self.sample_values(snapshot))
+                for listener in self.listeners:
+                    try:
+                        listener(snapshot, mounts)
+                    except Exception:  # pylint: disable=broad-except
+                        self.logger.exception('Error in sample listener')
+            await asyncio.sleep(self.interval)
+
+    def summary(self, seconds):
+        """
+        Statistics of each metric over the last 'seconds' seconds
+
+        Returns
+        -------
+        (int, dict)
+            number of samples in the window and, for each metric,
+            a dict with 'min', 'mean', 'max' and 'p<percentile>' for each of PERCENTILES
+            (empty if there are no samples)
+        """
+        _, values = self.history.window(seconds)
+        if len(values) == 0:
+            return 0, {}
+
+        values = values.astype(numpy.float64)
+        minimums = values.min(axis=0)
+        means = values.mean(axis=0)
+        maximums = values.max(axis=0)
+        percentiles = numpy.percentile(values, PERCENTILES, axis=0)
+
+        statistics = {}
+        for column, metric in enumerate(METRICS):
+            statistics[metric] = {'min': minimums[column],
+                                  'mean': means[column],
+                                  'max': maximums[column]}
+            for row, percentile in enumerate(PERCENTILES):
+                statistics[metric][f'p{percentile}'] = percentiles[row, column]
+        return len(values), statistics
+
+
+def parse_duration(text):
+    """
+    Parses a duration like '90s', '30m', '12h', '7d' or '1w' into seconds
+
+    Raises
+    ------
+    ValueError
+        if text isn't a valid duration
+    """
+    units = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60, 'w': 7 * 24 * 60 * 60}
+    text = text.strip().lower()
+    if not text:
+        raise ValueError('empty duration')
+    if text[-1] in units:
+        number, unit = text[:-1], units[text[-1]]
+    else:
+        number, unit = text, 1
+    seconds = float(number) * unit
+    if seconds <= 0:
+        raise ValueError(f'duration must be positive: {text}')
+    return seconds
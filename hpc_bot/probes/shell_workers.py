@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Persistent shell workers
+
+Small helper processes, started once, that run shell commands on request and time them.
+Forking a command from a small helper is much cheaper than forking the bot process, and
+removes the "/usr/bin/time bash -c" wrapper (and its quoting) around every command.
+
+Protocol, one JSON object per line:
+    bot -> worker: {"cmd": "<shell command>"}
+    worker -> bot: {"pid": <shell pid>}, the shell leads its own process group, then
+                   {"line": "<stdout line>"}, once per line of output, then
+                   {"returncode": <int>, "runtime": <seconds>, "stderr": "<stderr>"}
+
+This file is also the worker itself (run as a script, only depends on the standard library).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+
+SHELL_WORKERS = 2
+
+
+###########
+# WORKER
+###########
+
+
+def reply(message):
+    """
+    Sends a message to the bot
+    """
+    sys.stdout.write(json.dumps(message) + '\n')
+    sys.stdout.flush()
+
+
+def read_into(stream, chunks):
+    """
+    Reads stream until its end, appending its content to chunks
+    """
+    chunks.append(stream.read())
+
+
+def serve():
+    """
+    Worker main loop. Runs each requested command and streams its output back
+    """
+    for request in sys.stdin:
+        cmd = json.loads(request)['cmd']
+        start = time.perf_counter()
+        # own session, so that the bot can kill the command and everything it started
+        process = subprocess.Popen(cmd, shell=True, stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   start_new_session=True)
+        reply({'pid': process.pid})
+
+        # read stderr in parallel, so a full stderr pipe can't block the command
+        stderr = []
+        stderr_reader = threading.Thread(target=read_into, args=(process.stderr, stderr))
+        stderr_reader.start()
+
+        for line in process.stdout:
+            reply({'line': line.decode('utf-8', errors='replace').rstrip()})
+        process.wait()
+        stderr_reader.join()
+
+        reply({'returncode': process.returncode,
+               'runtime': time.perf_counter() - start,
+               'stderr': stderr[0].decode('utf-8', errors='replace').rstrip()})
+
+
+###########
+# BOT SIDE
+###########
+
+
+class ShellWorkerError(Exception):
+    """A shell worker died while running a command"""
+
+
+class ShellWorker:
+    """
+    Handle to a single worker process
+    """
+    def __init__(self):
+        self.process = None
+        self.command_group = None  # process group of the command being run
+
+    async def start(self):
+        """
+        Starts the worker process
+        """
+        # -I: don't add this file's folder to sys.path, -u: unbuffered
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, '-I', '-u', __file__,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            limit=2 ** 20)
+
+    @property
+    def alive(self):
+        """True if the worker process is running"""
+        return self.process is not None and self.process.returncode is None
+
+    async def run(self, cmd, handle_line):
+        """
+        Runs cmd on the worker, awaiting handle_line(line) for each non empty line of output
+
+        Returns
+        -------
+        (int, float, str)
+            return code, runtime in seconds and stderr
+        """
+        self.process.stdin.write((json.dumps({'cmd': cmd}) + '\n').encode())
+        await self.process.stdin.drain()
+
+        while True:
+            message = await self.process.stdout.readline()
+            if not message:
+                raise ShellWorkerError(f'Shell worker died while running: {cmd}')
+            message = json.loads(message)
+            if 'pid' in message:
+                self.command_group = message['pid']
+            elif 'line' in message:
+                if message['line']:
+                    await handle_line(message['line'])
+            else:
+                self.command_group = None
+                return message['returncode'], message['runtime'], message['stderr']
+
+    def kill(self):
+        """
+        Kills the worker and the command it is running, with every process the command started
+        """
+        if self.command_group is not None:
+            try:
+                os.killpg(self.command_group, signal.SIGKILL)
+            except ProcessLookupError:
+                pass  # the command already ended
+            self.command_group = None
+        if self.alive:
+            try:
+                self.process.kill()
+            except ProcessLookupError:
+                pass  # the worker died, but asyncio didn't reap it yet
+        self.process = None
+
+    async def stop(self):
+        """
+        Stops the worker process (it exits when its stdin is closed)
+        """
+        if self.alive:
+            self.process.stdin.close()
+            await self.process.wait()
+
+
+class ShellWorkerPool:
+    """
+    Pool of persistent shell workers. Each worker runs one command at a time
+
+    Parameters
+    ----------
+    size: int
+        number of workers
+    """
+    def __init__(self, size=SHELL_WORKERS):
+        self.logger = logging.getLogger('hpc-bot.ShellWorkerPool')
+        self.size = size
+        self.workers = []
+        self._idle = None  # asyncio.Queue, created inside the running loop
+        self._starting = None
+
+    async def start(self):
+        """
+        Starts the workers, if they weren't started yet
+        """
+        if self._starting is None:
+            self._starting = asyncio.ensure_future(self._start())
+        await self._starting
+
+    async def _start(self):
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            worker = ShellWorker()
+            await worker.start()
+            self.workers.append(worker)
+            self._idle.put_nowait(worker)
+        self.logger.info(f'Started {self.size} shell workers')
+
+    async def run(self, cmd, handle_line):
+        """
+        Runs cmd on the next idle worker, awaiting handle_line(line) for each line of output
+        A worker that died is restarted before being used. If the command doesn't finish
+        normally (timed out, worker died, handle_line raised, unreadable reply, ...), the
+        worker and the command's process group are killed and the worker is replaced, so
+        that the rest of its output isn't read by the next command
+
+        Returns
+        -------
+        (int, float, str)
+            return code, runtime in seconds and stderr
+        """
+        await self.start()
+        worker = await self._idle.get()
+        try:
+            if not worker.alive:
+                self.logger.warning('Restarting dead shell worker')
+                await worker.start()
+            return await worker.run(cmd, handle_line)
+        except BaseException:
+            # the worker may still be in the middle of a command, replace it
+            worker.kill()
+            raise
+        finally:
+            self._idle.put_nowait(worker)
+
+    async def stop(self):
+        """
+        Stops all workers
+        """
+        for worker in self.workers:
+            await worker.stop()
+
+
+if __name__ == '__main__':
+    serve()
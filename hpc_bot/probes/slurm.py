@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+SLURM job queue and accounting probes
+
+Keeps the last squeue snapshot for a short time and, on refresh, diffs it against the new one,
+updating per-user and per-partition aggregates only for the jobs that changed.
+Polls sacct for jobs that finished since a cursor (the end time of the last finished job seen).
+"""
+
+import logging
+import shlex
+import time
+from dataclasses import dataclass
+
+
+SQUEUE_COMMAND = 'squeue'
+# job name goes last: it is the only field that can contain the separator
+SQUEUE_FORMAT = '%i|%u|%P|%T|%D|%C|%j'
+QUEUE_TTL = 15  # seconds
+
+SACCT_COMMAND = 'sacct'
+# job name goes last: it is the only field that can contain the separator
+SACCT_FORMAT = 'JobID,User,State,End,ExitCode,JobName'
+FINISHED_STATES = 'BF,CA,CD,DL,F,NF,OOM,PR,TO'  # every state of a job that ended
+SLURM_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+ACCOUNTING_INTERVAL = 60  # seconds between sacct polls, while there are subscriptions
+
+# job states shown on their own, all others are counted as 'other'
+QUEUE_STATES = ('RUNNING', 'PENDING')
+
+
+@dataclass(frozen=True)
+class Job:
+    """
+    A job in the SLURM queue
+    """
+    job_id: str
+    user: str
+    partition: str
+    state: str
+    nodes: int
+    cpus: int
+    name: str
+
+
+@dataclass(frozen=True)
+class FinishedJob:
+    """
+    A job that ended, as reported by SLURM accounting
+    """
+    job_id: str
+    user: str
+    state: str
+    end: str  # SLURM_TIME_FORMAT
+    exit_code: str
+    name: str
+
+    @property
+    def base_job_id(self):
+        """job id without the array task id (123_4 -> 123)"""
+        return base_job_id(self.job_id)
+
+
+def base_job_id(job_id):
+    """
+    Job id without the array task id (123_4 -> 123, pending tasks 123_[5-10] -> 123)
+    """
+    return job_id.split('_')[0]
+
+
+def parse_squeue_line(line):
+    """
+    Parses a line of 'squeue --noheader --format=SQUEUE_FORMAT' output
+
+    Returns
+    -------
+    Job or None
+        None if the line isn't a job line
+    """
+    fields = line.rstrip('\n').split('|', 6)
+    if len(fields) != 7:
+        return None
+    job_id, user, partition, state, nodes, cpus, name = fields
+    try:
+        return Job(job_id.strip(), user.strip(), partition.strip(), state.strip(),
+                   int(nodes), int(cpus), name)
+    except ValueError:
+        return None
+
+
+class JobQueue:
+    """
+    Cached, incrementally diffed squeue snapshot
+
+    Parameters
+    ----------
+    command: str
+        squeue executable (a stub printing fixture output can be used instead)
+    ttl: float
+        seconds a snapshot is reused before squeue is run again
+    """
+    def __init__(self, command=SQUEUE_COMMAND, ttl=QUEUE_TTL):
+        self.logger = logging.getLogger('hpc-bot.JobQueue')
+        self.command = command
+        self.ttl = ttl
+
+        self.jobs = {}  # job id: Job
+        self.last_refresh = None  # timestamp
+        self.runtime = None  # seconds squeue took
+        # group: {state: [jobs, cpus]}, with state one of QUEUE_STATES or 'other'
+        self.by_user = {}
+        self.by_partition = {}
+        # groups whose aggregates changed since they were last taken by the caller
+        self.changed_users = set()
+        self.changed_partitions = set()
+
+    @property
+    def squeue_cmd(self):
+        """shell command run to get the queue"""
+        return f"{shlex.quote(self.command)} --noheader --format='{SQUEUE_FORMAT}'"
+
+    @property
+    def fresh(self):
+        """True if the snapshot is younger than ttl"""
+        return self.last_refresh is not None and time.monotonic() - self.last_refresh < self.ttl
+
+    async def refresh(self, shell_workers, force=False):
+        """
+        Runs squeue (unless the snapshot is still fresh) and applies the differences
+
+        Parameters
+        ----------
+        shell_workers: ShellWorkerPool
+            where squeue runs
+        force: bool
+            run squeue even if the snapshot is fresh
+
+        Returns
+        -------
+        (int, str)
+            squeue return code (0 if the snapshot was reused) and stderr
+
+        Raises
+        ------
+        ShellWorkerError
+            if the worker died while running squeue
+        """
+        if self.fresh and not force:
+            return 0, ''
+
+        jobs = {}
+
+        async def handle_line(line):
+            job = parse_squeue_line(line)
+            if job is not None:
+                jobs[job.job_id] = job
+
+        returncode, self.runtime, stderr = await shell_workers.run(self.squeue_cmd, handle_line)
+        if returncode != 0:
+            return returncode, stderr
+        self.apply(jobs)
+        self.last_refresh = time.monotonic()
+        return 0, ''
+
+    def apply(self, jobs):
+        """
+        Replaces the snapshot with 'jobs', only touching the aggregates of jobs that changed
+
+        Returns
+        -------
+        (int, int, int)
+            jobs added, removed and changed
+        """
+        added = removed = changed = 0
+        for job_id, job in self.jobs.items():
+            new_job = jobs.get(job_id)
+            if new_job is None:
+                self._count(job, -1)
+                removed += 1
+            elif new_job != job:
+                self._count(job, -1)
+                self._count(new_job, 1)
+                changed += 1
+        for job_id, job in jobs.items():
+            if job_id not in self.jobs:
+                self._count(job, 1)
+                added += 1
+        self.jobs = jobs
+        if added or removed or changed:
+            self.logger.info(f'Job queue: {added} jobs added, {removed} removed, '
+                             f'{changed} changed, {len(jobs)} in total')
+        return added, removed, changed
+
+    def _count(self, job, sign):
+        """
+        Adds (sign=1) or removes (sign=-1) a job from the aggregates
+        """
+        state = job.state if job.state in QUEUE_STATES else 'other'
+        for aggregates, group, changed_groups in (
+                (self.by_user, job.user, self.changed_users),
+                (self.by_partition, job.partition, self.changed_partitions)):
+            counts = aggregates.setdefault(group, {}).setdefault(state, [0, 0])
+            counts[0] += sign
+            counts[1] += sign * job.cpus
+            if not counts[0]:
+                del aggregates[group][state]
+                if not aggregates[group]:
+                    del aggregates[group]
+            changed_groups.add(group)
+
+    def take_changes(self):
+        """
+        Returns and forgets the users and partitions whose aggregates changed
+
+        Returns
+        -------
+        (set, set)
+            users and partitions
+        """
+        changes = self.changed_users, self.changed_partitions
+        self.changed_users, self.changed_partitions = set(), set()
+        return changes
+
+    def state_totals(self):
+        """
+        Number of jobs in each state (QUEUE_STATES and 'other')
+        """
+        totals = {}
+        for states in self.by_partition.values():
+            for state, (jobs, _) in states.items():
+                totals[state] = totals.get(state, 0) + jobs
+        return totals
+
+
+def parse_sacct_line(line):
+    """
+    Parses a line of 'sacct --noheader --parsable2 --format=SACCT_FORMAT' output
+
+    Returns
+    -------
+    FinishedJob or None
+        None if the line isn't a finished job line
+    """
+    fields = line.rstrip('\n').split('|', 5)
+    if len(fields) != 6:
+        return None
+    job_id, user, state, end, exit_code, name = fields
+    if not job_id or end in ('', 'Unknown', 'None'):
+        return None
+    # ex: "CANCELLED by 1234"
+    return FinishedJob(job_id, user, state.split()[0] if state else state, end, exit_code, name)
+
+
+class JobAccounting:
+    """
+    Incremental sacct poller: each poll only asks for jobs that ended after the cursor
+
+    Parameters
+    ----------
+    command: str
+        sacct executable (a stub printing fixture output can be used instead)
+    """
+    def __init__(self, command=SACCT_COMMAND):
+        self.logger = logging.getLogger('hpc-bot.JobAccounting')
+        self.command = command
+        self.cursor = None  # end time of the last finished job seen (SLURM_TIME_FORMAT)
+        self.seen = set()  # ids of the jobs that ended at cursor, which sacct reports again
+
+    def reset(self, timestamp=None):
+        """
+        Only jobs that end after timestamp (default: now) are reported from now on
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        self.cursor = time.strftime(SLURM_TIME_FORMAT, time.localtime(timestamp))
+        self.seen = set()
+
+    def sacct_cmd(self):
+        """shell command run to get the jobs that ended after the cursor"""
+        return (f'{shlex.quote(self.command)} --allusers --allocations --noheader --parsable2 '
+                f'--state={FINISHED_STATES} --starttime={self.cursor} --endtime=now '
+                f'--format={SACCT_FORMAT}')
+
+    async def poll(self, shell_workers):
+        """
+        Runs sacct and advances the cursor
+
+        Parameters
+        ----------
+        shell_workers: ShellWorkerPool
+            where sacct runs
+
+        Returns
+        -------
+        list of FinishedJob
+            jobs that ended since the last poll, oldest first
+
+        Raises
+        ------
+        OSError
+            if sacct failed
+        ShellWorkerError
+            if the worker died while running sacct
+        """
+        if self.cursor is None:
+            self.reset()
+            return []
+
+        jobs = []
+
+        async def handle_line(line):
+            job = parse_sacct_line(line)
+            if job is not None and job.end >= self.cursor and job.job_id not in self.seen:
+                jobs.append(job)
+
+        returncode, _, stderr = await shell_workers.run(self.sacct_cmd(), handle_line)
+        if returncode != 0:
+            raise OSError(f'{self.command} exited with code {returncode}: {stderr.strip()}')
+
+        jobs.sort(key=lambda job: job.end)
+        if jobs:
+            if jobs[-1].end > self.cursor:
+                self.cursor = jobs[-1].end
+                self.seen = set()
+            self.seen.update(job.job_id for job in jobs if job.end == self.cursor)
+        return jobs
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Native system metrics collector
+
+Reads /proc and statvfs directly instead of forking uptime, free and df
+"""
+
+import os
+import time
+from dataclasses import dataclass
+
+
+PROC_PATH = '/proc'
+SIZE_UNITS = 'BKMGTPE'
+
+
+@dataclass(frozen=True)
+class LoadAverage:
+    """
+    CPU load average over 1, 5 and 15 minutes
+    """
+    one: float
+    five: float
+    fifteen: float
+
+
+@dataclass(frozen=True)
+class Memory:
+    """
+    RAM usage, in bytes
+    """
+    total: int
+    free: int
+    available: int
+    cache: int
+
+    @property
+    def used(self):
+        """same definition as procps free: total - free - buffers/cache"""
+        return max(self.total - self.free - self.cache, 0)
+
+
+@dataclass(frozen=True)
+class Swap:
+    """
+    SWAP usage, in bytes
+    """
+    total: int
+    free: int
+
+    @property
+    def used(self):
+        """used swap"""
+        return self.total - self.free
+
+
+@dataclass(frozen=True)
+class Disk:
+    """
+    Disk usage, in bytes, summed over one or more filesystems
+    """
+    size: int
+    used: int
+    available: int
+
+    @property
+    def percentage(self):
+        """same definition as df: used / (used + available), rounded up"""
+        usable = self.used + self.available
+        if not usable:
+            return 0
+        return -(-self.used * 100 // usable)
+
+
+@dataclass(frozen=True)
+class SystemSnapshot:
+    """
+    System state at a given moment
+    """
+    timestamp: float
+    uptime: float
+    load: LoadAverage
+    memory: Memory
+    swap: Swap
+    disk: Disk
+
+
+def proc_available(proc_path=PROC_PATH):
+    """
+    True if the /proc files read by this module exist and are readable
+    """
+    return all(os.access(os.path.join(proc_path, name), os.R_OK)
+               for name in ('loadavg', 'uptime', 'meminfo'))
+
+
+def read_loadavg(proc_path=PROC_PATH):
+    """
+    Reads load average from /proc/loadavg
+    """
+    with open(os.path.join(proc_path, 'loadavg')) as loadavg:
+        one, five, fifteen = loadavg.read().split()[:3]
+    return LoadAverage(float(one), float(five), float(fifteen))
+
+
+def read_uptime(proc_path=PROC_PATH):
+    """
+    Reads system uptime (seconds) from /proc/uptime
+    """
+    with open(os.path.join(proc_path, 'uptime')) as uptime:
+        return float(uptime.read().split()[0])
+
+
+def read_meminfo(proc_path=PROC_PATH):
+    """
+    Reads RAM and SWAP usage from /proc/meminfo
+
+    Returns
+    -------
+    (Memory, Swap)
+    """
+    meminfo = {}
+    with open(os.path.join(proc_path, 'meminfo')) as meminfo_file:
+        for line in meminfo_file:
+            key, _, value = line.partition(':')
+            value = value.split()
+            if value:
+                # values are in kB
+                meminfo[key] = int(value[0]) * 1024
+
+    cache = meminfo.get('Buffers', 0) + meminfo.get('Cached', 0) + meminfo.get('SReclaimable', 0)
+    memory = Memory(
+        total=meminfo['MemTotal'],
+        free=meminfo['MemFree'],
+        available=meminfo.get('MemAvailable', meminfo['MemFree']),
+        cache=cache)
+    swap = Swap(total=meminfo.get('SwapTotal', 0), free=meminfo.get('SwapFree', 0))
+    return memory, swap
+
+
+def read_disk(paths=('/',)):
+    """
+    Reads disk usage of the filesystems containing each path in paths
+    Filesystems shared by more than one path are only counted once
+    """
+    size = used = available = 0
+    seen_devices = set()
+    for path in paths:
+        device = os.stat(path).st_dev
+        if device in seen_devices:
+            continue
+        seen_devices.add(device)
+
+        stats = os.statvfs(path)
+        size += stats.f_blocks * stats.f_frsize
+        used += (stats.f_blocks - stats.f_bfree) * stats.f_frsize
+        available += stats.f_bavail * stats.f_frsize
+    return Disk(size=size, used=used, available=available)
+
+
+def collect_snapshot(disk_paths=('/',), proc_path=PROC_PATH):
+    """
+    Collects a full system snapshot
+    Blocking (statvfs can stall on network filesystems), run it in an executor
+
+    Raises
+    ------
+    OSError
+        if /proc or any of disk_paths can't be read
+    """
+    memory, swap = read_meminfo(proc_path)
+    return SystemSnapshot(
+        timestamp=time.time(),
+        uptime=read_uptime(proc_path),
+        load=read_loadavg(proc_path),
+        memory=memory,
+        swap=swap,
+        disk=read_disk(disk_paths))
+
+
+###################
+# FORMAT FUNCTIONS
+###################
+
+
+def format_size(size):
+    """
+    Formats a size in bytes the same way 'df -h' does (ex: 512K, 3.4G, 12T)
+    """
+    size = float(size)
+    exponent = 0
+    while size >= 1024 and exponent < len(SIZE_UNITS) - 1:
+        size /= 1024
+        exponent += 1
+    unit = SIZE_UNITS[exponent]
+    if unit == 'B':
+        return f'{size:.0f}{unit}'
+    return f'{size:.1f}{unit}' if size < 10 else f'{size:.0f}{unit}'
+
+
+def format_uptime(seconds):
+    """
+    Formats uptime the same way 'uptime' does (ex: 3 days, 4:05)
+    """
+    minutes = int(seconds) // 60
+    days, minutes = divmod(minutes, 24 * 60)
+    hours, minutes = divmod(minutes, 60)
+
+    clock = f'{hours}:{minutes:02d}' if hours else f'{minutes} min'
+    if days:
+        return f'{days} day{"s" if days > 1 else ""}, {clock}'
+    return clock
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Threshold alerts with hysteresis and cooldowns
+
+Rules are evaluated against each sample taken by probes.MetricsSampler, so they never run
+probes of their own. A rule fires when its value reaches 'above' and is resolved when it falls
+to 'clear' (hysteresis, so a value hovering around the threshold doesn't flap). Two firings of
+the same rule are at least 'cooldown' seconds apart.
+"""
+
+import time
+from dataclasses import dataclass
+
+try:
+    import probes
+except ImportError:
+    import hpc_bot.probes as probes
+
+
+ALERT_METRICS = ('load', 'memory', 'swap', 'disk')
+ALERT_COOLDOWN = 60 * 60  # seconds
+# default 'clear': 'above' minus 5 percentage points, or 80% of 'above' for load
+ALERT_HYSTERESIS = 5
+LOAD_HYSTERESIS = 0.8
+
+
+@dataclass
+class AlertRule:
+    """
+    A threshold on a sampled metric (load is the 1 minute load average, all others are
+    percentages of use; disk is the filesystem containing 'path')
+    """
+    metric: str
+    above: float
+    clear: float
+    cooldown: float = ALERT_COOLDOWN
+    path: str = '/'
+    name: str = None
+
+    # state
+    active: bool = False
+    last_fired: float = None  # timestamp
+
+    def __post_init__(self):
+        if self.name is None:
+            self.name = f'{self.metric} {self.path}' if self.metric == 'disk' else self.metric
+
+    def value(self, values, mounts):
+        """
+        Value of the rule metric in a sample, None if it wasn't sampled
+
+        Parameters
+        ----------
+        values: dict
+            metric: value, of the whole system
+        mounts: dict
+            path: probes.Disk
+        """
+        if self.metric == 'disk':
+            disk = mounts.get(self.path)
+            return disk.percentage if disk is not None else None
+        return values[self.metric]
+
+
+def parse_alert_rules(configs):
+    """
+    Parses the 'alerts' config: a list of {"metric": ..., "above": ..., and optionally
+    "clear", "cooldown" (seconds or a duration like "30m"), "path" (disk only) and "name"}
+
+    Returns
+    -------
+    list of AlertRule
+
+    Raises
+    ------
+    ValueError
+        if a rule is invalid
+    """
+    rules = []
+    for config in configs:
+        try:
+            metric = config['metric']
+            above = float(config['above'])
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(f'alert rule needs a "metric" and a numeric "above": {config}')
+        if metric not in ALERT_METRICS:
+            raise ValueError(f'alert metric must be one of {", ".join(ALERT_METRICS)}: {config}')
+        if metric == 'load':
+            default_clear = above * LOAD_HYSTERESIS
+        else:
+            default_clear = max(above - ALERT_HYSTERESIS, 0)
+        try:
+            clear = float(config.get('clear', default_clear))
+        except (TypeError, ValueError):
+            raise ValueError(f'alert "clear" must be a number: {config}')
+        if clear > above:
+            raise ValueError(f'alert "clear" must not be higher than "above": {config}')
+        cooldown = config.get('cooldown', ALERT_COOLDOWN)
+        try:
+            if isinstance(cooldown, str):
+                cooldown = probes.parse_duration(cooldown)
+            cooldown = float(cooldown)
+        except (TypeError, ValueError):
+            raise ValueError(f'alert "cooldown" must be seconds or a duration like "30m": {config}')
+        rules.append(AlertRule(metric, above, clear, cooldown,
+                               config.get('path', '/'), config.get('name')))
+    return rules
+
+
+class AlertEngine:
+    """
+    Evaluates alert rules against samples
+
+    Parameters
+    ----------
+    rules: list of AlertRule
+    """
+    def __init__(self, rules):
+        self.rules = rules
+
+    @property
+    def mounts(self):
+        """paths whose disk usage the rules need, each sampled on its own"""
+        return sorted({rule.path for rule in self.rules if rule.metric == 'disk'})
+
+    def evaluate(self, snapshot, mounts, now=None):
+        """
+        Updates the state of every rule with a new sample
+
+        Parameters
+        ----------
+        snapshot: probes.SystemSnapshot
+        mounts: dict
+            path: probes.Disk
+        now: float
+            timestamp, defaults to now
+
+        Returns
+        -------
+        list of (AlertRule, bool, float)
+            rules that fired (True) or were resolved (False), with their value
+        """
+        now = time.time() if now is None else now
+        values = dict(zip(probes.METRICS, probes.MetricsSampler.sample_values(snapshot)))
+        events = []
+        for rule in self.rules:
+            value = rule.value(values, mounts)
+            if value is None:
+                continue
+            if not rule.active and value >= rule.above:
+                if rule.last_fired is None or now - rule.last_fired >= rule.cooldown:
+                    rule.active = True
+                    rule.last_fired = now
+                    events.append((rule, True, value))
+            elif rule.active and value <= rule.clear:
+                rule.active = False
+                events.append((rule, False, value))
+        return events
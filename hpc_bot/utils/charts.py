@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Renders metrics history charts as PNG images
+"""
+
+import asyncio
+import datetime
+from io import BytesIO
+import numpy
+from PIL import Image, ImageDraw
+
+
+CHART_SIZE = (640, 280)
+CHART_MARGINS = (50, 20, 15, 30)  # left, top, right, bottom
+BACKGROUND_COLOR = (47, 49, 54)  # discord dark theme
+AXIS_COLOR = (185, 187, 190)
+
+
+def render_chart(timestamps, values, title, color, unit=''):
+    """
+    Renders a line chart of values over time
+    CPU bound, run it in an executor
+
+    Parameters
+    ----------
+    timestamps: numpy.ndarray
+        sample timestamps, oldest first
+    values: numpy.ndarray
+        sample values, same length as timestamps
+    title: str
+        drawn at the top of the chart
+    color: (int, int, int)
+        line color
+    unit: str
+        appended to the y axis labels
+
+    Returns
+    -------
+    bytes
+        PNG image
+    """
+    width, height = CHART_SIZE
+    left, top, right, bottom = CHART_MARGINS
+    plot_width = width - left - right
+    plot_height = height - top - bottom
+
+    image = Image.new('RGB', CHART_SIZE, BACKGROUND_COLOR)
+    draw = ImageDraw.Draw(image)
+    draw.text((left, 4), title, fill=AXIS_COLOR)
+    draw.line([(left, top), (left, height - bottom), (width - right, height - bottom)],
+              fill=AXIS_COLOR)
+
+    if len(values) > 1:
+        # more samples than pixels: keep the maximum of each pixel column, so peaks still show
+        if len(values) > plot_width:
+            bins = numpy.linspace(0, len(values), plot_width + 1).astype(int)
+            values = numpy.maximum.reduceat(values, bins[:-1])
+            timestamps = timestamps[bins[:-1]]
+
+        low = 0 if values.min() >= 0 else float(values.min())
+        high = float(values.max()) or 1.0
+        start, end = float(timestamps[0]), float(timestamps[-1])
+        x_positions = left + (timestamps - start) / ((end - start) or 1) * plot_width
+        y_positions = top + plot_height - (values - low) / ((high - low) or 1) * plot_height
+        draw.line(list(zip(x_positions.tolist(), y_positions.tolist())), fill=color, width=2)
+
+        # axis labels
+        draw.text((4, top - 5), f'{high:.1f}{unit}', fill=AXIS_COLOR)
+        draw.text((4, height - bottom - 5), f'{low:.1f}{unit}', fill=AXIS_COLOR)
+        time_format = '%H:%M' if end - start < 24 * 60 * 60 else '%m-%d %H:%M'
+        draw.text((left, height - bottom + 8),
+                  f'{datetime.datetime.fromtimestamp(start):{time_format}}', fill=AXIS_COLOR)
+        end_label = f'{datetime.datetime.fromtimestamp(end):{time_format}}'
+        draw.text((width - right - draw.textsize(end_label)[0], height - bottom + 8),
+                  end_label, fill=AXIS_COLOR)
+    else:
+        draw.text((left + 10, top + plot_height // 2), 'not enough samples', fill=AXIS_COLOR)
+
+    png = BytesIO()
+    image.save(png, format='PNG')
+    return png.getvalue()
+
+
+class ChartCache:
+    """
+    Rendered charts, reused until new samples arrive
+
+    Parameters
+    ----------
+    sampler: probes.MetricsSampler
+        where samples come from
+    labels: dict
+        {metric: (title, unit)} of each chart
+    """
+    def __init__(self, sampler, labels):
+        self.sampler = sampler
+        self.labels = labels
+        self._charts = {}  # (metric, seconds, color): (sample count, png)
+        sampler.listeners.append(self.clear)
+
+    def clear(self, snapshot=None, mounts=None):
+        """
+        Drops every chart. Called by the sampler after each sample
+        """
+        self._charts.clear()
+
+    async def get(self, metric, seconds, color):
+        """
+        Returns the PNG chart of metric over the last 'seconds' seconds,
+        rendering it in an executor if there are new samples since it was last rendered
+        """
+        sample_count = self.sampler.history.count
+        key = (metric, seconds, color)
+        cached = self._charts.get(key)
+        if cached is not None and cached[0] == sample_count:
+            return cached[1]
+
+        timestamps, values = self.sampler.history.window(seconds)
+        column = self.sampler.metrics.index(metric)
+        title, unit = self.labels[metric]
+        png = await asyncio.get_running_loop().run_in_executor(
+            None, render_chart, timestamps, values[:, column], title, color, unit)
+        self._charts[key] = (sample_count, png)
+        return png
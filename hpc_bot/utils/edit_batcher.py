@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Coalesces embed edits of a single message
+"""
+
+import asyncio
+import logging
+import time
+
+
+EDIT_INTERVAL = 2.0  # seconds
+
+
+class EditBatcher:
+    """
+    Collects changes made to an embed and edits the message it belongs to
+    at most once every 'interval' seconds, plus once when closed
+
+    Usage: change the embed, then call 'await batcher.update()'. Call 'await batcher.close()'
+    when done, to send the last changes.
+
+    Parameters
+    ----------
+    message: discord.Message
+        message to edit
+    embed: discord.Embed
+        embed being changed
+    interval: float
+        minimum seconds between edits
+    outbox: Outbox
+        where edits are sent through, if given
+    """
+    def __init__(self, message, embed, interval=EDIT_INTERVAL, outbox=None):
+        self.logger = logging.getLogger('hpc-bot.EditBatcher')
+        self.message = message
+        self.embed = embed
+        self.interval = interval
+        self.outbox = outbox
+
+        self.edits_requested = 0
+        self.edits_sent = 0
+        self._pending = False
+        self._last_edit = 0
+        self._timer = None  # asyncio.Task of a delayed flush
+
+    @property
+    def edits_saved(self):
+        """number of edits that were coalesced"""
+        return self.edits_requested - self.edits_sent
+
+    async def update(self):
+        """
+        Marks the embed as changed
+        Edits the message right away if the last edit is older than 'interval',
+        else schedules an edit for when 'interval' is over
+        """
+        self.edits_requested += 1
+        self._pending = True
+        if self._timer is not None:  # an edit is already scheduled
+            return
+
+        delay = self._last_edit + self.interval - time.monotonic()
+        if delay <= 0:
+            await self.flush()
+        else:
+            self._timer = asyncio.get_event_loop().create_task(self._flush_later(delay))
+
+    async def _flush_later(self, delay):
+        await asyncio.sleep(delay)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        """
+        Edits the message if there are changes that weren't sent yet
+        """
+        if not self._pending:
+            return
+        self._pending = False
+        self._last_edit = time.monotonic()
+        self.edits_sent += 1
+        if self.outbox is not None:
+            await self.outbox.edit(self.message, embed=self.embed)
+        else:
+            await self.message.edit(embed=self.embed)
+
+    def cancel(self):
+        """
+        Drops pending changes (ex: message is about to be deleted)
+        """
+        self._pending = False
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    async def close(self):
+        """
+        Sends pending changes and reports how many edits were saved
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await self.flush()
+        if self.edits_saved:
+            self.logger.info(f'Coalesced {self.edits_requested} embed edits into '
+                             f'{self.edits_sent} ({self.edits_saved} saved)')
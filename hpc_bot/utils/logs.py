@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Logging setup: non-blocking, rotating and optionally structured (JSON lines)
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+
+
+LOG_BACKUPS = 5
+LOG_FORMAT = '%(asctime)s:%(levelname)s:%(name)s: %(message)s'
+TIME_ROTATIONS = {'hourly': 'H', 'daily': 'midnight', 'weekly': 'W0'}
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+# extra fields that can be passed to a log call (logger.info(..., extra={...})),
+# included in JSON lines logs
+COMMAND_FIELDS = ('command', 'user', 'channel', 'duration', 'exit_code')
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats log records as JSON objects, one per line
+    """
+    def format(self, record):
+        log_entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in COMMAND_FIELDS:
+            if hasattr(record, field):
+                log_entry[field] = getattr(record, field)
+        if record.exc_info:
+            log_entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(log_entry, default=str)
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enqueues log records for a QueueListener in the same process
+    Unlike QueueHandler, doesn't pre-format records, so that the listener handlers can use
+    their own formatters (and exception information is kept)
+    """
+    def prepare(self, record):
+        record.msg = record.getMessage()  # arguments may change after the call returns
+        record.args = None
+        return record
+
+
+def parse_rotation(rotation):
+    """
+    Validates a log rotation definition: a size (ex: 500K, 10M, 1G) or one of TIME_ROTATIONS
+
+    Raises
+    ------
+    ValueError
+        if rotation isn't valid
+    """
+    if rotation in TIME_ROTATIONS:
+        return rotation
+    unit = SIZE_UNITS.get(rotation[-1:].upper(), 1)
+    number = rotation[:-1] if rotation[-1:].upper() in SIZE_UNITS else rotation
+    if not number.isdigit() or int(number) <= 0:
+        raise ValueError(f'Invalid log rotation "{rotation}". Use a size (ex: 10M) '
+                         f'or one of: {", ".join(TIME_ROTATIONS)}')
+    return int(number) * unit
+
+
+def log_file_handler(log_path, rotation=None, backups=LOG_BACKUPS):
+    """
+    Returns a log file handler, rotating by size or time if rotation is defined
+
+    Parameters
+    ----------
+    log_path: os.PathLike
+        log file
+    rotation: str or int or None
+        value returned by parse_rotation. None never rotates
+    backups: int
+        number of rotated files to keep
+    """
+    if rotation is None:
+        return logging.FileHandler(filename=log_path, encoding='utf-8', mode='a')
+    if rotation in TIME_ROTATIONS:
+        return logging.handlers.TimedRotatingFileHandler(
+            filename=log_path, when=TIME_ROTATIONS[rotation], backupCount=backups,
+            encoding='utf-8')
+    return logging.handlers.RotatingFileHandler(
+        filename=log_path, maxBytes=rotation, backupCount=backups, encoding='utf-8')
+
+
+def setup_logging(stream, log_path, rotation=None, json_lines=False, level=logging.INFO):
+    """
+    Sets up logging so that log calls only enqueue records
+    A background thread formats them and writes them to stream and to the log file
+
+    Parameters
+    ----------
+    stream: file object
+        stream to log to, besides the log file (ex: sys.stderr)
+    log_path: os.PathLike
+        log file
+    rotation: str or int or None
+        value returned by parse_rotation. None never rotates
+    json_lines: bool
+        if True, the log file is written as JSON lines (see JsonFormatter)
+    level: int
+        logging level
+
+    Returns
+    -------
+    logging.handlers.QueueListener
+        already started. Call stop() before exiting, to flush queued records
+    """
+    stream_handler = logging.StreamHandler(stream)
+    stream_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    file_handler = log_file_handler(log_path, rotation)
+    file_handler.setFormatter(JsonFormatter() if json_lines else logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, file_handler,
+                                              respect_handler_level=True)
+    # handler level too: loggers set to a lower level (ex: discord.http) aren't written
+    queue_handler = LogQueueHandler(log_queue)
+    queue_handler.setLevel(level)
+    logging.basicConfig(level=level, handlers=[queue_handler])
+    listener.start()
+    return listener
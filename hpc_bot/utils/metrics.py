@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Prometheus metrics: a small registry and an HTTP endpoint serving it in the text format
+"""
+
+import asyncio
+import logging
+import math
+
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_labels(labels):
+    """
+    Formats a tuple of (name, value) label pairs as {name="value",...}
+    """
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def format_value(value):
+    """
+    Formats a sample value
+    """
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+def parse_metrics_address(address):
+    """
+    Parses a "[host:]port" address (host defaults to 127.0.0.1)
+
+    Returns
+    -------
+    (str, int)
+        host and port
+
+    Raises
+    ------
+    ValueError
+        if port isn't a number between 1 and 65535
+    """
+    host, _, port = address.rpartition(':')
+    if not port.isdigit() or not 0 < int(port) < 2 ** 16:
+        raise ValueError(f'invalid port "{port}" in metrics address "{address}"')
+    return host or '127.0.0.1', int(port)
+
+
+class MetricsRegistry:
+    """
+    Counters and histograms updated by the bot, plus gauges read from collectors at scrape time
+    """
+    def __init__(self):
+        self._metrics = {}  # name: (type, help, buckets)
+        self._counters = {}  # name: {labels: value}
+        self._histograms = {}  # name: {labels: [bucket counts, sum, count]}
+        self._collectors = []
+
+    def counter(self, name, help_text):
+        """
+        Declares a counter (name should end with _total)
+        """
+        self._metrics[name] = ('counter', help_text, None)
+        self._counters[name] = {}
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        """
+        Declares a histogram
+        """
+        self._metrics[name] = ('histogram', help_text, tuple(buckets))
+        self._histograms[name] = {}
+
+    def add_collector(self, collector):
+        """
+        Adds a function called at scrape time
+        It returns a list of (name, help, [(labels dict, value), ...]) gauges
+        """
+        self._collectors.append(collector)
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increments a counter
+        """
+        labels = tuple(sorted(labels.items()))
+        counter = self._counters[name]
+        counter[labels] = counter.get(labels, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        Adds an observation to a histogram
+        """
+        labels = tuple(sorted(labels.items()))
+        buckets = self._metrics[name][2]
+        histogram = self._histograms[name]
+        if labels not in histogram:
+            histogram[labels] = [[0] * len(buckets), 0, 0]
+        bucket_counts, _, _ = entry = histogram[labels]
+        for position, bucket in enumerate(buckets):
+            if value <= bucket:
+                bucket_counts[position] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def render(self):
+        """
+        All metrics in the Prometheus text format
+        """
+        lines = []
+        for name, (metric_type, help_text, buckets) in self._metrics.items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            if metric_type == 'counter':
+                for labels, value in self._counters[name].items():
+                    lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+            else:
+                for labels, (bucket_counts, total, count) in self._histograms[name].items():
+                    for bucket, bucket_count in zip(buckets + (math.inf,),
+                                                    bucket_counts + [count]):
+                        bucket_labels = labels + (('le', format_value(bucket)),)
+                        lines.append(f'{name}_bucket{format_labels(bucket_labels)} {bucket_count}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {format_value(total)}')
+                    lines.append(f'{name}_count{format_labels(labels)} {count}')
+
+        for collector in self._collectors:
+            for name, help_text, samples in collector():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} gauge')
+                for labels, value in samples:
+                    labels = tuple(sorted(labels.items()))
+                    lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class RateLimitCounter(logging.Handler):
+    """
+    Counts discord.py rate limit waits, by watching its 'discord.http' log
+    discord.py sleeps on 429 responses internally and only reports it through that log
+    """
+    def __init__(self, registry):
+        super().__init__(logging.WARNING)
+        self.registry = registry
+
+    def emit(self, record):
+        if record.getMessage().startswith('We are being rate limited'):
+            self.registry.inc('hpc_bot_discord_rate_limit_waits_total')
+            if record.args and isinstance(record.args[0], (int, float)):
+                self.registry.inc('hpc_bot_discord_rate_limit_wait_seconds_total', record.args[0])
+
+
+class MetricsExporter:
+    """
+    HTTP endpoint serving a MetricsRegistry at /metrics
+
+    Parameters
+    ----------
+    registry: MetricsRegistry
+        metrics to serve
+    address: str
+        [host:]port to listen on (see parse_metrics_address)
+    """
+    def __init__(self, registry, address):
+        self.logger = logging.getLogger('hpc-bot.MetricsExporter')
+        self.registry = registry
+        self.host, self.port = parse_metrics_address(address)
+        self.server = None
+
+    async def start(self):
+        """
+        Starts listening
+        Runs as a background task, so failures (ex: port already in use) are logged here
+        """
+        try:
+            self.server = await asyncio.start_server(self.handle_request, self.host, self.port)
+        except OSError as error:
+            self.logger.error(f'Could not serve metrics at {self.host}:{self.port}: {error}')
+            return
+        self.logger.info(f'Serving metrics at http://{self.host}:{self.port}/metrics')
+
+    async def handle_request(self, reader, writer):
+        """
+        Answers a single HTTP request
+        """
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 10)
+            while (await asyncio.wait_for(reader.readline(), 10)).strip():  # skip headers
+                pass
+            method, path, *_ = request_line.decode('latin-1').split() + ['', '']
+            if method == 'GET' and path.split('?')[0] == '/metrics':
+                status, body = '200 OK', self.registry.render().encode()
+            else:
+                status, body = '404 Not Found', b'Not Found\n'
+            writer.write(f'HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n'
+                         f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode()
+                         + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except ValueError:  # line longer than the stream limit
+            self.logger.warning('Ignoring metrics request with a line too long')
+        finally:
+            writer.close()
+
+    async def stop(self):
+        """
+        Stops listening
+        """
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Outbound message scheduler
+
+Every message sent, edited or deleted by the bot goes through a per-channel queue that:
+- waits for discord's rate limits before picking the next request, instead of letting it block
+  inside discord.py. Per-channel limits are the ones discord reports in its X-RateLimit headers
+  (see RateLimitListener), the global limit is a token bucket
+- merges edits of the same message that are still waiting, only the last one is sent
+- sends interactive traffic (command replies) before background traffic (alerts, notifications,
+  deletions of feedback messages)
+Each API call runs in the context of the caller that made the request, so its time is added to
+that caller's latency spans.
+"""
+
+import asyncio
+import contextvars
+import heapq
+import inspect
+import itertools
+import logging
+import time
+import discord.http
+
+
+# priorities, lower goes first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# discord.py route (rate limit bucket, with the channel id) of each kind of request
+ROUTES = {'send': '/channels/{channel_id}/messages',
+          'edit': '/channels/{channel_id}/messages/{message_id}',
+          'delete': '/channels/{channel_id}/messages/{message_id}'}
+GLOBAL_RATE_LIMIT = (50, 1.0)  # requests, seconds
+
+
+class TokenBucket:
+    """
+    Allows 'rate' requests every 'per' seconds, refilled continuously
+    """
+    def __init__(self, rate, per):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+
+    def delay(self):
+        """
+        Seconds to wait before a request is allowed, 0 if it is allowed now
+        """
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) * self.per / self.rate
+
+    def take(self):
+        """
+        Uses a request
+        """
+        self.tokens -= 1
+
+
+class OutboundRequest:
+    """
+    A send, edit or delete waiting in a channel queue
+    """
+    def __init__(self, kind, target, priority, *args, **kwargs):
+        self.kind = kind
+        self.target = target  # channel (send) or message (edit, delete)
+        self.priority = priority
+        self.args = args
+        self.kwargs = kwargs
+        self.context = contextvars.copy_context()  # of the caller
+        self.future = asyncio.get_event_loop().create_future()
+
+    def merge(self, kwargs, priority):
+        """
+        Merges a later edit of the same message into this one
+
+        Returns
+        -------
+        bool
+            True if the priority was raised
+        """
+        self.kwargs.update(kwargs)
+        if priority < self.priority:
+            self.priority = priority
+            return True
+        return False
+
+    async def call(self):
+        """
+        Makes the discord API call
+        """
+        if self.kind == 'send':
+            return await self.target.send(*self.args, **self.kwargs)
+        if self.kind == 'edit':
+            return await self.target.edit(**self.kwargs)
+        return await self.target.delete()
+
+
+class ChannelQueue:
+    """
+    Requests waiting to be made to a single channel, by priority then arrival order
+    """
+    def __init__(self):
+        self.heap = []  # (priority, sequence, OutboundRequest)
+        self.edits = {}  # message id: OutboundRequest, edits still waiting
+        self.resets = {}  # route: time.monotonic() when its rate limit resets
+        self.task = None  # asyncio.Task emptying the queue
+        self._sequence = itertools.count()
+
+    def push(self, request):
+        """
+        Adds a request (again, if its priority was raised)
+        """
+        heapq.heappush(self.heap, (request.priority, next(self._sequence), request))
+
+    def delay(self, kind):
+        """
+        Seconds until discord allows a request of kind, 0 if it is allowed now
+        """
+        reset = self.resets.get(ROUTES[kind])
+        return max(reset - time.monotonic(), 0) if reset is not None else 0
+
+    def rate_limited(self, route, seconds):
+        """
+        Holds the requests of route for 'seconds' seconds
+        """
+        self.resets[route] = time.monotonic() + seconds
+
+
+class Outbox:
+    """
+    Per-channel outbound queues (see module docstring)
+    """
+    def __init__(self):
+        self.logger = logging.getLogger('hpc-bot.Outbox')
+        self.channels = {}  # channel id: ChannelQueue
+        self.global_bucket = TokenBucket(*GLOBAL_RATE_LIMIT)
+        self.edits_merged = 0
+        self.rate_limit_waits = 0
+
+    async def send(self, channel, *args, priority=INTERACTIVE, **kwargs):
+        """
+        Sends a message to channel (same arguments as discord.abc.Messageable.send)
+
+        Returns
+        -------
+        discord.Message
+        """
+        request = OutboundRequest('send', channel, priority, *args, **kwargs)
+        self._enqueue(channel.id, request)
+        return await request.future
+
+    async def edit(self, message, priority=INTERACTIVE, **kwargs):
+        """
+        Edits a message (same arguments as discord.Message.edit)
+        If an edit of the same message is still waiting, it is replaced by this one
+        """
+        channel_queue = self._channel_queue(message.channel.id)
+        waiting = channel_queue.edits.get(message.id)
+        if waiting is not None:
+            if waiting.merge(kwargs, priority):  # can't reorder the heap, push the merged edit
+                channel_queue.push(waiting)
+            self.edits_merged += 1
+            return await asyncio.shield(waiting.future)
+
+        request = OutboundRequest('edit', message, priority, **kwargs)
+        channel_queue.edits[message.id] = request
+        self._enqueue(message.channel.id, request)
+        return await asyncio.shield(request.future)
+
+    async def delete(self, message, delay=None, priority=BACKGROUND):
+        """
+        Deletes a message, after 'delay' seconds if given (without waiting for it)
+        """
+        if delay is not None:
+            asyncio.get_event_loop().create_task(self._delete_later(message, delay, priority))
+            return
+        request = OutboundRequest('delete', message, priority)
+        self._enqueue(message.channel.id, request)
+        await request.future
+
+    def rate_limited(self, bucket, seconds):
+        """
+        Holds the requests of a discord.py rate limit bucket ('channel id:guild id:route')
+        for 'seconds' seconds. Buckets of channels without a queue are ignored
+        """
+        channel_id, _, route = bucket.split(':', 2)
+        channel_queue = self.channels.get(int(channel_id)) if channel_id.isdigit() else None
+        if channel_queue is not None:
+            channel_queue.rate_limited(route, seconds)
+
+    async def _delete_later(self, message, delay, priority):
+        await asyncio.sleep(delay)
+        try:
+            await self.delete(message, priority=priority)
+        except Exception as error:  # pylint: disable=broad-except
+            self.logger.warning(f'Could not delete message {message.id}: {error}')
+
+    def _channel_queue(self, channel_id):
+        channel_queue = self.channels.get(channel_id)
+        if channel_queue is None:
+            channel_queue = self.channels[channel_id] = ChannelQueue()
+        return channel_queue
+
+    def _enqueue(self, channel_id, request):
+        channel_queue = self._channel_queue(channel_id)
+        channel_queue.push(request)
+        if channel_queue.task is None or channel_queue.task.done():
+            channel_queue.task = asyncio.get_event_loop().create_task(
+                self._run(channel_queue))
+
+    async def _run(self, channel_queue):
+        """
+        Makes the requests of a channel queue, one at a time, as rate limits allow
+        If this task is cancelled (ex: on shutdown), the requests still queued are cancelled too,
+        so that their callers don't wait forever
+        """
+        loop = asyncio.get_event_loop()
+        request = None
+        try:
+            while channel_queue.heap:
+                _, _, request = channel_queue.heap[0]
+                if request.future.done():  # merged edit pushed twice, or cancelled by its caller
+                    heapq.heappop(channel_queue.heap)
+                    continue
+
+                # wait on the request at the head of the queue, a more urgent one may arrive
+                # meanwhile
+                delay = max(channel_queue.delay(request.kind), self.global_bucket.delay())
+                if delay:
+                    self.rate_limit_waits += 1
+                    await asyncio.sleep(delay)
+                    continue
+
+                heapq.heappop(channel_queue.heap)
+                if request.kind == 'edit':
+                    channel_queue.edits.pop(request.target.id, None)
+                self.global_bucket.take()
+                try:
+                    # this task was started by whichever caller came first, the call runs as a
+                    # task of its own in the context of the caller that made it
+                    result = await request.context.run(loop.create_task, request.call())
+                except Exception as error:  # pylint: disable=broad-except
+                    if not request.future.done():
+                        request.future.set_exception(error)
+                else:
+                    if not request.future.done():
+                        request.future.set_result(result)
+        finally:
+            waiting = [request] + [queued for _, _, queued in channel_queue.heap]
+            for queued in waiting:
+                if queued is not None and not queued.future.done():
+                    queued.future.cancel()
+            channel_queue.heap.clear()
+            channel_queue.edits.clear()
+
+
+# discord.py log messages reporting a rate limit (see RateLimitListener)
+BUCKET_EXHAUSTED_MESSAGE = 'A rate limit bucket has been exhausted'  # (bucket, seconds)
+RATE_LIMITED_MESSAGE = 'We are being rate limited'  # (seconds, bucket)
+
+
+class RateLimitListener(logging.Handler):
+    """
+    Passes the rate limits discord.py reports in its 'discord.http' log to an Outbox
+    discord.py reads them from the X-RateLimit-Remaining and X-RateLimit-Reset-After headers (a
+    bucket exhausted) or from 429 responses, and only reports them through that log (it doesn't
+    return the response headers). Bucket exhaustion is logged at debug level, so that logger
+    has to allow it. See supported()
+    """
+    def __init__(self, outbox):
+        super().__init__(logging.DEBUG)
+        self.outbox = outbox
+
+    @staticmethod
+    def supported():
+        """
+        True if the installed discord.py logs the messages this listener expects
+        Without them, per-channel rate limits are only enforced inside discord.py
+        """
+        try:
+            source = inspect.getsource(discord.http.HTTPClient.request)
+        except (OSError, TypeError):
+            return False
+        return f"'{BUCKET_EXHAUSTED_MESSAGE} (bucket: %s, retry: %s).'" in source and \
+            f"'{RATE_LIMITED_MESSAGE}. Retrying in %.2f seconds." in source
+
+    def emit(self, record):
+        if not isinstance(record.msg, str) or len(record.args or ()) != 2:
+            return
+        if record.msg.startswith(BUCKET_EXHAUSTED_MESSAGE):
+            bucket, seconds = record.args
+        elif record.msg.startswith(RATE_LIMITED_MESSAGE):
+            seconds, bucket = record.args
+        else:
+            return
+        if isinstance(bucket, str) and isinstance(seconds, (int, float)):
+            self.outbox.rate_limited(bucket, seconds)
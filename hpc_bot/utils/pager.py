@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Pages large results into embeds that fit discord's limits
+
+Rows are streamed in one at a time. Only the 'top' rows with the largest keys are kept, to be
+shown in embed pages, sorted. Every other row goes, as it is pushed out, to a gzip compressed
+text attachment, sorted the same way: rows are sorted OVERFLOW_RUN_ROWS at a time into
+compressed runs, merged when the attachment is built, so memory stays bounded whatever the
+number of rows.
+"""
+
+import gzip
+import heapq
+import itertools
+import pickle
+from dataclasses import dataclass
+from io import BytesIO
+
+
+TOP_ROWS = 50
+OVERFLOW_RUN_ROWS = 10000  # attachment rows sorted in memory at a time
+# discord embed limits
+EMBED_FIELDS = 25
+EMBED_CHARACTERS = 6000
+FIELD_NAME_CHARACTERS = 256
+FIELD_VALUE_CHARACTERS = 1024
+
+
+@dataclass
+class Pages:
+    """
+    Embed pages of a result, plus the rows that didn't fit in them (gzip compressed text)
+    """
+    embeds: list
+    attachment: bytes = None
+    attachment_name: str = None
+    attachment_rows: int = 0
+
+
+def embed_length(embed):
+    """
+    Number of characters counted by discord towards EMBED_CHARACTERS
+    """
+    length = len(embed.title or '') + len(embed.description or '')
+    length += len(embed.footer.text or '') if embed.footer else 0
+    return length + sum(len(field.name) + len(field.value) for field in embed.fields)
+
+
+def row_order(row):
+    """
+    Sort key of (key, sequence, name, value) rows: largest key first, ties in the order added
+    """
+    return -row[0], row[1]
+
+
+def read_run(run):
+    """
+    Rows of a compressed run, in order
+    """
+    with gzip.GzipFile(fileobj=BytesIO(run), mode='rb') as run_gzip:
+        while True:
+            try:
+                yield pickle.load(run_gzip)
+            except EOFError:
+                return
+
+
+class ResultPager:
+    """
+    Keeps the top rows of a result for embed pages, compressing the rest
+
+    Parameters
+    ----------
+    top: int
+        rows shown in embeds
+    attachment_name: str
+        file name of the attachment with the other rows (should end in .gz)
+    """
+    def __init__(self, top=TOP_ROWS, attachment_name='rows.txt.gz'):
+        self.top = top
+        self.attachment_name = attachment_name
+        self.rows = 0  # rows added
+        self.overflow = 0  # rows in the attachment
+        self._heap = []  # (key, sequence, name, value), smallest key first
+        self._sequence = itertools.count()
+        self._run = []  # attachment rows not in a compressed run yet
+        self._runs = []  # compressed runs of sorted attachment rows
+
+    def add(self, name, value, key):
+        """
+        Adds a row (an embed field name and value), ranked by key
+        """
+        self.rows += 1
+        row = (key, next(self._sequence), name[:FIELD_NAME_CHARACTERS],
+               value[:FIELD_VALUE_CHARACTERS])
+        if len(self._heap) < self.top:
+            heapq.heappush(self._heap, row)
+            return
+        if self._heap and row[0] > self._heap[0][0]:
+            row = heapq.heappushpop(self._heap, row)
+        self._write_overflow(row)
+
+    def _write_overflow(self, row):
+        self._run.append(row)
+        self.overflow += 1
+        if len(self._run) == OVERFLOW_RUN_ROWS:
+            run = BytesIO()
+            with gzip.GzipFile(fileobj=run, mode='wb') as run_gzip:
+                for sorted_row in sorted(self._run, key=row_order):
+                    pickle.dump(sorted_row, run_gzip)
+            self._runs.append(run.getvalue())
+            self._run = []
+
+    def _attachment(self):
+        """
+        Merges the attachment rows into gzip compressed text, None if there are none
+        """
+        if not self.overflow:
+            return None
+        runs = [read_run(run) for run in self._runs] + [sorted(self._run, key=row_order)]
+        buffer = BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode='wb') as attachment:
+            for _, _, name, value in heapq.merge(*runs, key=row_order):
+                attachment.write(f'{name}\t{value}\n'.encode())
+        self._run = []
+        self._runs = []
+        return buffer.getvalue()
+
+    def peek(self, count=EMBED_FIELDS):
+        """
+        The count rows with the largest keys added so far, as (name, value), largest first
+        """
+        return [(name, value) for _, _, name, value in
+                heapq.nlargest(count, self._heap, key=lambda row: (row[0], -row[1]))]
+
+    def pages(self, template, inline=True):
+        """
+        Builds the embed pages, largest keys first
+
+        Parameters
+        ----------
+        template: discord.Embed
+            copied for each page, its footer gets a page number when there are more pages
+        inline: bool
+            inline fields
+
+        Returns
+        -------
+        Pages
+        """
+        rows = sorted(self._heap, key=row_order)
+        footer = template.footer.text if template.footer and template.footer.text else ''
+        reserved = len(' • page 000/000')  # room left for the page number in the footer
+
+        embeds = []
+        embed = None
+        for _, _, name, value in rows:
+            if embed is None or len(embed.fields) == EMBED_FIELDS or \
+                    embed_length(embed) + len(name) + len(value) > EMBED_CHARACTERS - reserved:
+                embed = template.copy()
+                embeds.append(embed)
+            embed.add_field(name=name, value=value, inline=inline)
+        if not embeds:
+            embeds.append(template.copy())
+
+        if len(embeds) > 1:
+            for number, embed in enumerate(embeds, 1):
+                embed.set_footer(text=f'{footer} • page {number}/{len(embeds)}')
+
+        attachment = self._attachment()
+        return Pages(embeds, attachment, self.attachment_name if attachment else None,
+                     self.overflow)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Per-command latency spans
+
+Each command invocation gets its own dict of phase: seconds (stored in a context variable,
+so it follows the invocation into awaited coroutines and child tasks made with it).
+Code that spends time on a phase (ex: a discord API call) adds to it with span().
+loop.run_in_executor doesn't copy the context (python 3.8), so executor calls are timed by
+wrapping the await in the coroutine, not from inside the executor thread.
+"""
+
+import contextlib
+import contextvars
+import time
+from collections import deque
+import numpy
+
+
+PERF_SAMPLES = 500  # samples kept per command and phase
+PERF_PERCENTILES = (50, 95, 99)
+
+current_phases = contextvars.ContextVar('current_phases', default=None)
+
+
+def start_spans():
+    """
+    Starts recording phases for the current command invocation
+
+    Returns
+    -------
+    dict
+        phase: seconds, filled while the invocation runs
+    """
+    phases = {}
+    current_phases.set(phases)
+    return phases
+
+
+def add_span(phase, seconds):
+    """
+    Adds time spent on a phase to the current command invocation, if any
+    """
+    phases = current_phases.get()
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0) + seconds
+
+
+@contextlib.contextmanager
+def span(phase):
+    """
+    Times the enclosed block as time spent on phase
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_span(phase, time.perf_counter() - start)
+
+
+class LatencyRecorder:
+    """
+    Keeps the last PERF_SAMPLES durations of each (command, phase)
+
+    Parameters
+    ----------
+    size: int
+        samples kept per command and phase
+    """
+    def __init__(self, size=PERF_SAMPLES):
+        self.size = size
+        self._samples = {}  # (command, phase): deque of seconds
+
+    def record(self, command, phases):
+        """
+        Records the phases (phase: seconds) of a command invocation
+        """
+        for phase, seconds in phases.items():
+            samples = self._samples.get((command, phase))
+            if samples is None:
+                samples = self._samples[(command, phase)] = deque(maxlen=self.size)
+            samples.append(seconds)
+
+    def summary(self):
+        """
+        Percentiles of each command's phases
+
+        Returns
+        -------
+        dict
+            command: {phase: (number of samples, [p50, p95, p99])}
+        """
+        summary = {}
+        for (command, phase), samples in sorted(self._samples.items()):
+            percentiles = numpy.percentile(numpy.fromiter(samples, dtype=float, count=len(samples)),
+                                           PERF_PERCENTILES)
+            summary.setdefault(command, {})[phase] = (len(samples), percentiles.tolist())
+        return summary
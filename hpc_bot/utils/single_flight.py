@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Shares the result of a running coroutine between concurrent callers
+"""
+
+import asyncio
+import time
+from functools import partial
+
+
+RESULT_TTL = 10.0  # seconds
+
+
+class SingleFlight:
+    """
+    Runs at most one coroutine per key at a time
+    Callers that ask for a key that is already running wait for it and get the same result.
+    Results (other than None) are kept for 'ttl' seconds and returned to later callers.
+
+    Parameters
+    ----------
+    ttl: float
+        seconds a result is reused for. 0 disables caching
+    """
+    def __init__(self, ttl=RESULT_TTL):
+        self.ttl = ttl
+        self._in_flight = {}  # key: asyncio.Task
+        self._results = {}  # key: (monotonic timestamp, result)
+
+    async def run(self, key, coroutine_function, use_cache=True):
+        """
+        Returns the cached result for key, waits for the running coroutine for key or
+        starts coroutine_function() and waits for it
+
+        The coroutine keeps running if the caller that started it is cancelled,
+        so other callers still get its result.
+
+        Parameters
+        ----------
+        key: hashable
+            identifies the work being done
+        coroutine_function: function
+            called without arguments, returns a coroutine
+        use_cache: bool
+            if False, ignores cached results (but still joins a running coroutine)
+
+        Returns
+        -------
+        (object, bool)
+            result and True if it was shared (cached or started by another caller)
+        """
+        if use_cache:
+            cached = self._results.get(key)
+            if cached is not None and time.monotonic() - cached[0] < self.ttl:
+                return cached[1], True
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(coroutine_function())
+        self._in_flight[key] = task
+        task.add_done_callback(partial(self._finished, key))
+        return await asyncio.shield(task), False
+
+    def _finished(self, key, task):
+        """
+        Stops sharing the task and caches its result
+        """
+        del self._in_flight[key]
+        if not task.cancelled() and task.exception() is None and task.result() is not None:
+            self._results[key] = (time.monotonic(), task.result())
+
+    def invalidate(self, key):
+        """
+        Forgets the cached result for key
+        """
+        self._results.pop(key, None)
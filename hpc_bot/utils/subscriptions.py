@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Job completion subscriptions, persisted between restarts
+"""
+
+import json
+import logging
+import os
+import threading
+
+
+class JobSubscriptions:
+    """
+    Discord users to notify when a job, or any job of a SLURM user, finishes
+
+    Parameters
+    ----------
+    cache_file: os.PathLike
+        file where subscriptions (and the accounting cursor, with the jobs already reported
+        that ended at it) are persisted
+    """
+    def __init__(self, cache_file):
+        self.logger = logging.getLogger('hpc-bot.JobSubscriptions')
+        self.cache_file = cache_file
+        self.jobs = {}  # job id: set of discord user ids
+        self.users = {}  # SLURM user: set of discord user ids
+        # subscribed array job id: {state: number of its tasks that ended in that state}
+        self.arrays = {}
+        self.cursor = None  # accounting cursor when last saved
+        self.seen = set()  # ids of the jobs accounting already reported that ended at cursor
+        self._write_lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.jobs or self.users)
+
+    def load(self):
+        """
+        Loads subscriptions from cache_file, if it exists
+        """
+        try:
+            with open(self.cache_file) as cache:
+                data = json.load(cache)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as error:
+            self.logger.warning(f'Ignoring unreadable subscriptions "{self.cache_file}": {error}')
+            return
+
+        self.jobs = {job_id: set(subscribers) for job_id, subscribers in data['jobs'].items()}
+        self.users = {user: set(subscribers) for user, subscribers in data['users'].items()}
+        self.arrays = data.get('arrays', {})
+        self.cursor = data['cursor']
+        self.seen = set(data.get('seen', ()))
+
+    def dump(self):
+        """
+        Copy of the subscriptions, as written to cache_file
+        Taken where the subscriptions change (the event loop), so that write() can run elsewhere
+        """
+        return {
+            'jobs': {job_id: sorted(subscribers) for job_id, subscribers in self.jobs.items()},
+            'users': {user: sorted(subscribers) for user, subscribers in self.users.items()},
+            'arrays': {array_job_id: dict(states) for array_job_id, states in self.arrays.items()},
+            'cursor': self.cursor,
+            'seen': sorted(self.seen),
+        }
+
+    def write(self, data):
+        """
+        Atomically writes a dump() to cache_file. Concurrent writes are done one at a time
+        """
+        with self._write_lock:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            temporary_file = f'{self.cache_file}.tmp'
+            with open(temporary_file, 'w') as cache:
+                json.dump(data, cache)
+            os.replace(temporary_file, self.cache_file)
+
+    def save(self):
+        """
+        Atomically writes subscriptions to cache_file
+        """
+        self.write(self.dump())
+
+    def subscribe_job(self, job_id, subscriber):
+        """
+        Notify subscriber (discord user id) once, when job_id finishes
+        """
+        self.jobs.setdefault(job_id, set()).add(subscriber)
+
+    def subscribe_user(self, user, subscriber):
+        """
+        Notify subscriber (discord user id) whenever a job of SLURM user finishes
+        """
+        self.users.setdefault(user, set()).add(subscriber)
+
+    def unsubscribe(self, subscriber):
+        """
+        Cancels all subscriptions of subscriber
+
+        Returns
+        -------
+        int
+            number of subscriptions cancelled
+        """
+        cancelled = 0
+        for subscriptions in (self.jobs, self.users):
+            for key in list(subscriptions):
+                if subscriber in subscriptions[key]:
+                    subscriptions[key].discard(subscriber)
+                    cancelled += 1
+                    if not subscriptions[key]:
+                        del subscriptions[key]
+        return cancelled
+
+    def subscriptions_of(self, subscriber):
+        """
+        Subscriptions of subscriber
+
+        Returns
+        -------
+        (list, list)
+            job ids and SLURM users
+        """
+        return (sorted(job_id for job_id, subscribers in self.jobs.items()
+                       if subscriber in subscribers),
+                sorted(user for user, subscribers in self.users.items()
+                       if subscriber in subscribers))
+
+    def pop_subscribers(self, job):
+        """
+        Subscribers to notify about a finished job (probes.FinishedJob)
+        Subscriptions to that job are removed, subscriptions to its user are kept
+        Array tasks are only counted for the subscribers of their array job, who are notified
+        once every task ended (see pop_finished_arrays)
+
+        Returns
+        -------
+        set
+            discord user ids
+        """
+        subscribers = set(self.users.get(job.user, ()))
+        subscribers.update(self.jobs.pop(job.job_id, ()))
+        if job.base_job_id != job.job_id and job.base_job_id in self.jobs:
+            states = self.arrays.setdefault(job.base_job_id, {})
+            states[job.state] = states.get(job.state, 0) + 1
+        return subscribers
+
+    def pop_finished_arrays(self, queued_job_ids):
+        """
+        Removes the subscriptions to array jobs that have no task left in the queue
+
+        Parameters
+        ----------
+        queued_job_ids: set
+            array job ids (without task ids) of every job in the queue
+
+        Returns
+        -------
+        list of (str, dict, set)
+            array job id, {state: number of tasks} and discord user ids to notify
+        """
+        finished = []
+        for array_job_id in list(self.arrays):
+            if array_job_id not in queued_job_ids:
+                states = self.arrays.pop(array_job_id)
+                subscribers = self.jobs.pop(array_job_id, set())
+                if subscribers:
+                    finished.append((array_job_id, states, subscribers))
+        return finished
@@ -9,6 +9,7 @@ echo commands:
 echo upgrade-pip                    upgrades pip and setuptools to latest version
 echo install-dependencies           installs dependencies (including dev)
 echo lint                           check code style (lint)
+echo test                           runs unit tests
 goto:eof
 
 :upgrade-pip
@@ -19,5 +20,9 @@ python -m pip install -r requirements.txt -r requirements-dev.txt
 goto:eof
 
 :lint
-python -m pylint hpc_bot setup.py
+python -m pylint hpc_bot benchmarks tests setup.py
+goto:eof
+
+:test
+python -m unittest discover -s tests -t .
 goto:eof
@@ -70,7 +70,10 @@ setup(
     # project_urls={'Documentation': '<documentation_url>'},
     packages=['hpc_bot',
               'hpc_bot.cogs',
-              'hpc_bot.checks'],
+              'hpc_bot.checks',
+              'hpc_bot.federation',
+              'hpc_bot.probes',
+              'hpc_bot.utils'],
     install_requires=requirements,
     keywords='discord-bot discord-py hpc-bot',
     download_url='{0}/-/archive/{1}/hpc_bot-{1}.tar.gz'.format(hpc_bot.__url__,
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Home folder index tests
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from hpc_bot.probes import home_index
+
+
+def unreadable_home(*_):
+    """_list_directory stand-in: every home folder looks unreadable, as for a non-owner"""
+    return 0, [], False
+
+
+class HomeIndexDuTest(unittest.TestCase):
+    """
+    du runs on home folders the bot user can't read, only when they changed
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.directory.name, 'home')
+        os.makedirs(os.path.join(self.root, 'alice'))
+        self.index = home_index.HomeIndex(os.path.join(self.directory.name, 'index.json'),
+                                          root=self.root)
+        patches = (mock.patch.object(home_index.HomeIndex, '_list_directory',
+                                     staticmethod(unreadable_home)),
+                   mock.patch.object(home_index, 'privileged_usage', return_value=4096))
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(self.directory.cleanup)
+
+    def test_unchanged_home_reuses_du(self):
+        """a second scan with no changes doesn't run du"""
+        self.index.scan()
+        self.index.scan()
+        self.assertEqual(home_index.privileged_usage.call_count, 1)
+        self.assertEqual(self.index.usage, {'alice': 4096})
+        self.assertFalse(self.index.unreadable)
+
+    def test_changed_home_runs_du(self):
+        """du runs again when the home folder mtime changes"""
+        self.index.scan()
+        home = os.path.join(self.root, 'alice')
+        os.utime(home, ns=(0, os.lstat(home).st_mtime_ns + 1))
+        self.index.scan()
+        self.assertEqual(home_index.privileged_usage.call_count, 2)
+
+    def test_full_scan_runs_du(self):
+        """full scans run du again"""
+        self.index.scan()
+        self.index.scan(full=True)
+        self.assertEqual(home_index.privileged_usage.call_count, 2)
+
+    def test_du_gets_what_is_left_of_the_deadline(self):
+        """du can't take a whole deadline on top of the walk"""
+        self.index.deadline = 30
+        self.index.scan()
+        timeout = home_index.privileged_usage.call_args[0][2]
+        self.assertLessEqual(timeout, 30)
+        self.assertGreater(timeout, 0)
+
+    def test_du_usage_is_persisted(self):
+        """du totals survive a restart"""
+        self.index.scan()
+        self.index.save()
+        reloaded = home_index.HomeIndex(self.index.cache_file, root=self.root)
+        reloaded.load()
+        reloaded.scan()
+        self.assertEqual(home_index.privileged_usage.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Job accounting tests
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import types
+import unittest
+
+from hpc_bot import probes, utils
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       'benchmarks', 'fixtures', 'sacct.txt')
+BEFORE_FIXTURE = '2020-06-01T00:00:00'
+
+
+async def print_fixture(cmd, handle_line):
+    """probes.ShellWorkerPool.run stand-in: every command prints the sacct fixture"""
+    with open(FIXTURE) as fixture:
+        for line in fixture:
+            await handle_line(line.rstrip('\n'))
+    return 0, 0.0, ''
+
+
+def poll(accounting):
+    """polls accounting against the fixture"""
+    shell_workers = types.SimpleNamespace(run=print_fixture)
+    return asyncio.new_event_loop().run_until_complete(accounting.poll(shell_workers))
+
+
+class JobAccountingRestartTest(unittest.TestCase):
+    """
+    Jobs reported before a restart aren't reported again after it
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.cache_file = os.path.join(self.directory.name, 'job_subscriptions.json')
+
+    def test_restart_keeps_jobs_seen_at_cursor(self):
+        """sacct reports the jobs that ended at the cursor again, they're only reported once"""
+        accounting = probes.JobAccounting()
+        accounting.cursor = BEFORE_FIXTURE
+        self.assertEqual(len(poll(accounting)), 6)
+        self.assertEqual(poll(accounting), [])
+
+        subscriptions = utils.JobSubscriptions(self.cache_file)
+        subscriptions.cursor, subscriptions.seen = accounting.cursor, accounting.seen
+        subscriptions.save()
+
+        restored = utils.JobSubscriptions(self.cache_file)
+        restored.load()
+        restarted = probes.JobAccounting()
+        restarted.cursor, restarted.seen = restored.cursor, set(restored.seen)
+        self.assertEqual(poll(restarted), [])
+
+    def test_subscriptions_without_seen_jobs_load(self):
+        """files saved before jobs seen were persisted still load"""
+        with open(self.cache_file, 'w') as cache:
+            json.dump({'jobs': {}, 'users': {}, 'cursor': BEFORE_FIXTURE}, cache)
+
+        subscriptions = utils.JobSubscriptions(self.cache_file)
+        subscriptions.load()
+        self.assertEqual(subscriptions.seen, set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+# Copyright 2020 Pedro HC David (Kronopt), https://github.com/Kronopt
+# This file is part of hpc-bot.
+# hpc-bot is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# hpc-bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with hpc-bot. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Outbox tests
+"""
+
+import asyncio
+import json
+import logging
+import time
+import types
+import unittest
+from discord.http import HTTPClient, Route
+
+from hpc_bot import utils
+
+
+class FakeResponse:
+    """aiohttp response, as much of it as discord.py reads"""
+    def __init__(self, status, headers, data):
+        self.status = status
+        self.headers = {'content-type': 'application/json', **headers}
+        self.data = data
+
+    async def text(self, encoding=None):
+        """body"""
+        return json.dumps(self.data)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        return False
+
+
+def fake_session(responses):
+    """aiohttp session answering each request with the next of 'responses'"""
+    responses = list(responses)
+    return types.SimpleNamespace(request=lambda method, url, **kwargs: responses.pop(0))
+
+
+CHANNEL_ID = 123
+
+
+class RateLimitListenerTest(unittest.TestCase):
+    """
+    The outbox follows the rate limits discord.py reports, pinned against the installed version
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        asyncio.set_event_loop(self.loop)
+        self.outbox = utils.Outbox()
+        self.outbox._channel_queue(CHANNEL_ID)  # pylint: disable=protected-access
+        self.listener = utils.RateLimitListener(self.outbox)
+        http_logger = logging.getLogger('discord.http')
+        http_logger.addHandler(self.listener)
+        self.addCleanup(http_logger.removeHandler, self.listener)
+        level = http_logger.level
+        http_logger.setLevel(logging.DEBUG)
+        self.addCleanup(http_logger.setLevel, level)
+
+    def request(self, *responses):
+        """makes a send request to the channel through discord.py's HTTPClient"""
+        http = HTTPClient(loop=self.loop)
+        http._HTTPClient__session = fake_session(responses)  # pylint: disable=protected-access
+        route = Route('POST', '/channels/{channel_id}/messages', channel_id=CHANNEL_ID)
+        self.loop.run_until_complete(http.request(route))
+
+    def test_supported(self):
+        """the installed discord.py logs the expected messages"""
+        self.assertTrue(utils.RateLimitListener.supported())
+
+    def test_bucket_exhausted(self):
+        """X-RateLimit-Remaining: 0 holds the channel's sends until the reset"""
+        self.request(FakeResponse(200, {'X-Ratelimit-Remaining': '0',
+                                        'X-Ratelimit-Reset-After': '2.5'}, {}))
+        channel_queue = self.outbox.channels[CHANNEL_ID]
+        self.assertAlmostEqual(channel_queue.delay('send'), 2.5, places=1)
+        self.assertEqual(channel_queue.delay('edit'), 0)
+
+    def test_rate_limited(self):
+        """429 responses hold the channel's sends for retry_after"""
+        requested = time.monotonic()
+        self.request(FakeResponse(429, {'Via': 'proxy'}, {'retry_after': 10, 'global': False}),
+                     FakeResponse(200, {}, {}))
+        reset = self.outbox.channels[CHANNEL_ID].resets[utils.ROUTES['send']]
+        self.assertAlmostEqual(reset - requested, 0.01, places=1)
+
+
+class OutboxTest(unittest.TestCase):
+    """
+    Outbox queue handling
+    """
+    def test_cancelled_queue_cancels_requests(self):
+        """callers of requests still queued when the queue task is cancelled don't hang"""
+        async def scenario():
+            outbox = utils.Outbox()
+            started = asyncio.Event()
+
+            async def slow_send(*args, **kwargs):
+                """never returns"""
+                started.set()
+                await asyncio.sleep(3600)
+
+            channel = types.SimpleNamespace(id=CHANNEL_ID, send=slow_send)
+            sends = [asyncio.ensure_future(outbox.send(channel, 'message')) for _ in range(3)]
+            await started.wait()
+            outbox.channels[channel.id].task.cancel()
+            return await asyncio.wait_for(asyncio.gather(*sends, return_exceptions=True), 1)
+
+        results = asyncio.new_event_loop().run_until_complete(scenario())
+        self.assertTrue(all(isinstance(result, asyncio.CancelledError) for result in results))
+
+
+if __name__ == '__main__':
+    unittest.main()